@@ -22,28 +22,73 @@ from botbuilder.core import (
 from botbuilder.core.integration import aiohttp_error_middleware
 from botbuilder.integration.aiohttp import CloudAdapter, ConfigurationBotFrameworkAuthentication
 
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
 from dotenv import load_dotenv
 
 from dialogs import LoginDialog
 from bots import AssistantBot
 from services.bing import BingClient
 from services.graph import GraphClient
+from services.conversation_lock import ConversationLease, TurnSerializer
+from services.admission import AdmissionController
+from services.connector_pool import PooledBotFrameworkAuthentication
+from services.rate_limit import RateLimiter
+from services.sqlite_storage import SqliteStorage
+from services.loop_monitor import LoopMonitor
+from services.memory import MemoryProfiler
+from services.metrics import WorkerMetrics
+from services.answer_cache import AnswerCache
+from services.drain import WorkerDrain
+from services.janitor import ResourceJanitor
+from services.model_router import ModelRouter
+from services.thread_pool import ThreadPool
+from services.turn_queue import IdempotencyCache, TurnQueue
 from config import DefaultConfig
-from utils import create_or_update_agent
+from utils import agent_definition_hash, create_or_update_agent
 
+from routes.api.admin import admin_routes, answer_cache_routes
 from routes.api.messages import messages_routes
 from routes.api.directline import directline_routes
 from routes.api.files import file_routes
+from routes.api.metrics import metrics_routes
 from routes.static.static import static_routes
 
 load_dotenv()
 
-def create_app(adapter: CloudAdapter, bot: ActivityHandler, agents_client: AgentsOperations, secret_client: SecretClient) -> web.Application:
-    app = web.Application(middlewares=[aiohttp_error_middleware])
-    app.add_routes(messages_routes(adapter, bot))
+def create_app(adapter: CloudAdapter, bot: ActivityHandler, agents_client: AgentsOperations, secret_client: SecretClient, admission: AdmissionController = None, loop_monitor: LoopMonitor = None, memory_profiler: MemoryProfiler = None, turn_queue: TurnQueue = None, idempotency: IdempotencyCache = None, connector_pool: PooledBotFrameworkAuthentication = None, thread_pool: ThreadPool = None, janitor: ResourceJanitor = None, answer_cache: AnswerCache = None, drain: WorkerDrain = None, worker_metrics: WorkerMetrics = None) -> web.Application:
+    middlewares = [aiohttp_error_middleware]
+    if memory_profiler:
+        middlewares.append(memory_profiler.middleware)
+    app = web.Application(middlewares=middlewares)
+    if loop_monitor:
+        app.on_startup.append(loop_monitor.on_startup)
+        app.on_cleanup.append(loop_monitor.on_cleanup)
+    if memory_profiler:
+        app.on_startup.append(memory_profiler.on_startup)
+        app.on_cleanup.append(memory_profiler.on_cleanup)
+        app.add_routes(admin_routes(memory_profiler, os.getenv("ADMIN_API_KEY")))
+    if turn_queue:
+        app.on_startup.append(turn_queue.on_startup)
+        app.on_cleanup.append(turn_queue.on_cleanup)
+    if connector_pool:
+        app.on_cleanup.append(connector_pool.on_cleanup)
+    if thread_pool:
+        app.on_startup.append(thread_pool.on_startup)
+        app.on_cleanup.append(thread_pool.on_cleanup)
+    if janitor:
+        app.on_startup.append(janitor.on_startup)
+        app.on_cleanup.append(janitor.on_cleanup)
+    if drain:
+        app.on_shutdown.append(drain.on_shutdown)
+    if worker_metrics:
+        app.on_startup.append(worker_metrics.on_startup)
+        app.on_cleanup.append(worker_metrics.on_cleanup)
+    if answer_cache:
+        app.add_routes(answer_cache_routes(answer_cache, os.getenv("ADMIN_API_KEY")))
+    app.add_routes(messages_routes(adapter, bot, admission, turn_queue, idempotency, drain))
     app.add_routes(directline_routes(secret_client))
     app.add_routes(file_routes(agents_client))
+    app.add_routes(metrics_routes(os.getenv("ADMIN_API_KEY"), worker_metrics))
     app.add_routes(static_routes())
     return app
 
@@ -51,7 +96,9 @@ config = DefaultConfig()
 
 # Create adapter.
 # See https://aka.ms/about-bot-adapter to learn more about how bots work.
-adapter = CloudAdapter(ConfigurationBotFrameworkAuthentication(config))
+# Connector clients are shared by the turns, to keep connections to the channels alive
+connector_pool = PooledBotFrameworkAuthentication(ConfigurationBotFrameworkAuthentication(config))
+adapter = CloudAdapter(connector_pool)
 
 # Set up service authentication
 credential = DefaultAzureCredential(managed_identity_client_id=os.getenv("MicrosoftAppId"))
@@ -60,7 +107,10 @@ credential = DefaultAzureCredential(managed_identity_client_id=os.getenv("Micros
 secret_client = SecretClient(vault_url=os.getenv("AZURE_KEY_VAULT_ENDPOINT"), credential=credential)
 
 # Azure AI Services
-aoai_client = AzureOpenAI(
+# Async client, its connection pool is shared by the vision calls of all turns
+aoai_client = AsyncAzureOpenAI(
+    # Throttled calls are retried by the shared rate limiter
+    max_retries=0,
     api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
     azure_endpoint=os.getenv("AZURE_OPENAI_API_ENDPOINT"),
     api_key=os.getenv("AZURE_OPENAI_API_KEY"),
@@ -91,6 +141,9 @@ if os.getenv("AZURE_COSMOSDB_ENDPOINT"):
             credential=credential,
         )
     )
+elif os.getenv("STORAGE_SQLITE_PATH"):
+    # Shared by the workers of this host, and kept across worker recycles and restarts
+    storage = SqliteStorage.from_environment()
 else:
     storage = MemoryStorage()
 
@@ -98,9 +151,46 @@ else:
 user_state = UserState(storage)
 conversation_state = ConversationState(storage)
 
+# Order turns per conversation, across workers when the storage is shared
+turn_serializer = TurnSerializer()
+if not isinstance(storage, MemoryStorage):
+    turn_serializer = TurnSerializer(ConversationLease(storage, duration=float(os.getenv("CONVERSATION_LEASE_SECONDS", 120))))
+
 dialog = LoginDialog()
 
-assistant_id = create_or_update_agent(agents_client, os.getenv("AZURE_OPENAI_ASSISTANT_NAME"))
+# Bound the agent runs in flight on this worker and host
+admission = AdmissionController.from_environment()
+
+# Keep model and agent calls of every worker under the deployment quota
+rate_limiter = RateLimiter.from_environment()
+
+# Empty threads created ahead of time for new and cleared conversations
+thread_pool = ThreadPool.from_environment(agents_client)
+
+# Opt-in deletion of the threads, files and vector stores of idle conversations
+janitor = ResourceJanitor.from_environment(storage, agents_client) if os.getenv("JANITOR_ENABLED", "false").lower() == "true" else None
+
+assistant_id = create_or_update_agent(agents_client, os.getenv("AZURE_OPENAI_ASSISTANT_NAME"), bing_mode=os.getenv("BING_GROUNDING_MODE", "off"))
+
+# Simple turns run on a tool-less agent on a smaller deployment, when one is configured
+fast_agent_id = None
+if os.getenv("AZURE_OPENAI_FAST_DEPLOYMENT_NAME"):
+    fast_agent_id = create_or_update_agent(
+        agents_client,
+        f"{os.getenv('AZURE_OPENAI_ASSISTANT_NAME')}-fast",
+        model=os.getenv("AZURE_OPENAI_FAST_DEPLOYMENT_NAME"),
+        with_tools=False
+    )
+router = ModelRouter.from_environment(fast_agent_id)
+
+# Opt-in reuse of the answers to context-free questions, until the agent definition changes
+answer_cache = None
+if os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true":
+    answer_cache = AnswerCache.from_environment(
+        agent_definition_hash(agents_client, assistant_id, os.getenv("LLM_INSTRUCTIONS")),
+        # Invalidations reach the other workers through a shared storage
+        storage=None if isinstance(storage, MemoryStorage) else storage
+    )
 
 # Create the bot
 bot = AssistantBot(
@@ -110,9 +200,42 @@ bot = AssistantBot(
     assistant_id,
     bing_client, 
     graph_client, 
-    dialog
+    dialog,
+    turn_serializer,
+    admission,
+    rate_limiter,
+    thread_pool,
+    janitor,
+    router,
+    answer_cache
 )
-app = create_app(adapter, bot, agents_client, secret_client)
+# Report blocking calls that stall the event loop of this worker
+loop_monitor = LoopMonitor.from_environment() if os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true" else None
+
+# Opt-in memory profiling, tracemalloc slows down every allocation
+memory_profiler = MemoryProfiler.from_environment() if os.getenv("MEMORY_PROFILING_ENABLED", "false").lower() == "true" else None
+
+# Acknowledge messages at once and answer them from background tasks, instead of within the request
+turn_queue = TurnQueue.from_environment(adapter) if os.getenv("TURN_PROCESSING_MODE", "sync") == "async" else None
+
+# Skip activities the channel redelivers while their turn is queued, across workers when the storage is shared
+idempotency = None
+if turn_queue:
+    idempotency = IdempotencyCache(
+        ttl=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", 900)),
+        storage=None if isinstance(storage, MemoryStorage) else storage
+    )
+
+# Let the turns in flight finish when gunicorn stops or recycles this worker
+drain = WorkerDrain.from_environment(bot.run_registry, turn_queue)
+
+# Any worker answers /metrics with the metrics of all the workers of the host
+worker_metrics = WorkerMetrics.from_environment()
+
+app = create_app(adapter, bot, agents_client, secret_client, admission, loop_monitor, memory_profiler, turn_queue, idempotency, connector_pool, thread_pool, janitor, answer_cache, drain, worker_metrics)
+app.on_cleanup.append(lambda app: aoai_client.close())
+if isinstance(storage, SqliteStorage):
+    app.on_cleanup.append(storage.on_cleanup)
 
 if __name__ == "__main__":
     web.run_app(app, host="localhost", port=3978)
\ No newline at end of file
@@ -0,0 +1,135 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""Measures the CPU cost of /api/messages per activity type, with the fast parsing path and the msrest one.
+
+Requests go through the real route and CloudAdapter, without an app id so no
+token is checked, to a bot that does nothing. What is left is the per request
+overhead: decoding, Activity construction, TurnContext and pipeline. Results
+are in requests per second of one core, from process time.
+
+Run from the src folder:
+    python -m benchmarks.activity_parsing
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+from aiohttp.test_utils import make_mocked_request
+from botbuilder.core import ActivityHandler
+from botbuilder.integration.aiohttp import CloudAdapter, ConfigurationBotFrameworkAuthentication
+from botbuilder.schema import Activity
+
+from config import DefaultConfig
+from routes.api import messages
+from services.connector_pool import PooledBotFrameworkAuthentication
+
+CONVERSATION = {"id": "a:1Xq9L_7zR3vT0pN8mK2wY6hJ4fD5sG1cB9nM3xZ7qW2eR8tY6uI0oP4aS5dF3gH1jK7lZ9xC2vB6nM8", "conversationType": "personal", "tenantId": "72f988bf-86f1-41af-91ab-2d7cd011db47"}
+USER = {"id": "29:1aBcDeFgHiJkLmNoPqRsTuVwXyZ0123456789-aBcDeFgHiJkLmNoPqRsTuVwXyZ", "name": "Megan Bowen", "aadObjectId": "6de1fe2f-8e6c-4b1a-9f8c-5c4a1f0b8e3d"}
+BOT = {"id": "28:2f1a2c1e-7c3b-4d7a-9a6d-0c8e3b1f5d2a", "name": "Travel Agent"}
+COMMON = {
+    "serviceUrl": "https://smba.trafficmanager.net/emea/",
+    "channelId": "msteams",
+    "from": USER,
+    "conversation": CONVERSATION,
+    "recipient": BOT,
+    "channelData": {"tenant": {"id": CONVERSATION["tenantId"]}},
+}
+
+BODIES = {
+    "message": {
+        **COMMON,
+        "type": "message",
+        "id": "1714557600123",
+        "timestamp": "2024-05-01T10:00:00.123Z",
+        "localTimestamp": "2024-05-01T12:00:00.123+02:00",
+        "locale": "en-US",
+        "textFormat": "plain",
+        "text": "<at>Travel Agent</at> Can you find me a hotel near the Pantheon for two nights?",
+        "attachments": [{"contentType": "text/html", "content": "<p>Can you find me a hotel near the Pantheon for two nights?</p>"}],
+        "entities": [
+            {"type": "mention", "text": "<at>Travel Agent</at>", "mentioned": BOT},
+            {"type": "clientInfo", "locale": "en-US", "country": "US", "platform": "Web", "timezone": "Europe/Rome"},
+        ],
+    },
+    "typing": {**COMMON, "type": "typing", "id": "1714557600001", "timestamp": "2024-05-01T10:00:00.001Z"},
+    "conversationUpdate/membersAdded": {**COMMON, "type": "conversationUpdate", "id": "f:1", "membersAdded": [USER]},
+    "conversationUpdate/topicName": {**COMMON, "type": "conversationUpdate", "id": "f:2", "topicName": "Trip to Rome"},
+}
+
+
+class Payload:
+    """The request body, as the request stream that aiohttp reads."""
+
+    def __init__(self, data: bytes):
+        self.chunks = [data, b""]
+
+    async def readany(self) -> bytes:
+        return self.chunks.pop(0)
+
+
+@contextmanager
+def msrest_parsing():
+    """Routes requests through json and the msrest deserializer, without the early acknowledgement."""
+    patched = {
+        "loads": json.loads,
+        "is_ignorable": lambda body: False,
+        "parse_activity": lambda body: Activity().deserialize(body),
+    }
+    originals = {name: getattr(messages, name) for name in patched}
+    for name, function in patched.items():
+        setattr(messages, name, function)
+    try:
+        yield
+    finally:
+        for name, function in originals.items():
+            setattr(messages, name, function)
+
+
+def create_handler():
+    adapter = CloudAdapter(PooledBotFrameworkAuthentication(ConfigurationBotFrameworkAuthentication(DefaultConfig())))
+    return messages.messages_routes(adapter, ActivityHandler())[0].handler
+
+
+async def requests_per_core(handler, body: dict, count: int) -> float:
+    data = json.dumps(body).encode()
+    requests = [
+        make_mocked_request("POST", "/api/messages", headers={"Content-Type": "application/json"}, payload=Payload(data))
+        for _ in range(count)
+    ]
+    start = time.process_time()
+    for request in requests:
+        response = await handler(request)
+        assert response.status < 300, response.status
+    return count / (time.process_time() - start)
+
+
+async def main(args) -> int:
+    handler = create_handler()
+    # Warm up the attribute caches of both paths
+    for body in BODIES.values():
+        await requests_per_core(handler, body, 10)
+        with msrest_parsing():
+            await requests_per_core(handler, body, 10)
+
+    print(f"{'activity':<34} {'msrest req/s':>13} {'fast req/s':>11} {'speedup':>8}")
+    for name, body in BODIES.items():
+        with msrest_parsing():
+            before = await requests_per_core(handler, body, args.requests)
+        after = await requests_per_core(handler, body, args.requests)
+        print(f"{name:<34} {before:>13.0f} {after:>11.0f} {after / before:>7.1f}x")
+    return 0
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500, help="requests per activity type and path")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_arguments())))
@@ -0,0 +1,238 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""Timed, network-free stand-ins for the agent service, the chat client and Bing, used by the load tests.
+
+Unlike the fakes in tests/conftest.py, these take the time a real service
+would: runs wait for the first token, stream tokens at a configurable rate,
+and randomly stop for tool calls or fail.
+"""
+
+import asyncio
+import itertools
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from azure.core.exceptions import ResourceNotFoundError
+
+WORDS = "Day one arrive in Rome check in near Piazza Navona then walk to the Pantheon and the Trevi Fountain before dinner in Trastevere".split()
+
+
+class RuntimeProfile:
+    """Latencies and behavior of the simulated services."""
+
+    def __init__(
+            self,
+            first_token_latency: float = 0.8,
+            tokens_per_second: float = 60,
+            answer_tokens: int = 150,
+            tool_call_rate: float = 0.2,
+            tool_latency: float = 0.5,
+            failure_rate: float = 0.01,
+            chat_latency: float = 1.5,
+            seed: int = None
+        ):
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.tool_call_rate = tool_call_rate
+        self.tool_latency = tool_latency
+        self.failure_rate = failure_rate
+        self.chat_latency = chat_latency
+        self.seed = seed
+
+    @staticmethod
+    def from_environment():
+        seed = os.getenv("FAKE_RUNTIME_SEED")
+        return RuntimeProfile(
+            first_token_latency=float(os.getenv("FAKE_RUNTIME_FIRST_TOKEN_LATENCY", 0.8)),
+            tokens_per_second=float(os.getenv("FAKE_RUNTIME_TOKENS_PER_SECOND", 60)),
+            answer_tokens=int(os.getenv("FAKE_RUNTIME_ANSWER_TOKENS", 150)),
+            tool_call_rate=float(os.getenv("FAKE_RUNTIME_TOOL_CALL_RATE", 0.2)),
+            tool_latency=float(os.getenv("FAKE_RUNTIME_TOOL_LATENCY", 0.5)),
+            failure_rate=float(os.getenv("FAKE_RUNTIME_FAILURE_RATE", 0.01)),
+            chat_latency=float(os.getenv("FAKE_RUNTIME_CHAT_LATENCY", 1.5)),
+            seed=int(seed) if seed else None,
+        )
+
+    def environment(self) -> dict:
+        """The environment variables that recreate this profile in another process."""
+        environment = {
+            "FAKE_RUNTIME_FIRST_TOKEN_LATENCY": str(self.first_token_latency),
+            "FAKE_RUNTIME_TOKENS_PER_SECOND": str(self.tokens_per_second),
+            "FAKE_RUNTIME_ANSWER_TOKENS": str(self.answer_tokens),
+            "FAKE_RUNTIME_TOOL_CALL_RATE": str(self.tool_call_rate),
+            "FAKE_RUNTIME_TOOL_LATENCY": str(self.tool_latency),
+            "FAKE_RUNTIME_FAILURE_RATE": str(self.failure_rate),
+            "FAKE_RUNTIME_CHAT_LATENCY": str(self.chat_latency),
+        }
+        if self.seed is not None:
+            environment["FAKE_RUNTIME_SEED"] = str(self.seed)
+        return environment
+
+
+class FakeAgentRuntime:
+    """A stand-in for AgentsOperations, streaming synthetic run events like the service does."""
+
+    def __init__(self, profile: RuntimeProfile = None):
+        self.profile = profile or RuntimeProfile()
+        self.random = random.Random(self.profile.seed)
+        self.ids = itertools.count(1)
+        self.cancelled = set()
+        self.lock = threading.Lock()
+        # Live resources: vector stores of each thread, and files
+        self.threads = {}
+        self.files = set()
+        self.vector_stores = set()
+
+    def create_thread(self, **kwargs):
+        thread_id = f"thread_{next(self.ids)}"
+        with self.lock:
+            self.threads[thread_id] = []
+        return SimpleNamespace(id=thread_id)
+
+    def get_thread(self, thread_id: str):
+        with self.lock:
+            if thread_id not in self.threads:
+                raise ResourceNotFoundError(f"No thread found with id '{thread_id}'.")
+            vector_store_ids = list(self.threads[thread_id])
+        return SimpleNamespace(id=thread_id, tool_resources=SimpleNamespace(file_search=SimpleNamespace(vector_store_ids=vector_store_ids)))
+
+    def delete_thread(self, thread_id: str):
+        with self.lock:
+            if self.threads.pop(thread_id, None) is None:
+                raise ResourceNotFoundError(f"No thread found with id '{thread_id}'.")
+        return SimpleNamespace(id=thread_id, deleted=True)
+
+    def upload_file(self, file=None, purpose: str = None, **kwargs):
+        file_id = f"assistant-{next(self.ids)}"
+        with self.lock:
+            self.files.add(file_id)
+        return SimpleNamespace(id=file_id, purpose=purpose)
+
+    def delete_file(self, file_id: str):
+        with self.lock:
+            if file_id not in self.files:
+                raise ResourceNotFoundError(f"No file found with id '{file_id}'.")
+            self.files.remove(file_id)
+        return SimpleNamespace(id=file_id, deleted=True)
+
+    def delete_vector_store(self, vector_store_id: str):
+        with self.lock:
+            if vector_store_id not in self.vector_stores:
+                raise ResourceNotFoundError(f"No vector store found with id '{vector_store_id}'.")
+            self.vector_stores.remove(vector_store_id)
+        return SimpleNamespace(id=vector_store_id, deleted=True)
+
+    def create_message(self, thread_id: str, role: str, content: str, attachments: list = None, **kwargs):
+        # Like the service, file search attachments give the thread a vector store
+        if any(tool["type"] == "file_search" for attachment in attachments or [] for tool in attachment["tools"]):
+            with self.lock:
+                if thread_id in self.threads and not self.threads[thread_id]:
+                    vector_store_id = f"vs_{next(self.ids)}"
+                    self.threads[thread_id].append(vector_store_id)
+                    self.vector_stores.add(vector_store_id)
+        return SimpleNamespace(id=f"msg_{next(self.ids)}", thread_id=thread_id, role=role)
+
+    def create_stream(self, thread_id: str, assistant_id: str, **kwargs):
+        return self.__run_events(f"run_{next(self.ids)}", allow_tool_call=True)
+
+    def submit_tool_outputs_to_stream(self, thread_id: str, run_id: str, tool_outputs: list):
+        return self.__run_events(run_id, allow_tool_call=False, created=False)
+
+    def cancel_run(self, thread_id: str, run_id: str):
+        with self.lock:
+            self.cancelled.add(run_id)
+        return SimpleNamespace(id=run_id, status="cancelling")
+
+    def get_run(self, thread_id: str, run_id: str):
+        return SimpleNamespace(id=run_id, status="cancelled" if run_id in self.cancelled else "completed")
+
+    def __draw(self, rate: float) -> bool:
+        with self.lock:
+            return self.random.random() < rate
+
+    def __run_events(self, run_id: str, allow_tool_call: bool, created: bool = True):
+        profile = self.profile
+        if created:
+            yield ("thread.run.created", SimpleNamespace(id=run_id))
+        time.sleep(profile.first_token_latency)
+        if allow_tool_call and self.__draw(profile.tool_call_rate):
+            function = SimpleNamespace(name="bing_query", arguments='{"query": "hotels in Rome", "type": "web"}')
+            tool_call = SimpleNamespace(id=f"call_{run_id}", type="function", function=function)
+            action = SimpleNamespace(submit_tool_outputs=SimpleNamespace(tool_calls=[tool_call]))
+            yield ("thread.run.requires_action", SimpleNamespace(id=run_id, required_action=action))
+            return
+        fails = self.__draw(profile.failure_rate)
+        tokens = profile.answer_tokens // 2 if fails else profile.answer_tokens
+        for i in range(tokens):
+            if run_id in self.cancelled:
+                yield ("thread.run.cancelled", SimpleNamespace(id=run_id))
+                return
+            text = SimpleNamespace(value=WORDS[i % len(WORDS)] + " ")
+            block = SimpleNamespace(type="text", text=text)
+            yield ("thread.message.delta", SimpleNamespace(delta=SimpleNamespace(content=[block])))
+            if profile.tokens_per_second > 0:
+                time.sleep(1 / profile.tokens_per_second)
+        if fails:
+            error = SimpleNamespace(code="server_error", message="Sorry, something went wrong.")
+            yield ("thread.run.failed", SimpleNamespace(id=run_id, last_error=error))
+            return
+        yield ("thread.run.completed", SimpleNamespace(id=run_id, usage=SimpleNamespace(total_tokens=tokens + 500)))
+
+
+class FakeChatClient:
+    """A stand-in for the AsyncAzureOpenAI client, streaming chat completions after chat_latency."""
+
+    def __init__(self, profile: RuntimeProfile = None):
+        self.profile = profile or RuntimeProfile()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model: str, messages: list, stream: bool = False, max_tokens: int = None, stream_options: dict = None, **kwargs):
+        await asyncio.sleep(self.profile.chat_latency)
+        words = "The image shows the Colosseum at sunset.".split(" ")[:max_tokens]
+        if not stream:
+            message = SimpleNamespace(role="assistant", content=" ".join(words))
+            return SimpleNamespace(
+                choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")],
+                usage=SimpleNamespace(prompt_tokens=900, completion_tokens=len(words), total_tokens=900 + len(words)),
+            )
+        return FakeChatStream(self.profile, words, include_usage=bool((stream_options or {}).get("include_usage")))
+
+
+class FakeChatStream:
+    """Chat completion chunks, one word each, at tokens_per_second, then a chunk with the usage if requested."""
+
+    def __init__(self, profile: RuntimeProfile, words: list, include_usage: bool = False):
+        self.profile = profile
+        self.words = words
+        self.include_usage = include_usage
+        self.closed = False
+
+    async def __aiter__(self):
+        for i, word in enumerate(self.words):
+            if self.closed:
+                return
+            content = word if i == 0 else " " + word
+            yield SimpleNamespace(choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=content), finish_reason=None)], usage=None)
+            if self.profile.tokens_per_second > 0:
+                await asyncio.sleep(1 / self.profile.tokens_per_second)
+        if self.include_usage:
+            yield SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=900, completion_tokens=len(self.words), total_tokens=900 + len(self.words)))
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeBingClient:
+    """A stand-in for BingClient, answering queries after tool_latency."""
+
+    def __init__(self, profile: RuntimeProfile = None):
+        self.profile = profile or RuntimeProfile()
+
+    def query(self, query: str, type: str):
+        time.sleep(self.profile.tool_latency)
+        return '[{"name": "Hotel Raphael", "url": "https://example.com/raphael", "snippet": "Near Piazza Navona."}]'
@@ -0,0 +1,73 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""The bot app wired to the simulated services of benchmarks.fake_runtime, for load tests.
+
+Serve it with: gunicorn benchmarks.load_app:app -c gunicorn.conf.py
+Replies go to the serviceUrl of each activity, see benchmarks.load_test.
+"""
+
+import os
+
+from aiohttp import web
+from botbuilder.core import ConversationState, MemoryStorage, UserState
+from botbuilder.core.integration import aiohttp_error_middleware
+from botbuilder.integration.aiohttp import CloudAdapter, ConfigurationBotFrameworkAuthentication
+
+from bots import AssistantBot
+from config import DefaultConfig
+from dialogs import LoginDialog
+from routes.api.messages import messages_routes
+from routes.api.metrics import metrics_routes
+from services.admission import AdmissionController
+from services.connector_pool import PooledBotFrameworkAuthentication
+from services.conversation_lock import TurnSerializer
+from services.loop_monitor import LoopMonitor
+from services.rate_limit import RateLimiter
+from services.thread_pool import ThreadPool
+from services.turn_queue import IdempotencyCache, TurnQueue
+from benchmarks.fake_runtime import FakeAgentRuntime, FakeBingClient, FakeChatClient, RuntimeProfile
+
+
+def create_load_test_app() -> web.Application:
+    profile = RuntimeProfile.from_environment()
+    storage = MemoryStorage()
+    admission = AdmissionController.from_environment()
+    agents_client = FakeAgentRuntime(profile)
+    thread_pool = ThreadPool.from_environment(agents_client)
+    bot = AssistantBot(
+        ConversationState(storage),
+        UserState(storage),
+        FakeChatClient(profile),
+        agents_client,
+        "asst_load_test",
+        FakeBingClient(profile),
+        None,
+        LoginDialog(),
+        TurnSerializer(),
+        admission,
+        RateLimiter.from_environment(),
+        thread_pool
+    )
+    bot.streaming = os.getenv("AZURE_OPENAI_STREAMING", "false").lower() == "true"
+    # Without an app id the adapter neither checks incoming tokens nor authenticates replies
+    connector_pool = PooledBotFrameworkAuthentication(ConfigurationBotFrameworkAuthentication(DefaultConfig()))
+    adapter = CloudAdapter(connector_pool)
+    loop_monitor = LoopMonitor.from_environment()
+    turn_queue = TurnQueue.from_environment(adapter) if os.getenv("TURN_PROCESSING_MODE", "sync") == "async" else None
+
+    app = web.Application(middlewares=[aiohttp_error_middleware])
+    app.on_startup.append(loop_monitor.on_startup)
+    app.on_cleanup.append(loop_monitor.on_cleanup)
+    app.on_cleanup.append(connector_pool.on_cleanup)
+    app.on_startup.append(thread_pool.on_startup)
+    app.on_cleanup.append(thread_pool.on_cleanup)
+    if turn_queue:
+        app.on_startup.append(turn_queue.on_startup)
+        app.on_cleanup.append(turn_queue.on_cleanup)
+    app.add_routes(messages_routes(adapter, bot, admission, turn_queue, IdempotencyCache() if turn_queue else None))
+    app.add_routes(metrics_routes(os.getenv("ADMIN_API_KEY")))
+    return app
+
+
+app = create_load_test_app()
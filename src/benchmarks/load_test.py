@@ -0,0 +1,240 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""Load-tests the bot on this machine, without network access.
+
+Starts the app of benchmarks.load_app under gunicorn, and a fake channel
+service that receives the replies of the bot. Virtual users then post
+message activities to /api/messages, each in its own conversation, and the
+driver reports throughput, turn latency and time to first token.
+
+Run from the src folder: python -m benchmarks.load_test --users 50 --turns 10 --workers 2
+Use --url to target a bot that is already running.
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.fake_runtime import RuntimeProfile
+
+SRC_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeChannel:
+    """Receives the activities the bot sends, and records when the first token of each turn arrived."""
+
+    def __init__(self):
+        self.turn_started = {}
+        self.first_token = {}
+        self.answered = {}
+        self.activities = 0
+
+    def start_turn(self, conversation_id: str):
+        self.turn_started[conversation_id] = time.perf_counter()
+        self.first_token.pop(conversation_id, None)
+        self.answered[conversation_id] = asyncio.Event()
+
+    async def wait_for_answer(self, conversation_id: str, timeout: float = 600) -> float:
+        """Waits for the final message of a turn answered in the background, and returns when it arrived."""
+        await asyncio.wait_for(self.answered[conversation_id].wait(), timeout)
+        return time.perf_counter()
+
+    def time_to_first_token(self, conversation_id: str) -> float:
+        if conversation_id not in self.first_token:
+            return None
+        return self.first_token[conversation_id] - self.turn_started[conversation_id]
+
+    async def on_activity(self, req: web.Request) -> web.Response:
+        activity = await req.json()
+        conversation_id = req.match_info["conversation_id"]
+        self.activities += 1
+        # The first streamed chunk, or the answer itself when the bot does not stream
+        is_token = activity.get("type") == "message" or (activity.get("type") == "typing" and activity.get("text") not in [None, "Typing..."])
+        if is_token and conversation_id not in self.first_token:
+            self.first_token[conversation_id] = time.perf_counter()
+        if activity.get("type") == "message" and conversation_id in self.answered:
+            self.answered[conversation_id].set()
+        return web.json_response({"id": activity.get("id") or uuid.uuid4().hex})
+
+    def routes(self):
+        return [
+            web.post("/v3/conversations/{conversation_id}/activities", self.on_activity),
+            web.post("/v3/conversations/{conversation_id}/activities/{activity_id}", self.on_activity),
+            web.put("/v3/conversations/{conversation_id}/activities/{activity_id}", self.on_activity),
+        ]
+
+
+class Results:
+    def __init__(self):
+        self.latencies = []
+        self.first_tokens = []
+        self.statuses = {}
+        self.errors = 0
+
+    def report(self, duration: float):
+        turns = len(self.latencies)
+        print(f"turns:           {turns} in {duration:.1f}s, {turns / duration:.1f} turns/s")
+        print(f"statuses:        {', '.join(f'{status}: {count}' for status, count in sorted(self.statuses.items()))}, errors: {self.errors}")
+        for name, values in [("latency", self.latencies), ("first token", self.first_tokens)]:
+            if not values:
+                continue
+            print(f"{name + ' ms:':<16} p50 {percentile(values, 50) * 1000:>7.0f}  p95 {percentile(values, 95) * 1000:>7.0f}  p99 {percentile(values, 99) * 1000:>7.0f}  max {max(values) * 1000:>7.0f}")
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def message(text: str, conversation_id: str, user_id: str, service_url: str) -> dict:
+    return {
+        "type": "message",
+        "id": uuid.uuid4().hex,
+        "text": text,
+        "channelId": "directline",
+        "serviceUrl": service_url,
+        "conversation": {"id": conversation_id},
+        "from": {"id": user_id, "role": "user"},
+        "recipient": {"id": "bot", "role": "bot"},
+    }
+
+
+async def virtual_user(session: aiohttp.ClientSession, url: str, service_url: str, channel: FakeChannel, results: Results, user: int, turns: int, think_time: float):
+    conversation_id = f"load_{user}_{uuid.uuid4().hex[:8]}"
+    for turn in range(turns):
+        channel.start_turn(conversation_id)
+        start = time.perf_counter()
+        try:
+            async with session.post(f"{url}/api/messages", json=message(f"Plan day {turn + 1} of my trip to Rome", conversation_id, f"user_{user}", service_url)) as resp:
+                await resp.read()
+                results.statuses[resp.status] = results.statuses.get(resp.status, 0) + 1
+            # Acknowledged turns are answered in the background, they end with the final message
+            end = await channel.wait_for_answer(conversation_id) if resp.status == 202 else time.perf_counter()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            results.errors += 1
+            continue
+        results.latencies.append(end - start)
+        first_token = channel.time_to_first_token(conversation_id)
+        if first_token is not None:
+            results.first_tokens.append(first_token)
+        if think_time:
+            await asyncio.sleep(think_time)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(port: int, workers: int, environment: dict) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "gunicorn", "benchmarks.load_app:app",
+        "-c", "gunicorn.conf.py",
+        "--workers", str(workers),
+        "--bind", f"127.0.0.1:{port}",
+        "--log-level", "warning",
+    ]
+    return subprocess.Popen(command, cwd=SRC_DIRECTORY, env={**os.environ, **environment})
+
+
+async def wait_until_ready(session: aiohttp.ClientSession, url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            # Any answer will do, /metrics needs the admin key
+            async with session.get(f"{url}/metrics") as resp:
+                if resp.status < 500:
+                    return
+        except aiohttp.ClientError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"The bot did not start at {url}")
+        await asyncio.sleep(0.25)
+
+
+async def main(args):
+    channel = FakeChannel()
+    channel_app = web.Application()
+    channel_app.add_routes(channel.routes())
+    runner = web.AppRunner(channel_app, access_log=None)
+    await runner.setup()
+    channel_port = free_port()
+    await web.TCPSite(runner, "127.0.0.1", channel_port).start()
+    service_url = f"http://127.0.0.1:{channel_port}"
+
+    server = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        profile = RuntimeProfile(
+            first_token_latency=args.first_token_latency,
+            tokens_per_second=args.tokens_per_second,
+            answer_tokens=args.answer_tokens,
+            tool_call_rate=args.tool_call_rate,
+            tool_latency=args.tool_latency,
+            failure_rate=args.failure_rate,
+        )
+        environment = {
+            **profile.environment(),
+            "AZURE_OPENAI_STREAMING": "true" if args.streaming else "false",
+            "TURN_PROCESSING_MODE": "async" if args.background else "sync",
+            # The simulated services have no quota to protect
+            "AZURE_OPENAI_TOKENS_PER_MINUTE": "0",
+            "AZURE_OPENAI_REQUESTS_PER_MINUTE": "0",
+            "MicrosoftAppId": "",
+            "MicrosoftAppPassword": "",
+        }
+        server = start_gunicorn(port, args.workers, environment)
+        url = f"http://127.0.0.1:{port}"
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=600)
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await wait_until_ready(session, url)
+            results = Results()
+            start = time.perf_counter()
+            await asyncio.gather(*[
+                virtual_user(session, url, service_url, channel, results, user, args.turns, args.think_time)
+                for user in range(args.users)
+            ])
+            results.report(time.perf_counter() - start)
+            print(f"activities:      {channel.activities} received by the channel")
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        await runner.cleanup()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="bot to test, instead of starting one under gunicorn")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--users", type=int, default=20, help="concurrent conversations")
+    parser.add_argument("--turns", type=int, default=5, help="turns per conversation")
+    parser.add_argument("--think-time", type=float, default=0, help="seconds between the turns of a user")
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--background", action="store_true", help="acknowledge turns with 202 and answer them in the background")
+    parser.add_argument("--first-token-latency", type=float, default=0.8)
+    parser.add_argument("--tokens-per-second", type=float, default=60)
+    parser.add_argument("--answer-tokens", type=int, default=150)
+    parser.add_argument("--tool-call-rate", type=float, default=0.2)
+    parser.add_argument("--tool-latency", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.01)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_arguments()))
@@ -0,0 +1,167 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""Micro-benchmarks of the local hot paths: key escaping, state serialization, history and mime types.
+
+Each case reports the best time per call over several timed repeats, and is
+compared to benchmarks/baselines/micro.json. Baselines depend on the machine,
+record them on the machine that checks them.
+
+Run from the src folder:
+    python -m benchmarks.micro
+    python -m benchmarks.micro --filter sanitize_key --update-baseline
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+from jsonpickle.pickler import Pickler
+from jsonpickle.unpickler import Unpickler
+
+from data_models import Attachment, ConversationData, mime_type
+from services.cosmos import CosmosDbKeyEscape
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "micro.json")
+
+CASES = {}
+
+
+def case(name: str):
+    """Registers a benchmark. The decorated function sets up and returns the callable to time."""
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+# Storage keys as built by ConversationState and UserState, for Direct Line and Teams conversation ids
+DIRECTLINE_KEY = "directline/conversations/8Zk3xVqL2mN7pR4tY9wB1c-us"
+TEAMS_KEY = "msteams/conversations/a:1Xq9L_7zR3vT0pN8mK2wY6hJ4fD5sG1cB9nM3xZ7qW2eR8tY6uI0oP4aS5dF3gH1jK7lZ9xC2vB6nM8qW4eR0tY2uI6oP8aS0dF4gH6jK8lZ0xC4vB8nM0qW6eR2tY4uI8oP0aS2dF6gH8jK0lZ2xC6vB0nM2"
+USER_KEY = "msteams/users/29:1aBcDeFgHiJkLmNoPqRsTuVwXyZ0123456789-aBcDeFgHiJkLmNoPqRsTuVwXyZ0123456789AbCdEfGh"
+# Keys past 255 characters are truncated and hashed in compatibility mode
+LONG_KEY = TEAMS_KEY + "/" + "conversation#thread?id=" + "x" * 120
+
+
+def conversation_data(turns: int, max_turns: int = 20) -> ConversationData:
+    data = ConversationData([], max_turns=max_turns, thread_id="thread_8Zk3xVqL2mN7pR4tY9wB1c")
+    for i in range(turns):
+        data.add_turn("user", f"Can you find me a hotel near the Pantheon for night {i}? Something quiet, under 200 euros.")
+        data.add_turn("assistant", "Here are three options near the Pantheon: " + "Hotel Raphael, a quiet hotel with a rooftop terrace and views over the old town. " * 6)
+    data.attachments = [Attachment("itinerary.pdf", "application/pdf", "https://example.com/files/itinerary.pdf")]
+    return data
+
+
+@case("sanitize_key/directline")
+def sanitize_directline():
+    return lambda: CosmosDbKeyEscape.sanitize_key(DIRECTLINE_KEY)
+
+
+@case("sanitize_key/teams")
+def sanitize_teams():
+    return lambda: CosmosDbKeyEscape.sanitize_key(TEAMS_KEY)
+
+
+@case("sanitize_key/user")
+def sanitize_user():
+    return lambda: CosmosDbKeyEscape.sanitize_key(USER_KEY)
+
+
+@case("sanitize_key/truncated")
+def sanitize_truncated():
+    return lambda: CosmosDbKeyEscape.sanitize_key(LONG_KEY)
+
+
+@case("truncate_key/long")
+def truncate_long():
+    return lambda: CosmosDbKeyEscape.truncate_key(LONG_KEY)
+
+
+@case("jsonpickle/flatten_10_turns")
+def flatten_10():
+    data = conversation_data(5)
+    return lambda: Pickler().flatten(data)
+
+
+@case("jsonpickle/flatten_20_turns")
+def flatten_20():
+    data = conversation_data(10)
+    return lambda: Pickler().flatten(data)
+
+
+@case("jsonpickle/restore_20_turns")
+def restore_20():
+    document = Pickler().flatten(conversation_data(10))
+    return lambda: Unpickler().restore(document)
+
+
+@case("add_turn/at_max_turns")
+def add_turn_full():
+    data = conversation_data(10)
+    return lambda: data.add_turn("user", "And a restaurant nearby?")
+
+
+@case("add_turn/max_turns_100")
+def add_turn_full_100():
+    data = conversation_data(50, max_turns=100)
+    return lambda: data.add_turn("user", "And a restaurant nearby?")
+
+
+@case("mime_type/pdf")
+def mime_type_pdf():
+    return lambda: mime_type("Rome itinerary.final.pdf")
+
+
+def measure(function, repeat: int = 9, min_time: float = 0.2) -> float:
+    """Returns the best time per call, in nanoseconds."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat, number)) / number * 1e9
+
+
+def main(args) -> int:
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    results = {}
+    regressions = []
+    print(f"{'case':<32} {'ns/call':>10} {'baseline':>10} {'change':>8}")
+    for name, setup in CASES.items():
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = round(measure(setup(), args.repeat, args.min_time), 1)
+        baseline = baselines.get(name)
+        change = f"{results[name] / baseline - 1:>+8.0%}" if baseline else f"{'':>8}"
+        print(f"{name:<32} {results[name]:>10.1f} {baseline or '':>10} {change}")
+        if baseline and results[name] > baseline * (1 + args.tolerance):
+            regressions.append(f"{name}: {results[name]} ns/call exceeds baseline {baseline} by more than {args.tolerance:.0%}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({**baselines, **results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    for regression in regressions:
+        print(regression, file=sys.stderr)
+    return 1 if regressions else 0
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--filter", help="only run cases whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=9)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timed repeat")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed regression, as a fraction of the baseline")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_arguments()))
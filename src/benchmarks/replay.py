@@ -0,0 +1,168 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""Replays recorded agent runs through AssistantBot, and fails on latency or allocation regressions.
+
+Recordings are made by setting AGENT_RECORDING_DIRECTORY, see services/recording.py.
+Each fixture is replayed as one turn, from state load to state save, with the
+stream events and tool outputs of the recording. --speed 1 keeps the original
+timing, higher values accelerate it, and 0 replays without any wait, which
+measures the bot's own processing.
+
+Run from the src folder:
+    python -m benchmarks.replay benchmarks/fixtures/*.jsonl* --baseline benchmarks/baselines/replay.json
+    python -m benchmarks.replay benchmarks/fixtures/*.jsonl* --baseline benchmarks/baselines/replay.json --update-baseline
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from botbuilder.core import TurnContext
+
+from services.recording import load_recording, to_namespace
+from tests.conftest import NullAdapter, create_bot, message_activity
+
+
+class ReplayAgentsClient:
+    """A stand-in for AgentsOperations that streams the events of a recording."""
+
+    def __init__(self, recording: dict, speed: float = 0):
+        self.recording = recording
+        self.speed = speed
+        self.next_segment = 0
+
+    def create_thread(self, **kwargs):
+        return SimpleNamespace(id="thread_replay")
+
+    def create_message(self, thread_id: str, role: str, content: str, **kwargs):
+        return SimpleNamespace(id="msg_replay", thread_id=thread_id, role=role)
+
+    def create_stream(self, thread_id: str, assistant_id: str, **kwargs):
+        return self.__segment_events()
+
+    def submit_tool_outputs_to_stream(self, thread_id: str, run_id: str, tool_outputs: list):
+        return self.__segment_events()
+
+    def cancel_run(self, thread_id: str, run_id: str):
+        return SimpleNamespace(id=run_id, status="cancelled")
+
+    def get_run(self, thread_id: str, run_id: str):
+        return SimpleNamespace(id=run_id, status="cancelled")
+
+    def __segment_events(self):
+        segment = self.recording["segments"][self.next_segment]
+        self.next_segment += 1
+        # Convert up front, so replays time the bot rather than the conversion
+        events = [(line["t"], line["type"], to_namespace(line["data"])) for line in segment if line["kind"] == "event"]
+        previous = segment[0]["t"]
+        for t, event_type, event_data in events:
+            if self.speed > 0 and t > previous:
+                time.sleep((t - previous) / self.speed)
+            previous = t
+            yield (event_type, event_data)
+
+
+class ReplayTools:
+    """Answers the tool calls of a replayed run with the recorded outputs."""
+
+    def __init__(self, recording: dict, speed: float = 0):
+        self.tools = list(recording["tools"])
+        self.speed = speed
+
+    async def call_tool(self, tool_call, conversation_data, turn_context):
+        tool = self.tools.pop(0)
+        if self.speed > 0:
+            await asyncio.sleep(tool["duration"] / self.speed)
+        return tool["output"]
+
+
+async def replay(recording: dict, speed: float = 0) -> SimpleNamespace:
+    """Replays a recording as one turn, and returns the bot's replies and the turn duration."""
+    bot = create_bot(ReplayAgentsClient(recording, speed))
+    bot.call_tool = ReplayTools(recording, speed).call_tool
+    bot.cancel_superseded_runs = False
+    adapter = NullAdapter()
+    turn = recording["turn"]
+    text = (turn.get("texts") or ["Replayed message"])[0]
+    activity = message_activity(text, channel_id=turn.get("channel_id") or "directline")
+    start = time.perf_counter()
+    await bot.on_turn(TurnContext(adapter, activity))
+    return SimpleNamespace(seconds=time.perf_counter() - start, sent=adapter.sent, updated=adapter.updated)
+
+
+async def measure(path: str, speed: float, repeat: int) -> dict:
+    recording = load_recording(path)
+    durations = []
+    for _ in range(repeat):
+        result = await replay(recording, speed)
+        durations.append(result.seconds)
+    # Allocations are measured in a separate pass, tracing slows the turn down
+    tracemalloc.start()
+    await replay(recording, speed)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "median_ms": round(statistics.median(durations) * 1000, 3),
+        "peak_allocated_bytes": peak,
+        "activities": result.sent + result.updated,
+    }
+
+
+def compare(name: str, measured: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for metric in ["median_ms", "peak_allocated_bytes"]:
+        if metric not in baseline:
+            continue
+        limit = baseline[metric] * (1 + tolerance)
+        if measured[metric] > limit:
+            regressions.append(f"{name}: {metric} {measured[metric]} exceeds baseline {baseline[metric]} by more than {tolerance:.0%}")
+    return regressions
+
+
+async def main(args) -> int:
+    baselines = {}
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    results = {}
+    regressions = []
+    print(f"{'fixture':<40} {'median ms':>10} {'peak KiB':>10} {'activities':>11}")
+    for path in args.fixtures:
+        name = os.path.basename(path)
+        results[name] = await measure(path, args.speed, args.repeat)
+        print(f"{name:<40} {results[name]['median_ms']:>10.2f} {results[name]['peak_allocated_bytes'] / 1024:>10.1f} {results[name]['activities']:>11}")
+        if name in baselines:
+            regressions += compare(name, results[name], baselines[name], args.tolerance)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({**baselines, **results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    for regression in regressions:
+        print(regression, file=sys.stderr)
+    return 1 if regressions else 0
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("fixtures", nargs="+")
+    parser.add_argument("--speed", type=float, default=0, help="1 for the recorded timing, 0 for no waits")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--baseline", help="JSON file of expected results per fixture")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed regression, as a fraction of the baseline")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_arguments())))
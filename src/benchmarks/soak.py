@@ -0,0 +1,65 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""Drives many synthetic turns through AssistantBot and reports the memory of the process over time.
+
+A flat resident size after warm-up means workers do not need to be recycled
+for memory, see max_requests in gunicorn.conf.py.
+
+Run from the src folder: python -m benchmarks.soak --turns 20000 --conversations 200 [--trace]
+"""
+
+import argparse
+import asyncio
+import gc
+import time
+import tracemalloc
+
+from botbuilder.core import TurnContext
+
+from services.memory import resident_memory_bytes
+from tests.conftest import FakeAgentsClient, NullAdapter, create_bot, message_activity
+
+MB = 1024 * 1024
+
+
+async def soak(turns: int, conversations: int, report_every: int, trace: bool):
+    if trace:
+        tracemalloc.start(5)
+    agents_client = FakeAgentsClient(answer="Day 1: Arrive in Rome and visit the Colosseum. " * 20, record=False)
+    bot = create_bot(agents_client)
+    adapter = NullAdapter()
+    previous = tracemalloc.take_snapshot() if trace else None
+
+    print(f"{'turns':>8} {'rss MB':>8} {'growth MB':>10} {'traced MB':>10} {'turns/s':>8}")
+    start = time.perf_counter()
+    first_rss = None
+    for turn in range(1, turns + 1):
+        activity = message_activity(f"Plan day {turn} of my trip", conversation_id=f"soak_{turn % conversations}")
+        await bot.on_turn(TurnContext(adapter, activity))
+        if turn % report_every:
+            continue
+        gc.collect()
+        rss = resident_memory_bytes()
+        first_rss = first_rss or rss
+        traced = tracemalloc.get_traced_memory()[0] if trace else 0
+        print(f"{turn:>8} {rss / MB:>8.1f} {(rss - first_rss) / MB:>10.1f} {traced / MB:>10.1f} {turn / (time.perf_counter() - start):>8.0f}")
+        if trace:
+            snapshot = tracemalloc.take_snapshot()
+            for stat in snapshot.compare_to(previous, "lineno")[:3]:
+                print(f"{'':>8} {stat}")
+            previous = snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=10000)
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--report-every", type=int, default=1000)
+    parser.add_argument("--trace", action="store_true", help="trace allocations and print the top growth of each interval")
+    args = parser.parse_args()
+    asyncio.run(soak(args.turns, args.conversations, args.report_every, args.trace))
+
+
+if __name__ == "__main__":
+    main()
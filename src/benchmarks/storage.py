@@ -0,0 +1,163 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""Compares the bot state storage providers: MemoryStorage, SqliteStorage and Cosmos DB.
+
+Each case times storage calls on the conversation state of a 20 turn
+conversation, and reports latency percentiles and calls per second. A turn
+reads the state and writes it back with its e_tag, like ConversationState.
+The Cosmos DB provider runs only when AZURE_COSMOSDB_ENDPOINT is set, on the
+container of AZURE_COSMOSDB_CONTAINER_ID, and its benchmark items are deleted
+afterwards. --processes also runs turns from several processes on one SQLite
+database, as gunicorn workers would.
+
+Run from the src folder:
+    python -m benchmarks.storage
+    python -m benchmarks.storage --iterations 2000 --processes 4
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from botbuilder.core import MemoryStorage
+from botbuilder.core.storage import Storage
+
+from benchmarks.micro import conversation_data
+from services.metrics import MetricsRegistry
+from services.sqlite_storage import SqliteStorage
+
+KEY_PREFIX = "benchmarks/conversations"
+
+
+def document(turns: int = 10) -> dict:
+    return {"ConversationData": conversation_data(turns)}
+
+
+STATE = document()
+
+
+async def write(storage: Storage, keys: list):
+    await storage.write({keys[0]: STATE})
+
+
+async def read(storage: Storage, keys: list):
+    await storage.read(keys[:1])
+
+
+async def read_batch(storage: Storage, keys: list):
+    await storage.read(keys)
+
+
+async def turn(storage: Storage, keys: list):
+    state = (await storage.read(keys[:1]))[keys[0]]
+    state["ConversationData"].add_turn("user", "And a restaurant nearby?")
+    await storage.write({keys[0]: state})
+
+
+CASES = {
+    "write": write,
+    "read": read,
+    "read_batch_10": read_batch,
+    "turn": turn,
+}
+
+
+async def run_case(storage: Storage, case, iterations: int, keys: list) -> list:
+    await storage.write({key: document() for key in keys})
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await case(storage, keys)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def report(provider: str, case: str, durations: list):
+    durations = sorted(durations)
+    p50 = durations[len(durations) // 2] * 1000
+    p95 = durations[int(len(durations) * 0.95)] * 1000
+    per_second = len(durations) / sum(durations)
+    print(f"{provider:<10} {case:<16} {p50:>9.3f} {p95:>9.3f} {per_second:>10.0f}")
+
+
+def create_cosmos_storage() -> Storage:
+    # Imported here, the other providers need no Azure packages
+    from azure.identity import DefaultAzureCredential
+    from services.cosmos import CosmosDbPartitionedConfig, CosmosDbPartitionedStorage
+    return CosmosDbPartitionedStorage(
+        CosmosDbPartitionedConfig(
+            cosmos_db_endpoint=os.getenv("AZURE_COSMOSDB_ENDPOINT"),
+            database_id=os.getenv("AZURE_COSMOSDB_DATABASE_ID"),
+            container_id=os.getenv("AZURE_COSMOSDB_CONTAINER_ID"),
+            credential=DefaultAzureCredential(managed_identity_client_id=os.getenv("MicrosoftAppId")),
+        )
+    )
+
+
+def run_turns(path: str, worker: int, iterations: int):
+    async def run():
+        storage = SqliteStorage(path, registry=MetricsRegistry())
+        keys = [f"{KEY_PREFIX}/worker_{worker}"]
+        await storage.write({keys[0]: document()})
+        for _ in range(iterations):
+            await turn(storage, keys)
+    asyncio.run(run())
+
+
+def run_processes(path: str, processes: int, iterations: int):
+    workers = [multiprocessing.get_context("spawn").Process(target=run_turns, args=(path, worker, iterations)) for worker in range(processes)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    print(f"\n{processes} processes on one SQLite database: {processes * iterations / elapsed:.0f} turns/s, including process start")
+
+
+async def main(args) -> int:
+    keys = [f"{KEY_PREFIX}/{i}" for i in range(10)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bot_state.db")
+        providers = {
+            "memory": MemoryStorage(),
+            "sqlite": SqliteStorage(path, registry=MetricsRegistry()),
+        }
+        if os.getenv("AZURE_COSMOSDB_ENDPOINT"):
+            providers["cosmos"] = create_cosmos_storage()
+        else:
+            print("AZURE_COSMOSDB_ENDPOINT is not set, skipping Cosmos DB")
+
+        print(f"{'provider':<10} {'case':<16} {'p50 ms':>9} {'p95 ms':>9} {'calls/s':>10}")
+        for provider, storage in providers.items():
+            if args.provider and args.provider != provider:
+                continue
+            # Cosmos DB calls are network round trips charged in request units
+            iterations = args.iterations if provider != "cosmos" else max(1, args.iterations // 10)
+            try:
+                for name, case in CASES.items():
+                    report(provider, name, await run_case(storage, case, iterations, keys))
+            finally:
+                await storage.delete(keys)
+        providers["sqlite"].close()
+
+        if args.processes:
+            run_processes(path, args.processes, args.iterations)
+    return 0
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--provider", choices=["memory", "sqlite", "cosmos"], help="only benchmark this provider")
+    parser.add_argument("--iterations", type=int, default=1000, help="calls per case")
+    parser.add_argument("--processes", type=int, default=0, help="SQLite worker processes running turns at once")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_arguments())))
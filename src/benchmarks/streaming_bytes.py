@@ -0,0 +1,41 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""Compares bytes sent to the channel by full and delta streaming modes.
+
+Run from the src folder: python -m benchmarks.streaming_bytes
+"""
+
+import asyncio
+import time
+
+from data_models import ConversationData
+from tests.conftest import FakeTurnContext, create_bot, text_run_events
+
+ANSWER_LENGTHS = [1000, 2000, 4000, 8000, 16000, 32000]
+
+
+async def measure(streaming_mode: str, answer_length: int):
+    bot = create_bot(streaming_mode=streaming_mode)
+    turn_context = FakeTurnContext(channel_id="directline")
+    answer = ("Day 1: Arrive in Rome and visit the Colosseum. " * (answer_length // 47 + 1))[:answer_length]
+    start = time.perf_counter()
+    await bot.process_run_streaming(text_run_events(answer), ConversationData([]), turn_context)
+    elapsed = time.perf_counter() - start
+    assert turn_context.sent[-1].text == answer
+    return turn_context.bytes_sent(), elapsed
+
+
+async def main():
+    print(f"{'length':>8} {'full bytes':>12} {'delta bytes':>12} {'full B/char':>12} {'delta B/char':>13} {'full ms':>8} {'delta ms':>9}")
+    for length in ANSWER_LENGTHS:
+        full_bytes, full_time = await measure("full", length)
+        delta_bytes, delta_time = await measure("delta", length)
+        print(
+            f"{length:>8} {full_bytes:>12} {delta_bytes:>12} {full_bytes / length:>12.1f} "
+            f"{delta_bytes / length:>13.2f} {full_time * 1000:>8.1f} {delta_time * 1000:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -3,22 +3,42 @@
 
 import os
 import io
+import asyncio
 import json
+import time
 import base64
 import urllib.request
 
 from azure.ai.projects.operations import AgentsOperations
 
 from botbuilder.core import ConversationState, TurnContext, UserState, MessageFactory
-from botbuilder.schema import ChannelAccount, CardAction, ActionTypes
+from botbuilder.schema import ChannelAccount, CardAction, ActionTypes, ActivityTypes
 from botbuilder.dialogs import Dialog
 
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
 
 from data_models import ConversationData, Attachment, mime_type
 from bots.state_management_bot import StateManagementBot
+from bots.run_orchestrator import RunOrchestrator, RunRegistry
 from services.bing import BingClient
 from services.graph import GraphClient
+from services.conversation_lock import TurnSerializer
+from services.admission import AdmissionController, AdmissionRejected
+from services.rate_limit import RateLimiter
+from services.metrics import REGISTRY
+from services.recording import RunRecorder
+from services.telemetry import TRACER, current_span
+from services.thread_pool import ThreadPool
+from services.janitor import ResourceJanitor
+from services.model_router import FAST, ModelRouter
+from services.answer_cache import AnswerCache
+
+VISION_FIRST_TOKEN_SECONDS = REGISTRY.histogram("vision_time_to_first_token_seconds", "Time from the vision request of image_query to its first token")
+VISION_SECONDS = REGISTRY.histogram("vision_completion_seconds", "Time to stream the vision completion of image_query", ["outcome"])
+
+def read_base64(url: str) -> str:
+    with urllib.request.urlopen(url) as f:
+        return base64.b64encode(f.read()).decode()
 
 class AssistantBot(StateManagementBot):
 
@@ -26,14 +46,21 @@ class AssistantBot(StateManagementBot):
             self, 
             conversation_state: ConversationState, 
             user_state: UserState, 
-            aoai_client: AzureOpenAI,
+            aoai_client: AsyncAzureOpenAI,
             agents_client: AgentsOperations,
             agent_id: str, 
             bing_client: BingClient, 
             graph_client: GraphClient, 
-            dialog: Dialog
+            dialog: Dialog,
+            turn_serializer: TurnSerializer = None,
+            admission: AdmissionController = None,
+            rate_limiter: RateLimiter = None,
+            thread_pool: ThreadPool = None,
+            janitor: ResourceJanitor = None,
+            router: ModelRouter = None,
+            answer_cache: AnswerCache = None
         ):
-        super().__init__(conversation_state, user_state, dialog)
+        super().__init__(conversation_state, user_state, dialog, turn_serializer)
         self.aoai_client = aoai_client
         self.chat_client = aoai_client.chat
         self.agents_client = agents_client
@@ -45,31 +72,83 @@ class AssistantBot(StateManagementBot):
         self.welcome_message = os.getenv("LLM_WELCOME_MESSAGE", "Hello and welcome to the Assistant Bot Python!")
         self.agent_id = agent_id
         self.streaming = os.getenv("AZURE_OPENAI_STREAMING", False)
+        self.streaming_mode = os.getenv("AZURE_OPENAI_STREAMING_MODE", "full")
+        self.max_tool_rounds = int(os.getenv("AGENT_MAX_TOOL_ROUNDS", 10))
+        self.vision_max_tokens = int(os.getenv("VISION_MAX_TOKENS", 1000))
+        self.vision_timeout = float(os.getenv("VISION_TIMEOUT_SECONDS", 30))
+        self.cancel_superseded_runs = os.getenv("AGENT_CANCEL_SUPERSEDED_RUNS", "true").lower() == "true"
+        self.run_registry = RunRegistry()
+        self.coalesce_messages = os.getenv("AGENT_COALESCE_MESSAGES", "true").lower() == "true"
+        self.admission = admission
+        self.rate_limiter = rate_limiter or RateLimiter(tokens_per_minute=0, requests_per_minute=0)
+        self.thread_pool = thread_pool or ThreadPool(agents_client, size=0)
+        self.janitor = janitor
+        self.router = router or ModelRouter()
+        self.answer_cache = answer_cache
+        self.recorder = RunRecorder.from_environment()
+
+    async def on_turn(self, turn_context: TurnContext):
+        activity = turn_context.activity
+        if activity.type == ActivityTypes.message:
+            # Show the user the message was received before the turn waits on runs, state and services
+            if self.is_chat_message(activity):
+                self.start_typing(turn_context)
+            # Stop the run of an earlier message nobody will read anymore
+            if self.cancel_superseded_runs:
+                await self.run_registry.supersede(activity.conversation.id)
+            # Queue chat messages so a burst is answered by a single run
+            if self.coalesce_messages and self.is_chat_message(activity):
+                self.turn_serializer.enqueue(activity.conversation.id, activity.text)
+                turn_context.turn_state[TurnSerializer.QUEUED_KEY] = activity.conversation.id
+        await super().on_turn(turn_context)
+
+    def touch(self, conversation_data: ConversationData, turn_context: TurnContext):
+        conversation_data.last_activity = time.time()
+        if self.janitor:
+            self.janitor.touch(self.conversation_state.get_storage_key(turn_context), conversation_data.last_activity)
+
+    def is_chat_message(self, activity):
+        if activity.text is None or activity.text in ["clear", "logout"] or activity.text.startswith(":"):
+            return False
+        return not any(attachment.content_url for attachment in activity.attachments or [])
 
     async def on_members_added_activity(self, members_added: list[ChannelAccount], turn_context: TurnContext):
-        for member in members_added:
-            if member.id != turn_context.activity.recipient.id:
-                await turn_context.send_activity(self.welcome_message)
-                await self.handle_login(turn_context)
+        users_added = [member for member in members_added if member.id != turn_context.activity.recipient.id]
+        for member in users_added:
+            await turn_context.send_activity(self.welcome_message)
+            await self.handle_login(turn_context)
 
     async def on_message_activity(self, turn_context: TurnContext):
         
-        # Enforce login
-        loggedIn = await self.handle_login(turn_context)
-        if not loggedIn:
-            return False
-        
+        # Take the messages queued for this conversation, including this one
+        texts = [turn_context.activity.text]
+        conversation_id = turn_context.activity.conversation.id
+        if turn_context.turn_state.get(TurnSerializer.QUEUED_KEY) == conversation_id:
+            texts = self.turn_serializer.take_pending(conversation_id)
+            if not texts:
+                # Already answered by the run of an earlier turn
+                return True
+
         # Load conversation state
         conversation_data = await self.conversation_data_accessor.get(turn_context, ConversationData([]))
+        self.touch(conversation_data, turn_context)
 
-        # Create a new thread if one does not exist
-        if conversation_data.thread_id is None:
-            thread = self.agents_client.create_thread()
-            conversation_data.thread_id = thread.id
+        # Enforce login, and create a new thread if one does not exist in the meantime
+        if conversation_data.thread_id is None and turn_context.activity.text != 'clear':
+            loggedIn, thread_id = await asyncio.gather(
+                self.handle_login(turn_context),
+                self.thread_pool.take()
+            )
+            conversation_data.thread_id = thread_id
+        else:
+            loggedIn = await self.handle_login(turn_context)
+        if not loggedIn:
+            return False
 
         # Delete thread if user asks
         if turn_context.activity.text == 'clear':
-            self.agents_client.delete_thread(conversation_data.thread_id)
+            if conversation_data.thread_id:
+                await asyncio.to_thread(self.agents_client.delete_thread, conversation_data.thread_id)
             conversation_data.thread_id = None
             conversation_data.attachments = []
             conversation_data.history = []
@@ -94,6 +173,7 @@ class AssistantBot(StateManagementBot):
                 bytes = io.BytesIO(f.read())
                 bytes.name = attachment.name
             file_response = self.agents_client.upload_file(file=bytes, purpose="assistants")
+            conversation_data.add_file(file_response.id)
             # Send the file to the assistant
             tools = []
             if tool == "Code Interpreter":
@@ -117,92 +197,116 @@ class AssistantBot(StateManagementBot):
             await turn_context.send_activity(MessageFactory.text(f"File added to {tool} successfully!"))
             return True
 
-        # Add user message to history
-        conversation_data.add_turn("user", turn_context.activity.text)
-        
-        # Send user message to thread
-        self.agents_client.create_message(
-            thread_id=conversation_data.thread_id, 
-            role="user", 
-            content=turn_context.activity.text
-        )
-        
-        # Run thread
-        run = self.agents_client.create_stream(
-            thread_id=conversation_data.thread_id,
-            assistant_id=self.agent_id,
-            instructions=self.instructions
-        )
+        # Wait for a free agent run slot
+        if self.admission is None:
+            await self.run_agent(texts, conversation_data, turn_context)
+            return True
+        try:
+            async with self.admission.admit(turn_context.activity.from_property.id):
+                await self.run_agent(texts, conversation_data, turn_context)
+        except AdmissionRejected:
+            await turn_context.send_activity(self.admission.busy_message)
+            return False
+        return True
+
+    async def run_agent(self, texts: list[str], conversation_data: ConversationData, turn_context: TurnContext):
+        # Earlier turns can change the answer, even to a question that stands alone
+        first_turn = not conversation_data.history
+        for text in texts:
+            # Add user message to history
+            conversation_data.add_turn("user", text)
+
+        # Answer context-free questions asked before without a run
+        cacheable = first_turn and self.answer_cache is not None and self.answer_cache.is_context_free(texts, conversation_data)
+        if cacheable:
+            answer = await self.answer_cache.get(texts[0])
+            if answer is not None:
+                await self.send_cached_answer(texts, answer, conversation_data, turn_context)
+                return
+
+        # Send user messages to thread, in one call off the event loop
+        def create_messages():
+            for text in texts:
+                self.agents_client.create_message(
+                    thread_id=conversation_data.thread_id,
+                    role="user",
+                    content=text
+                )
+        await asyncio.to_thread(create_messages)
+
+        # Run thread, on the fast agent when the turn is simple enough
+        tier, reason = self.router.route(texts, conversation_data)
+        span = current_span()
+        if span:
+            span.set_attribute("model_tier", tier)
+            span.set_attribute("model_tier_reason", reason)
+        started = time.perf_counter()
+        reserved_tokens = self.rate_limiter.estimate_run_tokens()
+        async def create_run():
+            return await self.rate_limiter.call(
+                "run",
+                reserved_tokens,
+                self.agents_client.create_stream,
+                thread_id=conversation_data.thread_id,
+                assistant_id=self.router.fast_agent_id if tier == FAST else self.agent_id,
+                instructions=self.instructions
+            )
+        run = await create_run()
 
         # Process run streaming
-        await self.process_run_streaming(run, conversation_data, turn_context)
+        orchestrator = await self.process_run_streaming(run, conversation_data, turn_context, reserved_tokens, create_run)
+        self.router.observe(tier, time.perf_counter() - started)
+        # Only answers the agent wrote without tools or generated files can be reused
+        answer = orchestrator.message.text
+        if cacheable and orchestrator.state == "completed" and orchestrator.tool_rounds == 0 and answer and "/api/files/" not in answer:
+            self.answer_cache.add(texts[0], answer, time.perf_counter() - started)
 
-        return True
+    async def send_cached_answer(self, texts: list[str], answer: str, conversation_data: ConversationData, turn_context: TurnContext):
+        span = current_span()
+        if span:
+            span.set_attribute("answer_cache", "hit")
+        await self.typing_sent(turn_context)
+        conversation_data.add_turn("assistant", answer)
+        await self.send_interim_message(turn_context, answer, 1, None, "message")
 
-    async def process_run_streaming(self, run, conversation_data, turn_context, stream_id = None):
-        # Start streaming response
-        current_message = ""
-        tool_outputs = []
-        current_run_id = ""
-        activity_id = ""
-        stream_sequence = 1
-        activity_id = await self.send_interim_message(turn_context, "Typing...", stream_sequence, stream_id, "typing")
-
-        for event in run:
-            event_type = event[0]
-            event_data = event[1]
-            if event_type == "thread.run.failed":
-                current_message = event_data.last_error.message
-                break
-            if event_type == "thread.run.created":
-                current_run_id = event_data.id
-            if event_type == "thread.run.requires_action":
-                tool_calls = event_data.required_action.submit_tool_outputs.tool_calls
-                for tool_call in tool_calls:
-                    arguments = json.loads(tool_call.function.arguments)
-                    if tool_call.function.name == "image_query":
-                        response = await self.image_query(conversation_data, arguments["query"], arguments["image_name"])
-                        tool_outputs.append({"tool_call_id": tool_call.id, "output": response})
-                    elif tool_call.function.name == "bing_query":
-                        response = await self.bing_query(conversation_data, arguments["query"], arguments["type"])
-                        tool_outputs.append({"tool_call_id": tool_call.id, "output": response})
-                    elif tool_call.function.name == "schedule_event":
-                        response = await self.schedule_event(conversation_data, turn_context.activity.token, arguments["subject"], arguments["start"], arguments["end"])
-                        tool_outputs.append({"tool_call_id": tool_call.id, "output": response})
-                    else:
-                        tool_outputs.append({"tool_call_id": tool_call.id, "output": "Tool not found"})
-
-            if event_type == "thread.message.delta":
-                deltaBlock = event_data.delta.content[0]
-                if deltaBlock.type == "text":
-                    current_message += deltaBlock.text.value
-                    stream_sequence += 1
-                    # Flush content every 50 messages
-                    if (stream_sequence % 50 == 0):
-                        await self.send_interim_message(turn_context, current_message, stream_sequence, activity_id, "typing")
-
-                elif deltaBlock.type == "image_file":
-                    current_message += f"![{deltaBlock.image_file.file_id}](/api/files/{deltaBlock.image_file.file_id})"
-        
-        messages = self.agents_client.get_messages(thread_id=conversation_data.thread_id).messages
-        # Recursively process the run with the tool outputs
-        if len(tool_outputs) > 0:
-            new_run = self.agents_client.submit_tool_outputs_to_stream(thread_id=conversation_data.thread_id, run_id=current_run_id, tool_outputs=tool_outputs)
-            await self.process_run_streaming(new_run, conversation_data, turn_context, activity_id)
-            return
-        response = current_message
+        # Keep the thread complete for follow-up questions
+        def create_messages():
+            for text in texts:
+                self.agents_client.create_message(thread_id=conversation_data.thread_id, role="user", content=text)
+            self.agents_client.create_message(thread_id=conversation_data.thread_id, role="assistant", content=answer)
+        await asyncio.to_thread(create_messages)
 
-        # Add assistant message to history
-        conversation_data.add_turn("assistant", response)
+    async def process_run_streaming(self, run, conversation_data, turn_context, reserved_tokens = 0, restart = None):
+        orchestrator = RunOrchestrator(self, conversation_data, turn_context, self.max_tool_rounds)
+        orchestrator.reserved_tokens = reserved_tokens
+        orchestrator.restart = restart
+        conversation_id = turn_context.activity.conversation.id
+        if self.recorder:
+            orchestrator.recording = self.recorder.start(conversation_id, [turn_context.activity.text], turn_context.activity.channel_id)
+            run = orchestrator.recording.wrap(run)
+        self.run_registry.start(conversation_id, orchestrator)
+        try:
+            await orchestrator.run(run)
+        finally:
+            self.run_registry.finish(conversation_id, orchestrator)
+            if orchestrator.recording:
+                await asyncio.to_thread(orchestrator.recording.save)
+        return orchestrator
 
-        # Respond back to user
-        stream_sequence += 1
-        await self.send_interim_message(turn_context, current_message, stream_sequence, activity_id, "message")
-    
+    async def call_tool(self, tool_call, conversation_data: ConversationData, turn_context: TurnContext):
+        arguments = json.loads(tool_call.function.arguments)
+        if tool_call.function.name == "image_query":
+            return await self.image_query(conversation_data, arguments["query"], arguments["image_name"])
+        elif tool_call.function.name == "bing_query":
+            return await self.bing_query(conversation_data, arguments["query"], arguments["type"])
+        elif tool_call.function.name == "schedule_event":
+            return await self.schedule_event(conversation_data, turn_context.activity.token, arguments["subject"], arguments["start"], arguments["end"])
+        return "Tool not found"
 
     # Helper to handle file uploads from user
     async def handle_file_uploads(self, turn_context: TurnContext, thread_id: str, conversation_data: ConversationData):
         files_uploaded = False
+        notices = []
         # Check if incoming message has attached files
         if turn_context.activity.attachments is not None:
             for attachment in turn_context.activity.attachments:
@@ -221,10 +325,10 @@ class AssistantBot(StateManagementBot):
 
                 # Add file upload notice to conversation history, frontend, and assistant
                 conversation_data.add_turn("user", f"File uploaded: {attachment.name}")
-                await turn_context.send_activity(MessageFactory.text(f"File uploaded: {attachment.name}"))
+                notices.append(MessageFactory.text(f"File uploaded: {attachment.name}"))
                 self.agents_client.create_message(thread_id=thread_id,role="user",content=f"File uploaded: {attachment.name}",)
                 # Ask whether to add file to a tool
-                await turn_context.send_activity(MessageFactory.suggested_actions(
+                notices.append(MessageFactory.suggested_actions(
                     [
                         CardAction(title= ":Code Interpreter", type= ActionTypes.im_back, value= ":Code Interpreter"),
                         CardAction( title= ":File Search", type= ActionTypes.im_back, value= ":File Search"),
@@ -232,6 +336,9 @@ class AssistantBot(StateManagementBot):
                     "Add to a tool? (ignore if not needed)",
                 ))
 
+        # Send the notices of all files in one batch
+        if notices:
+            await turn_context.send_activities(notices)
 
         # Return True if files were uploaded
         return files_uploaded
@@ -240,28 +347,68 @@ class AssistantBot(StateManagementBot):
         # Find image in attachments by name
         image = next(filter(lambda a: a.name == image_name.split("/")[-1], conversation_data.attachments))
 
-        # Read image.url
-        with urllib.request.urlopen(image.url) as f:
-            # get file as base64
-            bytes = base64.b64encode(f.read()).decode()
+        # Read image.url, off the event loop
+        bytes = await asyncio.to_thread(read_base64, image.url)
 
         # Send image to assistant
-        response = self.chat_client.completions.create(
-            model=self.deployment,
-            messages=[
-                {"role": "user", "content": [
-                    {"type": "text", "text": query},
-                    {"type": "image_url", "image_url": {
-                        "url": f"data:{image.content_type};base64,{bytes}"}
-                    }
-                ]}
-            ]
-        )
-        return response.choices[0].message.content
+        messages = [
+            {"role": "user", "content": [
+                {"type": "text", "text": query},
+                {"type": "image_url", "image_url": {
+                    "url": f"data:{image.content_type};base64,{bytes}"}
+                }
+            ]}
+        ]
+        reserved_tokens = self.rate_limiter.estimate_chat_tokens(messages, self.vision_max_tokens)
+        with TRACER.span("vision.completion", deployment=self.deployment) as span:
+            # Stream the answer, so a slow completion can be cut at the time budget
+            stream = None
+            parts = []
+            outcome = "completed"
+            usage_recorded = False
+
+            async def consume():
+                nonlocal stream, usage_recorded
+                stream = await self.rate_limiter.call_async(
+                    "chat",
+                    reserved_tokens,
+                    self.chat_client.completions.create,
+                    model=self.deployment,
+                    messages=messages,
+                    max_tokens=self.vision_max_tokens,
+                    stream=True,
+                    # The last chunk reports the usage, which settles the reservation
+                    stream_options={"include_usage": True}
+                )
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if not parts:
+                            span.add_event("first_token")
+                            VISION_FIRST_TOKEN_SECONDS.observe(span.elapsed())
+                        parts.append(chunk.choices[0].delta.content)
+                    if chunk.usage:
+                        self.rate_limiter.record_usage("chat", reserved_tokens, chunk.usage.total_tokens)
+                        usage_recorded = True
+
+            try:
+                await asyncio.wait_for(consume(), self.vision_timeout)
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                if stream is not None:
+                    await stream.close()
+            finally:
+                # Like RunOrchestrator.settle_reservation, completions that produced nothing used no tokens
+                if not usage_recorded and not parts:
+                    self.rate_limiter.release(reserved_tokens)
+            span.set_attribute("outcome", outcome)
+        VISION_SECONDS.observe(span.duration, outcome=outcome)
+        if not parts:
+            return "The image could not be analyzed in time." if outcome == "timeout" else ""
+        return "".join(parts)
 
     async def bing_query(self, conversation_data: ConversationData, query: str, type: str):
-        return self.bing_client.query(query, type)
+        return await asyncio.to_thread(self.bing_client.query, query, type)
 
     async def schedule_event(self, conversation_data: ConversationData, token: str, subject: str, start: str, end: str):
-        return self.graph_client.schedule_event(token, subject, start, end)
+        return await self.graph_client.schedule_event_batched(token, subject, start, end)
 
@@ -0,0 +1,41 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+class MessageStream:
+    """Accumulates streamed text deltas.
+
+    Parts are kept in a list and only joined when the text is read, so growing
+    a long answer is linear in its length. Content appended since the last
+    call to take_delta() is tracked separately for channels that can append.
+    """
+
+    def __init__(self, text: str = ""):
+        self._parts = [text] if text else []
+        self._pending = []
+        self._length = len(text)
+
+    def append(self, text: str):
+        if not text:
+            return
+        self._parts.append(text)
+        self._pending.append(text)
+        self._length += len(text)
+
+    def take_delta(self) -> str:
+        delta = "".join(self._pending)
+        self._pending.clear()
+        return delta
+
+    def replace(self, text: str):
+        self._parts = [text] if text else []
+        self._pending = []
+        self._length = len(text)
+
+    @property
+    def text(self) -> str:
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def __len__(self):
+        return self._length
@@ -0,0 +1,370 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import asyncio
+import threading
+import time
+
+from botbuilder.core import TurnContext
+
+from data_models import ConversationData
+from bots.message_stream import MessageStream
+from bots.state_management_bot import TURN_STARTED_KEY
+from services.metrics import REGISTRY
+from services.rate_limit import is_run_throttled, run_retry_after
+from services.telemetry import TRACER, current_span
+
+TERMINAL_RUN_STATUSES = ["completed", "failed", "cancelled", "expired", "incomplete"]
+
+TIME_TO_FIRST_TOKEN_SECONDS = REGISTRY.histogram("agent_time_to_first_token_seconds", "Time from the start of a turn to the first streamed token")
+RUN_SECONDS = REGISTRY.histogram("agent_run_seconds", "Time to stream an agent run, including its tool rounds", ["state"])
+FLUSHES = REGISTRY.histogram("agent_run_flushes", "Interim messages sent per agent run", buckets=[0, 1, 2, 5, 10, 20, 50, 100])
+TOOL_SECONDS = REGISTRY.histogram("agent_tool_seconds", "Time to run a tool call", ["tool"])
+WEB_SEARCH_SECONDS = REGISTRY.histogram("web_search_seconds", "Time web searches held up a run, by grounding mode", ["mode"])
+WEB_SEARCH_RUN_SECONDS = REGISTRY.histogram("web_search_run_seconds", "Time to stream agent runs that searched the web, by grounding mode", ["mode"])
+
+
+class RunOrchestrator:
+    """Drives an agent run and its tool rounds until the run reaches a terminal state.
+
+    The orchestrator moves through the states streaming -> requires_action ->
+    streaming ... and ends in completed, failed or cancelled. Each tool round
+    resubmits outputs to a new stream in the same loop, up to max_tool_rounds.
+    """
+
+    def __init__(
+            self,
+            bot,
+            conversation_data: ConversationData,
+            turn_context: TurnContext,
+            max_tool_rounds: int = 10,
+            cancel_timeout: float = 10
+        ):
+        self.bot = bot
+        self.agents_client = bot.agents_client
+        self.conversation_data = conversation_data
+        self.turn_context = turn_context
+        self.max_tool_rounds = max_tool_rounds
+        self.cancel_timeout = cancel_timeout
+        self.state = "created"
+        self.run_id = None
+        self.cancelled = False
+        # Appended to the answer of a run cancelled for a reason the user should know
+        self.notice = None
+        self.done = asyncio.Event()
+        self.message = MessageStream()
+        self.activity_id = None
+        self.stream_sequence = 1
+        self.send_deltas = False
+        self.reserved_tokens = 0
+        self.usage_recorded = False
+        # Starts the run again when the service throttled it, see AssistantBot.run_agent
+        self.restart = None
+        self.throttled_attempts = 0
+        self.retry_delay = None
+        self.flushes = 0
+        self.tool_rounds = 0
+        self.web_search_mode = None
+        self.tool_steps = {}
+        self.first_token = False
+        self.started = time.perf_counter()
+        # Set when the run is recorded for replay, see services/recording.py
+        self.recording = None
+
+    def cancel(self, notice: str = None):
+        # Picked up between stream events; the run itself is cancelled by the orchestrator
+        self.cancelled = True
+        self.notice = notice
+
+    async def run(self, stream):
+        with TRACER.span("agent.run", thread_id=self.conversation_data.thread_id) as span:
+            try:
+                await self.__run(stream)
+            finally:
+                span.set_attribute("run_id", self.run_id)
+                span.set_attribute("state", self.state)
+                span.set_attribute("flushes", self.flushes)
+                RUN_SECONDS.observe(span.elapsed(), state=self.state)
+                if self.web_search_mode:
+                    span.set_attribute("web_search_mode", self.web_search_mode)
+                    WEB_SEARCH_RUN_SECONDS.observe(span.elapsed(), mode=self.web_search_mode)
+                FLUSHES.observe(self.flushes)
+                self.settle_reservation()
+                self.done.set()
+
+    async def __run(self, stream):
+        self.send_deltas = self.bot.delta_streaming_supported(self.turn_context)
+        await self.bot.typing_sent(self.turn_context)
+        self.activity_id = await self.bot.send_interim_message(self.turn_context, "Typing...", self.stream_sequence, None, "typing")
+        while True:
+            self.state = "streaming"
+            tool_calls = await self.consume(stream)
+            if self.state == "throttled":
+                if not await self.retry_throttled():
+                    self.message.replace("The service is busy right now. Please try again in a moment.")
+                    self.state = "failed"
+                    break
+                stream = await self.restart()
+                if self.recording:
+                    stream = self.recording.wrap(stream)
+                continue
+            if self.cancelled:
+                await self.cancel_run()
+                self.state = "cancelled"
+                break
+            if self.state != "streaming":
+                break
+            if not tool_calls:
+                self.state = "completed"
+                break
+            if self.tool_rounds >= self.max_tool_rounds:
+                await self.cancel_run()
+                self.message.replace("Sorry, this request needed too many tool calls to complete.")
+                self.state = "failed"
+                break
+            self.tool_rounds += 1
+            self.state = "requires_action"
+            round_started = time.perf_counter()
+            # The tool calls of a round run together, which lets tools batch their service calls
+            results = await asyncio.gather(*[self.call_tool(tool_call) for tool_call in tool_calls])
+            tool_outputs = []
+            for tool_call, (output, duration) in zip(tool_calls, results):
+                if self.recording:
+                    self.recording.record_tool(tool_call.function.name, tool_call.function.arguments, output, duration)
+                tool_outputs.append({"tool_call_id": tool_call.id, "output": output})
+            if self.cancelled:
+                await self.cancel_run()
+                self.state = "cancelled"
+                break
+            stream = await self.bot.rate_limiter.call(
+                "run",
+                0,
+                self.agents_client.submit_tool_outputs_to_stream,
+                thread_id=self.conversation_data.thread_id,
+                run_id=self.run_id,
+                tool_outputs=tool_outputs
+            )
+            if self.recording:
+                stream = self.recording.wrap(stream)
+            # Client-side searches cost the Bing call and the resubmission of the run
+            if any(tool_call.function.name == "bing_query" for tool_call in tool_calls):
+                self.web_search_mode = "client"
+                WEB_SEARCH_SECONDS.observe(time.perf_counter() - round_started, mode="client")
+        await self.finish()
+
+    async def call_tool(self, tool_call):
+        with TRACER.span("agent.tool", tool=tool_call.function.name) as tool_span:
+            output = await self.bot.call_tool(tool_call, self.conversation_data, self.turn_context)
+        TOOL_SECONDS.observe(tool_span.duration, tool=tool_call.function.name)
+        return output, tool_span.duration
+
+    async def consume(self, stream):
+        """Reads events until the stream ends, and returns pending tool calls, if any."""
+        tool_calls = []
+        # The agents client is synchronous, read it off the event loop
+        async for event in iterate_in_thread(stream):
+            event_type = event[0]
+            event_data = event[1]
+            if event_type == "thread.run.created":
+                self.run_id = event_data.id
+            # Read on until the run is known, a run left going on the service blocks its thread
+            if self.cancelled:
+                if self.run_id is None:
+                    continue
+                break
+            if event_type == "thread.run.completed":
+                self.record_usage(event_data)
+            elif event_type == "thread.run.failed":
+                self.record_usage(event_data)
+                if is_run_throttled(event_data.last_error):
+                    self.retry_delay = run_retry_after(event_data.last_error)
+                    self.state = "throttled"
+                    break
+                self.message.replace(event_data.last_error.message)
+                self.state = "failed"
+                break
+            elif event_type in ["thread.run.cancelled", "thread.run.expired"]:
+                self.record_usage(event_data)
+                self.state = "cancelled"
+                break
+            elif event_type == "thread.run.requires_action":
+                tool_calls = event_data.required_action.submit_tool_outputs.tool_calls
+            elif event_type == "thread.message.delta":
+                await self.on_message_delta(event_data)
+            elif event_type == "thread.run.step.created" and event_data.type == "tool_calls":
+                self.tool_steps[event_data.id] = time.perf_counter()
+            elif event_type == "thread.run.step.completed" and event_data.type == "tool_calls":
+                self.on_tool_step_completed(event_data)
+        return tool_calls
+
+    def record_usage(self, run):
+        if getattr(run, "usage", None) and not self.usage_recorded:
+            self.bot.rate_limiter.record_usage("run", self.reserved_tokens, run.usage.total_tokens)
+            self.usage_recorded = True
+
+    def settle_reservation(self):
+        # Runs without a usage report used about their reservation, unless they produced nothing
+        if not self.usage_recorded and not self.first_token and not self.tool_rounds:
+            self.bot.rate_limiter.release(self.reserved_tokens)
+        self.usage_recorded = True
+
+    async def retry_throttled(self) -> bool:
+        """Waits out a throttled run before it is started again. Returns False if it cannot be retried."""
+        rate_limiter = self.bot.rate_limiter
+        if self.restart is None or self.cancelled or self.first_token or self.tool_rounds or self.throttled_attempts >= rate_limiter.max_retries:
+            rate_limiter.throttled_counter.inc(kind="run")
+            return False
+        delay = rate_limiter.throttled("run", self.throttled_attempts, self.retry_delay)
+        self.throttled_attempts += 1
+        # The throttled run used nothing, its restart reserves tokens again
+        self.settle_reservation()
+        await asyncio.sleep(delay)
+        self.usage_recorded = False
+        return True
+
+    def on_tool_step_completed(self, step):
+        started = self.tool_steps.pop(step.id, None)
+        # Server-side grounding searches within the run, without a requires_action round trip
+        if any(tool_call.type == "bing_grounding" for tool_call in step.step_details.tool_calls or []):
+            self.web_search_mode = "server"
+            if started is not None:
+                WEB_SEARCH_SECONDS.observe(time.perf_counter() - started, mode="server")
+
+    async def on_message_delta(self, event_data):
+        deltaBlock = event_data.delta.content[0]
+        if deltaBlock.type == "text":
+            if not self.first_token:
+                self.first_token = True
+                self.record_first_token()
+            self.message.append(deltaBlock.text.value)
+            self.stream_sequence += 1
+            # Flush content every 50 messages
+            if (self.stream_sequence % 50 == 0):
+                self.flushes += 1
+                if self.send_deltas:
+                    await self.bot.send_interim_message(self.turn_context, self.message.take_delta(), self.stream_sequence, self.activity_id, "typing", delta=True)
+                else:
+                    await self.bot.send_interim_message(self.turn_context, self.message.text, self.stream_sequence, self.activity_id, "typing")
+        elif deltaBlock.type == "image_file":
+            self.conversation_data.add_file(deltaBlock.image_file.file_id)
+            self.message.append(f"![{deltaBlock.image_file.file_id}](/api/files/{deltaBlock.image_file.file_id})")
+
+    def record_first_token(self):
+        started = self.turn_context.turn_state.get(TURN_STARTED_KEY)
+        if not isinstance(started, float):
+            started = self.started
+        TIME_TO_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started)
+        span = current_span()
+        if span:
+            span.add_event("first_token")
+
+    async def cancel_run(self):
+        if self.run_id is None:
+            return
+        try:
+            run = await asyncio.to_thread(self.agents_client.cancel_run, thread_id=self.conversation_data.thread_id, run_id=self.run_id)
+            # The thread accepts new messages only once the run has stopped
+            deadline = time.monotonic() + self.cancel_timeout
+            while run.status not in TERMINAL_RUN_STATUSES and time.monotonic() < deadline:
+                await asyncio.sleep(0.25)
+                run = await asyncio.to_thread(self.agents_client.get_run, thread_id=self.conversation_data.thread_id, run_id=self.run_id)
+        except Exception:
+            # The run may have finished on its own in the meantime
+            pass
+
+    async def finish(self):
+        response = self.message.text
+        if self.notice:
+            response = f"{response}\n\n{self.notice}" if response else self.notice
+        # A superseded run with nothing to show does not need a reply
+        if self.state == "cancelled" and not response:
+            return
+
+        # Add assistant message to history
+        self.conversation_data.add_turn("assistant", response)
+
+        # Respond back to user with the full message, also in delta mode
+        self.stream_sequence += 1
+        await self.bot.send_interim_message(self.turn_context, response, self.stream_sequence, self.activity_id, "message")
+
+
+class RunRegistry:
+    """Tracks the in-flight run of each conversation in this worker."""
+
+    def __init__(self):
+        self.runs = {}
+
+    def start(self, conversation_id: str, orchestrator: RunOrchestrator):
+        self.runs[conversation_id] = orchestrator
+
+    def finish(self, conversation_id: str, orchestrator: RunOrchestrator):
+        if self.runs.get(conversation_id) is orchestrator:
+            del self.runs[conversation_id]
+
+    async def supersede(self, conversation_id: str, timeout: float = 15) -> bool:
+        """Cancels the in-flight run of a conversation and waits for it to stop."""
+        orchestrator = self.runs.get(conversation_id)
+        if orchestrator is None:
+            return False
+        orchestrator.cancel()
+        try:
+            await asyncio.wait_for(orchestrator.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return True
+
+    def cancel_all(self, notice: str = None) -> int:
+        """Cancels every in-flight run, and returns how many there were."""
+        for orchestrator in self.runs.values():
+            orchestrator.cancel(notice)
+        return len(self.runs)
+
+
+async def iterate_in_thread(stream):
+    """Iterates a blocking stream on a worker thread, yielding its events to the event loop.
+
+    The stream is closed by the reading thread once it is exhausted or the
+    consumer stops early.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stopped = threading.Event()
+    end = object()
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # The loop is gone, nobody is reading anymore
+            stopped.set()
+
+    def read():
+        try:
+            for event in stream:
+                if stopped.is_set():
+                    break
+                put((event, None))
+        except Exception as error:
+            put((end, error))
+        finally:
+            close_stream(stream)
+            put((end, None))
+
+    loop.run_in_executor(None, read)
+    try:
+        while True:
+            event, error = await queue.get()
+            if error is not None:
+                raise error
+            if event is end:
+                break
+            yield event
+    finally:
+        stopped.set()
+
+
+def close_stream(stream):
+    if hasattr(stream, "__exit__"):
+        stream.__exit__(None, None, None)
+    elif hasattr(stream, "close"):
+        stream.close()
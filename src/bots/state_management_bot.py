@@ -1,28 +1,130 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
+import asyncio
+import logging
 import os
-import jwt
+import time
 from botbuilder.core import ActivityHandler, ConversationState, TurnContext, UserState, MessageFactory
+from botbuilder.schema import Activity, ActivityTypes
 from botbuilder.dialogs import Dialog, DialogSet, DialogTurnStatus
 from botframework.connector.auth.user_token_client import UserTokenClient
 
+from services.conversation_lock import LeaseUnavailableError, TurnSerializer
+from services.token_cache import CachedToken, UserTokenCache
+from services.metrics import REGISTRY
+from services.telemetry import TRACER, current_span
+
+logger = logging.getLogger(__name__)
+
+STATE_LOAD_SECONDS = REGISTRY.histogram("state_load_seconds", "Time to load the conversation state of a message")
+STATE_SAVE_SECONDS = REGISTRY.histogram("state_save_seconds", "Time to save the conversation and user state of a turn")
+TURN_LOCK_WAIT_SECONDS = REGISTRY.histogram("turn_lock_wait_seconds", "Time messages waited for earlier turns of their conversation")
+TIME_TO_FEEDBACK_SECONDS = REGISTRY.histogram("turn_time_to_feedback_seconds", "Time from the start of a turn to the typing indicator")
+
+# Turn state key holding the time.perf_counter() value at the start of the turn
+TURN_STARTED_KEY = "StateManagementBot.turn_started"
+# Turn state keys holding the tasks started ahead of the steps that need them
+TYPING_KEY = "StateManagementBot.typing"
+USER_TOKEN_KEY = "StateManagementBot.user_token"
+
+# Channels whose client reassembles appended stream chunks (see public/index.html)
+APPEND_CHANNELS = ["directline"]
+
 class StateManagementBot(ActivityHandler):
-    def __init__(self, conversation_state: ConversationState, user_state: UserState, dialog: Dialog):
+    def __init__(self, conversation_state: ConversationState, user_state: UserState, dialog: Dialog, turn_serializer: TurnSerializer = None):
         self.conversation_state = conversation_state
         self.user_state = user_state
         self.conversation_data_accessor = self.conversation_state.create_property("ConversationData")
+        self.user_profile_accessor = self.user_state.create_property("UserProfile")
         self.dialog = dialog
+        self.dialog_set = DialogSet(self.conversation_state.create_property("DialogState"))
+        self.dialog_set.add(self.dialog)
         self.sso_enabled = os.getenv("SSO_ENABLED", False)
         if (self.sso_enabled == "false"):
             self.sso_enabled = False
         self.sso_config_name = os.getenv("SSO_CONFIG_NAME", "default")
+        self.user_token_cache = UserTokenCache.from_environment()
+        self.turn_serializer = turn_serializer or TurnSerializer()
 
     async def on_turn(self, turn_context: TurnContext):
+        turn_context.turn_state[TURN_STARTED_KEY] = time.perf_counter()
+        with TRACER.span("bot.turn", activity_type=turn_context.activity.type) as span:
+            if turn_context.activity.type != ActivityTypes.message:
+                await self.process_turn(turn_context)
+                return
+            # The user token does not depend on the conversation, fetch it while waiting for the lock and state
+            if self.sso_enabled and turn_context.activity.text != "logout":
+                turn_context.turn_state[USER_TOKEN_KEY] = asyncio.create_task(self.get_user_token(turn_context))
+            try:
+                # Messages of a conversation are processed one at a time, from state load to save
+                async with self.turn_serializer.turn(turn_context.activity.conversation.id):
+                    lock_wait = span.elapsed()
+                    span.set_attribute("lock_wait_seconds", lock_wait)
+                    TURN_LOCK_WAIT_SECONDS.observe(lock_wait)
+                    with TRACER.span("state.load") as load_span:
+                        if self.sso_enabled:
+                            await asyncio.gather(self.conversation_state.load(turn_context), self.user_state.load(turn_context))
+                        else:
+                            await self.conversation_state.load(turn_context)
+                    STATE_LOAD_SECONDS.observe(load_span.duration)
+                    await self.process_turn(turn_context)
+            except LeaseUnavailableError:
+                # Running the turn without the lease could overwrite the state of the turn holding it
+                logger.warning("Conversation %s is still leased, turn not processed", turn_context.activity.conversation.id)
+                # The user sends the message again, it must not also reach the next turn from the queue
+                if turn_context.turn_state.get(TurnSerializer.QUEUED_KEY) == turn_context.activity.conversation.id:
+                    self.turn_serializer.discard(turn_context.activity.conversation.id, turn_context.activity.text)
+                await turn_context.send_activity("I am still working on your previous message. Please send this one again in a moment.")
+            finally:
+                await self.settle_pending(turn_context)
+
+    async def process_turn(self, turn_context: TurnContext):
         await super().on_turn(turn_context)
         # Save any state changes. The load happened during the execution of the Dialog.
-        await self.conversation_state.save_changes(turn_context)
-        await self.user_state.save_changes(turn_context)
+        with TRACER.span("state.save") as save_span:
+            await self.conversation_state.save_changes(turn_context)
+            await self.user_state.save_changes(turn_context)
+        STATE_SAVE_SECONDS.observe(save_span.duration)
     
+    def start_typing(self, turn_context: TurnContext):
+        """Sends the typing indicator without waiting for it, so it goes out while the turn is set up."""
+        turn_context.turn_state[TYPING_KEY] = asyncio.create_task(self.send_typing(turn_context))
+
+    async def send_typing(self, turn_context: TurnContext):
+        await turn_context.send_activity(Activity(type=ActivityTypes.typing))
+        started = turn_context.turn_state.get(TURN_STARTED_KEY)
+        if started is not None:
+            TIME_TO_FEEDBACK_SECONDS.observe(time.perf_counter() - started)
+        span = current_span()
+        if span:
+            span.add_event("typing_sent")
+
+    async def typing_sent(self, turn_context: TurnContext):
+        """Waits for the typing indicator, so it reaches the user before the activities that follow it."""
+        typing = turn_context.turn_state.pop(TYPING_KEY, None)
+        if typing:
+            await typing
+
+    async def settle_pending(self, turn_context: TurnContext):
+        # Tasks started ahead of time must not outlive the turn context they use
+        token = turn_context.turn_state.pop(USER_TOKEN_KEY, None)
+        if token:
+            token.cancel()
+        try:
+            await self.typing_sent(turn_context)
+        except Exception:
+            logger.exception("Failed to send the typing indicator")
+
+    async def get_user_token(self, turn_context: TurnContext) -> CachedToken:
+        user_id = turn_context.activity.from_property.id
+        channel_id = turn_context.activity.channel_id
+        cached = self.user_token_cache.get(user_id, self.sso_config_name, channel_id)
+        if cached:
+            return cached
+        user_token_client = turn_context.turn_state.get(UserTokenClient.__name__, None)
+        user_token = await user_token_client.get_user_token(user_id, self.sso_config_name, channel_id, None)
+        return self.user_token_cache.add(user_id, self.sso_config_name, channel_id, user_token)
+
     async def handle_login(self, turn_context: TurnContext):
         if not self.sso_enabled:
             return True
@@ -30,38 +132,47 @@ class StateManagementBot(ActivityHandler):
             await self.handle_logout(turn_context)
             return False
 
-        user_profile_accessor = self.user_state.create_property("UserProfile")
-        user_profile = await user_profile_accessor.get(turn_context, lambda: {})
+        user_profile = await self.user_profile_accessor.get(turn_context, lambda: {})
 
-        user_token_client = turn_context.turn_state.get(UserTokenClient.__name__, None)
+        # Started at the beginning of the turn, see on_turn
+        user_token = turn_context.turn_state.pop(USER_TOKEN_KEY, None)
 
         try:
-            user_token = await user_token_client.get_user_token(turn_context.activity.from_property.id, self.sso_config_name, turn_context.activity.channel_id, None)
-            decoded_token = jwt.decode(user_token.token, options={"verify_signature": False})
+            user_token = await (user_token or self.get_user_token(turn_context))
+            if user_token.fetched_at <= user_profile.get("signed_out_at", 0):
+                # Cached before the user signed out, maybe on another worker
+                self.user_token_cache.invalidate(turn_context.activity.from_property.id, self.sso_config_name, turn_context.activity.channel_id)
+                user_token = await self.get_user_token(turn_context)
             turn_context.activity.token = user_token.token
-            user_profile["name"] = decoded_token.get("name")
+            user_profile["name"] = user_token.claims.get("name")
             return True
         except Exception as error:
-            dialog_set = DialogSet(self.conversation_state.create_property("DialogState"))
-            dialog_set.add(self.dialog)
-            dialog_context = await dialog_set.create_context(turn_context)
+            dialog_context = await self.dialog_set.create_context(turn_context)
             results = await dialog_context.continue_dialog()
             if results.status == DialogTurnStatus.Empty:
                 await dialog_context.begin_dialog(self.dialog.id)
             return False
 
     async def handle_logout(self, turn_context):
+        # Tokens cached by the other workers are dropped on their next turn of this user
+        user_profile = await self.user_profile_accessor.get(turn_context, lambda: {})
+        user_profile["signed_out_at"] = time.time()
+        self.user_token_cache.invalidate(turn_context.activity.from_property.id, self.sso_config_name, turn_context.activity.channel_id)
         user_token_client = turn_context.turn_state.get(UserTokenClient.__name__, None)
         await user_token_client.sign_out_user(turn_context.activity.from_property.id, self.sso_config_name, turn_context.activity.channel_id)
         await turn_context.send_activity("Signed out")
 
+    def delta_streaming_supported(self, turn_context):
+        return self.streaming and self.streaming_mode == "delta" and turn_context.activity.channel_id in APPEND_CHANNELS
+
     async def send_interim_message(
         self,
         turn_context,
         interim_message,
         stream_sequence,
         stream_id,
-        stream_type
+        stream_type,
+        delta = False
     ):
         stream_supported = self.streaming and turn_context.activity.channel_id == "directline"
         update_supported = self.streaming and turn_context.activity.channel_id == "msteams"
@@ -85,6 +196,9 @@ class StateManagementBot(ActivityHandler):
             "streamSequence": stream_sequence,
             "streamType": "streaming" if stream_type == "typing" else "final"
         }
+        # Delta chunks only carry the text appended since the previous chunk
+        if delta:
+            channel_data["streamMode"] = "delta"
         message = MessageFactory.text(interim_message)
         message.channel_data = channel_data if stream_supported else None
         message.type = stream_type
@@ -32,8 +32,18 @@ class ConversationData:
         self.history = history
         self.max_turns = max_turns
         self.attachments = []
+        # Agent files owned by the conversation, and the time of its last message, for the janitor
+        self.file_ids = []
+        self.last_activity = None
 
     def add_turn(self, role: str, content: str):
         self.history.append(ConversationTurn(role, content))
         if len(self.history) > self.max_turns:
-            self.history.pop(0)
\ No newline at end of file
+            self.history.pop(0)
+
+    def add_file(self, file_id: str):
+        # State saved before files were tracked has no file_ids
+        if not hasattr(self, "file_ids"):
+            self.file_ids = []
+        if file_id not in self.file_ids:
+            self.file_ids.append(file_id)
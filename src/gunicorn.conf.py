@@ -1,11 +1,14 @@
 import multiprocessing
 
+# Recycles workers to bound memory growth, see benchmarks/soak.py before changing it
 max_requests = 1000
 max_requests_jitter = 50
 log_file = "-"
 bind = "0.0.0.0:8000"
 
 timeout = 600
+# Time a stopping worker has for its turns in flight, keep it above DRAIN_TIMEOUT_SECONDS
+graceful_timeout = 60
 # https://learn.microsoft.com/en-us/troubleshoot/azure/app-service/web-apps-performance-faqs#why-does-my-request-time-out-after-230-seconds
 
 num_cpus = multiprocessing.cpu_count()
@@ -0,0 +1,58 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import asyncio
+import hmac
+from http import HTTPStatus
+from aiohttp import web
+from aiohttp.web import Request, Response, json_response
+
+from services.answer_cache import AnswerCache
+from services.memory import MemoryProfiler
+
+def is_authorized(req: Request, api_key: str) -> bool:
+    # Without a key the admin endpoints stay closed
+    return bool(api_key) and hmac.compare_digest(req.headers.get("X-Admin-Key", ""), api_key)
+
+def admin_routes(memory_profiler: MemoryProfiler, api_key: str):
+    def authorized(req: Request) -> bool:
+        return is_authorized(req, api_key)
+
+    # Memory of this worker: resident size, traced allocations, per-route counters and recent reports
+    async def get_memory(req: Request) -> Response:
+        if not authorized(req):
+            return Response(status=HTTPStatus.UNAUTHORIZED)
+        return json_response(memory_profiler.summary())
+
+    # Takes a snapshot now, and returns the allocations that grew since the previous one
+    async def post_memory_snapshot(req: Request) -> Response:
+        if not authorized(req):
+            return Response(status=HTTPStatus.UNAUTHORIZED)
+        report = await asyncio.to_thread(memory_profiler.snapshot)
+        return json_response(report)
+
+
+    return [
+        web.get("/api/admin/memory", get_memory),
+        web.post("/api/admin/memory/snapshot", post_memory_snapshot)
+    ]
+
+def answer_cache_routes(answer_cache: AnswerCache, api_key: str):
+    # Hit ratio and time saved by the answer cache of this worker
+    async def get_answer_cache(req: Request) -> Response:
+        if not is_authorized(req, api_key):
+            return Response(status=HTTPStatus.UNAUTHORIZED)
+        return json_response(answer_cache.stats())
+
+    # Drops the answer of the question parameter, or every answer without it, in every worker sharing the storage
+    async def delete_answer_cache(req: Request) -> Response:
+        if not is_authorized(req, api_key):
+            return Response(status=HTTPStatus.UNAUTHORIZED)
+        invalidated = await answer_cache.invalidate(req.query.get("question"))
+        return json_response({"invalidated": invalidated, "scope": "all" if answer_cache.storage else "worker"})
+
+
+    return [
+        web.get("/api/admin/answer-cache", get_answer_cache),
+        web.delete("/api/admin/answer-cache", delete_answer_cache)
+    ]
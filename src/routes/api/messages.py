@@ -1,8 +1,7 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
-import sys
-import traceback
+import logging
 from http import HTTPStatus
 from aiohttp import web
 from aiohttp.web import Request, Response, json_response
@@ -11,12 +10,23 @@ from botbuilder.core import (
     TurnContext
 )
 from botbuilder.integration.aiohttp import CloudAdapter
-from botbuilder.schema import Activity
+from botbuilder.schema import ActivityTypes
+
+from services.activity_parsing import is_ignorable, loads, parse_activity
+from services.admission import AdmissionController
+from services.drain import WorkerDrain
+from services.telemetry import TRACER, current_span
+from services.turn_queue import IdempotencyCache, TurnQueue
+
+logger = logging.getLogger(__name__)
 
 # Catch-all for errors.
 async def on_error(context: TurnContext, error: Exception):
-    print(f"\n [on_turn_error] unhandled error: {error}", file=sys.stderr)
-    traceback.print_exc()
+    logger.exception("[on_turn_error] unhandled error: %s", error, exc_info=error)
+    span = current_span()
+    if span:
+        span.status = "error"
+        span.set_attribute("error", repr(error))
 
     # Send a message to the user
     await context.send_activity("The bot encountered an error or bug.")
@@ -25,19 +35,61 @@ async def on_error(context: TurnContext, error: Exception):
     )
     await context.send_activity(str(error))
 
-def messages_routes(adapter: CloudAdapter, bot: ActivityHandler):
+def messages_routes(
+        adapter: CloudAdapter,
+        bot: ActivityHandler,
+        admission: AdmissionController = None,
+        turn_queue: TurnQueue = None,
+        idempotency: IdempotencyCache = None,
+        drain: WorkerDrain = None
+    ):
+    # Answer with the busy message only, without loading any conversation state.
+    # The request is acknowledged, a channel redelivering it would answer it twice.
+    async def shed(turn_context: TurnContext):
+        await turn_context.send_activity(admission.busy_message)
+
     # Listen for incoming requests on /api/messages.
     async def messages(req: Request) -> Response:
         # Parse incoming request
         if "application/json" in req.headers["Content-Type"]:
-            body = await req.json()
+            body = loads(await req.read())
         else:
             return Response(status=HTTPStatus.UNSUPPORTED_MEDIA_TYPE)
-        activity = Activity().deserialize(body)
+        # Acknowledge the activities the bot does not handle, without running a turn
+        if is_ignorable(body):
+            return Response(status=HTTPStatus.OK)
+        # A stopping worker only finishes the turns it started, the channel retries elsewhere
+        if drain and drain.draining:
+            return Response(status=HTTPStatus.SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+        activity = parse_activity(body)
         auth_header = req.headers["Authorization"] if "Authorization" in req.headers else ""
+        try:
+            authentication = await adapter.bot_framework_authentication.authenticate_request(activity, auth_header)
+        except PermissionError:
+            return Response(status=HTTPStatus.UNAUTHORIZED)
+
+        # Redelivered activities are already being processed
+        if idempotency and await idempotency.is_duplicate(activity):
+            return Response(status=HTTPStatus.ACCEPTED if turn_queue else HTTPStatus.OK)
+
+        # Shed load fast when every run slot is taken and the queue is full
+        logic = bot.on_turn
+        if admission and activity.type == ActivityTypes.message and admission.saturated():
+            admission.rejected_counter.inc(reason="saturated")
+            logic = shed
 
         # Route received a request to adapter for processing
-        response = await adapter.process_activity(auth_header, activity, bot.on_turn)
+        tracked_logic = drain.tracked(logic) if drain else logic
+
+        # Acknowledge messages right away and answer them from a background task
+        if turn_queue and activity.type == ActivityTypes.message and logic == bot.on_turn:
+            activity.caller_id = authentication.caller_id
+            if not turn_queue.enqueue(activity, authentication, tracked_logic):
+                return Response(status=HTTPStatus.SERVICE_UNAVAILABLE, headers={"Retry-After": "5"})
+            return Response(status=HTTPStatus.ACCEPTED)
+
+        with TRACER.span("POST /api/messages", activity_type=activity.type, channel_id=activity.channel_id):
+            response = await adapter.process_activity(authentication, activity, tracked_logic)
         if response:
             return json_response(data=response.body, status=response.status)
         return Response(status=HTTPStatus.OK)
@@ -0,0 +1,27 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import asyncio
+from http import HTTPStatus
+from aiohttp import web
+from aiohttp.web import Request, Response
+
+from routes.api.admin import is_authorized
+from services.metrics import REGISTRY, MetricsRegistry, WorkerMetrics
+
+
+def metrics_routes(api_key: str, worker_metrics: WorkerMetrics = None, registry: MetricsRegistry = REGISTRY):
+    # Prometheus scrape endpoint, with the metrics of every worker of the host when worker_metrics is set
+    async def get_metrics(req: Request) -> Response:
+        if not is_authorized(req, api_key):
+            return Response(status=HTTPStatus.UNAUTHORIZED)
+        text = await asyncio.to_thread(worker_metrics.render) if worker_metrics else registry.render()
+        return Response(
+            text=text,
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+
+    return [
+        web.get("/metrics", get_metrics)
+    ]
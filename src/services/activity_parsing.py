@@ -0,0 +1,94 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import json
+
+import botbuilder.schema
+from botbuilder.schema import Activity, ActivityTypes
+from msrest.serialization import Deserializer, Model
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library, which is several times slower
+    orjson = None
+
+# Schema models by name, as referenced in the attribute maps
+MODELS = {
+    name: model for name, model in vars(botbuilder.schema).items()
+    if isinstance(model, type) and issubclass(model, Model)
+}
+
+# Activity types the bot does not handle. They are acknowledged without running a turn.
+IGNORED_ACTIVITY_TYPES = [
+    ActivityTypes.typing,
+    ActivityTypes.message_reaction,
+    ActivityTypes.message_update,
+    ActivityTypes.message_delete,
+    ActivityTypes.installation_update,
+    ActivityTypes.contact_relation_update,
+    ActivityTypes.end_of_conversation,
+    ActivityTypes.trace,
+]
+
+_attributes = {}
+_deserializer = Deserializer(MODELS)
+
+
+def loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def is_ignorable(body: dict) -> bool:
+    """True for activities that need no turn, judged from the raw body before it is parsed."""
+    activity_type = body.get("type")
+    if activity_type in IGNORED_ACTIVITY_TYPES:
+        return True
+    # Only members joining get a welcome message
+    return activity_type == ActivityTypes.conversation_update and not body.get("membersAdded")
+
+
+def parse_activity(body: dict) -> Activity:
+    """Builds an Activity from its JSON body, like Activity().deserialize(body) but faster.
+
+    The generic msrest deserializer resolves the attribute map of every model
+    on every call. This keeps the maps per model, builds plain fields directly,
+    and only hands unusual types back to msrest.
+    """
+    return _build(Activity, body)
+
+
+def _build(model, data: dict):
+    attributes, keys = _model_attributes(model)
+    kwargs = {}
+    for attribute, key, data_type in attributes:
+        value = data.get(key)
+        if value is None:
+            continue
+        kwargs[attribute] = _convert(data_type, value)
+    instance = model(**kwargs)
+    # Like msrest, keeps unmapped properties, such as the text of Teams mention entities
+    if len(data) > len(kwargs):
+        instance.additional_properties = {key: value for key, value in data.items() if key not in keys}
+    return instance
+
+
+def _convert(data_type: str, value):
+    if data_type in ["str", "object", "bool", "int", "float", "{object}"]:
+        return value
+    if data_type.startswith("[") and isinstance(value, list):
+        item_type = data_type[1:-1]
+        return [_convert(item_type, item) for item in value]
+    if data_type in MODELS and isinstance(value, dict):
+        return _build(MODELS[data_type], value)
+    return _deserializer.deserialize_data(value, data_type)
+
+
+def _model_attributes(model):
+    attributes = _attributes.get(model)
+    if attributes is None:
+        mapped = [(attribute, info["key"], info["type"]) for attribute, info in model._attribute_map.items()]
+        attributes = (mapped, {key for _, key, _ in mapped})
+        _attributes[model] = attributes
+    return attributes
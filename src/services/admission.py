@@ -0,0 +1,206 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import asyncio
+import os
+import tempfile
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+try:
+    import fcntl
+except ImportError:  # Host-wide limits need POSIX file locks
+    fcntl = None
+
+from services.metrics import REGISTRY, MetricsRegistry
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Over capacity, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class HostSlots:
+    """A host-wide pool of slots shared by the worker processes, backed by file locks.
+
+    A slot is held for as long as its lock file is locked, so slots of a
+    worker that dies are released by the operating system.
+    """
+
+    def __init__(self, size: int, directory: str = None):
+        self.size = size
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "travel-agent-admission")
+        os.makedirs(self.directory, exist_ok=True)
+
+    def try_acquire(self):
+        for i in range(self.size):
+            fd = os.open(os.path.join(self.directory, f"slot-{i}.lock"), os.O_CREAT | os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except OSError:
+                os.close(fd)
+        return None
+
+    def release(self, fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+class AdmissionController:
+    """Bounds the number of agent runs in flight, per worker and per host.
+
+    Requests over the limit wait in per-user queues that are served round-robin,
+    so one chatty user cannot starve the others. When the queue is full, or a
+    request waited longer than max_wait, it is rejected with AdmissionRejected.
+    """
+
+    def __init__(
+            self,
+            max_in_flight: int = 16,
+            max_in_flight_host: int = 0,
+            max_queue: int = 64,
+            max_wait: float = 30,
+            retry_after: int = 10,
+            busy_message: str = "We are receiving a lot of messages right now. Please try again in a moment.",
+            slot_directory: str = None,
+            registry: MetricsRegistry = REGISTRY
+        ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.busy_message = busy_message
+        self.host_slots = HostSlots(max_in_flight_host, slot_directory) if max_in_flight_host and fcntl else None
+        self.in_flight = 0
+        self.queued = 0
+        self.queues = OrderedDict()
+        self.retry_handle = None
+
+        self.in_flight_gauge = registry.gauge("admission_in_flight", "Agent runs in flight in this worker")
+        self.queue_depth_gauge = registry.gauge("admission_queue_depth", "Turns waiting for an agent run slot")
+        self.wait_histogram = registry.histogram("admission_wait_seconds", "Time turns waited for an agent run slot")
+        self.rejected_counter = registry.counter("admission_rejected_total", "Turns shed because of capacity", ["reason"])
+
+    @staticmethod
+    def from_environment():
+        return AdmissionController(
+            max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 16)),
+            max_in_flight_host=int(os.getenv("ADMISSION_MAX_IN_FLIGHT_HOST", 0)),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", 64)),
+            max_wait=float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", 30)),
+            retry_after=int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", 10)),
+            busy_message=os.getenv("ADMISSION_BUSY_MESSAGE", "We are receiving a lot of messages right now. Please try again in a moment."),
+            slot_directory=os.getenv("ADMISSION_SLOT_DIRECTORY"),
+        )
+
+    def saturated(self) -> bool:
+        """True when a new request would be rejected right away."""
+        return self.in_flight >= self.max_in_flight and self.queued >= self.max_queue
+
+    @asynccontextmanager
+    async def admit(self, user_id: str):
+        slot = await self.acquire(user_id)
+        try:
+            yield
+        finally:
+            self.release(slot)
+
+    async def acquire(self, user_id: str):
+        start = time.monotonic()
+        if not self.queued and self.in_flight < self.max_in_flight:
+            slot = self.__take_host_slot()
+            if slot is not False:
+                self.__started(slot)
+                self.wait_histogram.observe(0)
+                return slot
+        if self.queued >= self.max_queue:
+            self.rejected_counter.inc(reason="queue_full")
+            raise AdmissionRejected(self.retry_after)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(user_id, deque()).append(waiter)
+        self.__set_queued(self.queued + 1)
+        self.dispatch()
+        try:
+            slot = await asyncio.wait_for(asyncio.shield(waiter), self.max_wait)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                self.__remove(user_id, waiter)
+                self.rejected_counter.inc(reason="timeout")
+                raise AdmissionRejected(self.retry_after)
+            slot = waiter.result()
+        except asyncio.CancelledError:
+            # Do not leak a slot handed over while the request went away
+            if waiter.done():
+                self.release(waiter.result())
+            else:
+                self.__remove(user_id, waiter)
+            raise
+        self.wait_histogram.observe(time.monotonic() - start)
+        return slot
+
+    def release(self, slot):
+        if slot is not None:
+            self.host_slots.release(slot)
+        self.in_flight -= 1
+        self.in_flight_gauge.set(self.in_flight)
+        self.dispatch()
+
+    def dispatch(self):
+        """Hands free slots to waiting requests, one user at a time."""
+        while self.queues and self.in_flight < self.max_in_flight:
+            user_id, waiters = next(iter(self.queues.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                self.queues.move_to_end(user_id)
+            else:
+                del self.queues[user_id]
+            self.__set_queued(self.queued - 1)
+            slot = self.__take_host_slot()
+            if slot is False:
+                # Other workers hold every host slot, check again shortly
+                self.queues[user_id] = self.queues.get(user_id, deque())
+                self.queues[user_id].appendleft(waiter)
+                self.queues.move_to_end(user_id, last=False)
+                self.__set_queued(self.queued + 1)
+                self.__schedule_retry()
+                return
+            self.__started(slot)
+            waiter.set_result(slot)
+
+    def __remove(self, user_id: str, waiter: asyncio.Future):
+        waiter.cancel()
+        waiters = self.queues.get(user_id)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self.queues[user_id]
+            self.__set_queued(self.queued - 1)
+
+    def __started(self, slot):
+        self.in_flight += 1
+        self.in_flight_gauge.set(self.in_flight)
+
+    def __set_queued(self, queued: int):
+        self.queued = queued
+        self.queue_depth_gauge.set(queued)
+
+    def __take_host_slot(self):
+        """Returns a host slot, None when there is no host limit, or False when none is free."""
+        if self.host_slots is None:
+            return None
+        slot = self.host_slots.try_acquire()
+        return False if slot is None else slot
+
+    def __schedule_retry(self):
+        if self.host_slots is None or self.retry_handle is not None:
+            return
+        def retry():
+            self.retry_handle = None
+            self.dispatch()
+            if self.queues:
+                self.__schedule_retry()
+        self.retry_handle = asyncio.get_running_loop().call_later(0.1, retry)
@@ -0,0 +1,143 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+
+from botbuilder.core.storage import Storage
+
+from data_models import ConversationData
+from services.metrics import REGISTRY, MetricsRegistry
+
+# Words that tie a question to the conversation so far, or to the moment it is asked
+CONTEXT_WORDS = [
+    "it", "its", "that", "this", "these", "those", "they", "them", "their", "there", "he", "she", "him", "her",
+    "above", "previous", "earlier", "again", "also", "else", "instead", "more", "same", "other",
+    "today", "tonight", "tomorrow", "yesterday", "now", "currently", "current", "latest", "next", "last", "recent",
+]
+QUESTION_WORDS = ["what", "which", "who", "when", "where", "how", "why", "is", "are", "can", "do", "does", "should"]
+
+
+class CachedAnswer:
+    def __init__(self, answer: str, expires_at: float, added_at: float):
+        self.answer = answer
+        self.expires_at = expires_at
+        # Start of the run that wrote the answer, older than any invalidation it missed
+        self.added_at = added_at
+
+
+class AnswerCache:
+    """Answers of context-free questions, reused across users until ttl or an invalidation.
+
+    A question is context-free when it stands alone: a single short question
+    with no word referring to earlier turns or to the current time, in a
+    conversation without files. Only the first turn of a conversation is
+    looked up or cached, see AssistantBot.run_agent. Answers are keyed on the
+    normalized question and the hash of the agent definition, so updating the
+    agent retires them.
+
+    Answers are kept in the memory of each worker. With a shared storage,
+    invalidations are recorded there, and every worker checks them before
+    reusing an answer.
+    """
+
+    INVALIDATED_KEY = "answer-cache/invalidated"
+
+    def __init__(self, agent_hash: str, ttl: float = 86400, max_size: int = 1000, max_words: int = 30, storage: Storage = None, registry: MetricsRegistry = REGISTRY):
+        self.agent_hash = agent_hash
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_words = max_words
+        self.answers = OrderedDict()
+        self.storage = storage
+        # Typical duration of the runs that answered cacheable questions
+        self.run_seconds = None
+        self.context_words = re.compile(r"\b(" + "|".join(CONTEXT_WORDS) + r")\b")
+
+        self.requests_counter = registry.counter("answer_cache_requests_total", "Context-free questions looked up in the answer cache, by result", ["result"])
+        self.saved_counter = registry.counter("answer_cache_seconds_saved_total", "Estimated agent run time saved by cached answers")
+
+    @staticmethod
+    def from_environment(agent_hash: str, storage: Storage = None):
+        return AnswerCache(
+            agent_hash,
+            ttl=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", 86400)),
+            max_size=int(os.getenv("ANSWER_CACHE_MAX_SIZE", 1000)),
+            storage=storage,
+        )
+
+    def is_context_free(self, texts: list[str], conversation_data: ConversationData) -> bool:
+        if len(texts) != 1 or conversation_data.attachments or getattr(conversation_data, "file_ids", None):
+            return False
+        words = normalize(texts[0]).split()
+        if not words or len(words) > self.max_words:
+            return False
+        if not texts[0].rstrip().endswith("?") and words[0] not in QUESTION_WORDS:
+            return False
+        return self.context_words.search(" ".join(words)) is None
+
+    async def get(self, question: str) -> str:
+        key = self.key(question)
+        cached = self.answers.get(key)
+        if cached is not None and cached.added_at <= await self.invalidated_at(key):
+            cached = None
+        if cached is None or cached.expires_at <= time.time():
+            self.answers.pop(key, None)
+            self.requests_counter.inc(result="miss")
+            return None
+        self.answers.move_to_end(key)
+        self.requests_counter.inc(result="hit")
+        if self.run_seconds:
+            self.saved_counter.inc(self.run_seconds)
+        return cached.answer
+
+    def add(self, question: str, answer: str, run_seconds: float):
+        now = time.time()
+        self.answers[self.key(question)] = CachedAnswer(answer, now + self.ttl, now - run_seconds)
+        while len(self.answers) > self.max_size:
+            self.answers.popitem(last=False)
+        self.run_seconds = run_seconds if self.run_seconds is None else 0.9 * self.run_seconds + 0.1 * run_seconds
+
+    async def invalidate(self, question: str = None) -> int:
+        """Drops the answer of a question, or every answer, in every worker.
+
+        Returns the number of answers dropped by this worker.
+        """
+        key = self.INVALIDATED_KEY if question is None else f"{self.INVALIDATED_KEY}/{self.key(question)}"
+        if self.storage:
+            await self.storage.write({key: {"invalidated_at": time.time(), "e_tag": "*"}})
+        if question is None:
+            count = len(self.answers)
+            self.answers.clear()
+            return count
+        return 1 if self.answers.pop(self.key(question), None) else 0
+
+    async def invalidated_at(self, key: str) -> float:
+        # Time of the last invalidation of every answer, or of this one, by any worker
+        if self.storage is None:
+            return 0
+        items = await self.storage.read([self.INVALIDATED_KEY, f"{self.INVALIDATED_KEY}/{key}"])
+        return max([item["invalidated_at"] for item in items.values()], default=0)
+
+    def stats(self) -> dict:
+        hits = self.requests_counter.get(result="hit")
+        misses = self.requests_counter.get(result="miss")
+        return {
+            # The answers and counters of this worker only
+            "scope": "worker",
+            "answers": len(self.answers),
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / (hits + misses) if hits + misses else 0,
+            "seconds_saved": self.saved_counter.get(),
+        }
+
+    def key(self, question: str) -> str:
+        return hashlib.sha256(f"{self.agent_hash}\n{normalize(question)}".encode()).hexdigest()
+
+
+def normalize(question: str) -> str:
+    return " ".join(re.sub(r"[^\w]+", " ", question.lower()).split())
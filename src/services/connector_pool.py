@@ -0,0 +1,117 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import logging
+from collections import OrderedDict
+
+from botbuilder.schema import Activity
+from botframework.connector.aio import ConnectorClient
+from botframework.connector.auth import (
+    AuthenticateRequestResult,
+    BotFrameworkAuthentication,
+    ClaimsIdentity,
+    ConnectorFactory,
+    UserTokenClient,
+)
+from botframework.connector.auth.authentication_constants import AuthenticationConstants
+
+from services.metrics import REGISTRY, MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class PooledBotFrameworkAuthentication(BotFrameworkAuthentication):
+    """Shares the connector and user token clients of CloudAdapter across turns.
+
+    The adapter asks for new clients on every turn. Each one builds its msrest
+    configuration and opens its own HTTP session, so no connection is reused
+    from one turn to the next. Here clients are kept per app id, service url
+    and audience, and their sessions keep connections to the channel alive.
+    """
+
+    def __init__(self, inner: BotFrameworkAuthentication, max_clients: int = 100, registry: MetricsRegistry = REGISTRY):
+        self.inner = inner
+        self.max_clients = max_clients
+        self.connector_clients = OrderedDict()
+        self.user_token_clients = OrderedDict()
+        self.created_counter = registry.counter("connector_clients_created_total", "Bot Connector clients created", ["kind"])
+
+    async def authenticate_request(self, activity: Activity, auth_header: str) -> AuthenticateRequestResult:
+        return self.__pooled(await self.inner.authenticate_request(activity, auth_header))
+
+    async def authenticate_streaming_request(self, auth_header: str, channel_id_header: str) -> AuthenticateRequestResult:
+        return self.__pooled(await self.inner.authenticate_streaming_request(auth_header, channel_id_header))
+
+    def create_connector_factory(self, claims_identity: ClaimsIdentity) -> ConnectorFactory:
+        return PooledConnectorFactory(self, self.inner.create_connector_factory(claims_identity), get_app_id(claims_identity))
+
+    async def create_user_token_client(self, claims_identity: ClaimsIdentity) -> UserTokenClient:
+        app_id = get_app_id(claims_identity)
+        client = self.user_token_clients.get(app_id)
+        if client is None:
+            client = await self.inner.create_user_token_client(claims_identity)
+            self.created_counter.inc(kind="user_token")
+            self.__add(self.user_token_clients, app_id, client)
+        return client
+
+    def create_bot_framework_client(self):
+        return self.inner.create_bot_framework_client()
+
+    def get_originating_audience(self) -> str:
+        return self.inner.get_originating_audience()
+
+    async def authenticate_channel_request(self, auth_header: str) -> ClaimsIdentity:
+        return await self.inner.authenticate_channel_request(auth_header)
+
+    async def connector_client(self, factory: ConnectorFactory, app_id: str, service_url: str, audience: str) -> ConnectorClient:
+        key = (app_id, service_url, audience)
+        client = self.connector_clients.get(key)
+        if client is None:
+            client = await factory.create(service_url, audience)
+            self.created_counter.inc(kind="connector")
+            self.__add(self.connector_clients, key, client)
+        else:
+            self.connector_clients.move_to_end(key)
+        return client
+
+    async def close(self):
+        for client in self.connector_clients.values():
+            try:
+                await client.__aexit__()
+            except Exception:
+                logger.exception("Failed to close a connector client")
+        self.connector_clients.clear()
+        self.user_token_clients.clear()
+
+    async def on_cleanup(self, app):
+        await self.close()
+
+    def __pooled(self, result: AuthenticateRequestResult) -> AuthenticateRequestResult:
+        # The adapter creates the connector of a turn with the factory of its authentication result
+        if result.connector_factory:
+            result.connector_factory = PooledConnectorFactory(self, result.connector_factory, get_app_id(result.claims_identity))
+        return result
+
+    def __add(self, clients: OrderedDict, key, client):
+        # Evicted clients may still be used by running turns, their sessions are closed when collected
+        clients[key] = client
+        while len(clients) > self.max_clients:
+            clients.popitem(last=False)
+
+
+class PooledConnectorFactory(ConnectorFactory):
+    def __init__(self, pool: PooledBotFrameworkAuthentication, inner: ConnectorFactory, app_id: str):
+        self.pool = pool
+        self.inner = inner
+        self.app_id = app_id
+
+    async def create(self, service_url: str, audience: str = None) -> ConnectorClient:
+        return await self.pool.connector_client(self.inner, self.app_id, service_url, audience)
+
+
+def get_app_id(claims_identity: ClaimsIdentity) -> str:
+    # Same lookup as the built in authentication: audience for channels, appid for the emulator
+    app_id = claims_identity.get_claim_value(AuthenticationConstants.AUDIENCE_CLAIM)
+    if app_id is None:
+        app_id = claims_identity.get_claim_value(AuthenticationConstants.APP_ID_CLAIM)
+    return app_id
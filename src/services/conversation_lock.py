@@ -0,0 +1,184 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import asyncio
+import os
+import socket
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+from botbuilder.core.storage import Storage
+
+
+class LeaseUnavailableError(Exception):
+    """Raised when a conversation stays leased by another worker past the wait timeout."""
+
+
+class ConversationLease:
+    """A time-limited lease on a conversation, kept in the bot state storage.
+
+    Leases coordinate turns across worker processes. A free conversation is
+    leased by creating its lease item, which only one worker can do when the
+    storage supports conditional creates (see create_item). An expired lease
+    is taken over by a write carrying its e_tag, which fails if another worker
+    took it first. Leases are renewed while held, deleted on release, and
+    expire if their owner dies.
+    """
+
+    def __init__(self, storage: Storage, duration: float = 120, poll_interval: float = 0.2):
+        self.storage = storage
+        self.duration = duration
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        # Expiry of the leases held by this worker, by owner token
+        self.expires_at: Dict[str, float] = {}
+
+    async def acquire(self, conversation_id: str, timeout: float = None) -> str:
+        """Waits until the lease is free and takes it. Returns the owner token, or None on timeout."""
+        key = self.__key(conversation_id)
+        owner = f"{self.worker_id}:{uuid.uuid4().hex}"
+        deadline = time.monotonic() + (timeout if timeout is not None else self.duration)
+        while True:
+            lease = self.__lease(owner)
+            if await create_item(self.storage, key, lease):
+                self.expires_at[owner] = lease["expires_at"]
+                return owner
+            lease = (await self.storage.read([key])).get(key)
+            if lease is not None and (lease.get("owner") is None or lease.get("expires_at", 0) < time.time()):
+                try:
+                    await self.__write(key, owner, lease)
+                    return owner
+                except Exception:
+                    # Another worker took the expired lease first
+                    pass
+            if time.monotonic() >= deadline:
+                return None
+            # Released in the meantime, try to create it again at once
+            if lease is not None:
+                await asyncio.sleep(self.poll_interval)
+
+    async def renew(self, conversation_id: str, owner: str) -> bool:
+        key = self.__key(conversation_id)
+        lease = (await self.storage.read([key])).get(key)
+        if lease is None or lease.get("owner") != owner:
+            return False
+        try:
+            await self.__write(key, owner, lease)
+            return True
+        except Exception:
+            return False
+
+    async def release(self, conversation_id: str, owner: str):
+        key = self.__key(conversation_id)
+        expires_at = self.expires_at.pop(owner, 0)
+        # Renewals keep a live lease at least two thirds of its duration away from expiry, nobody else can hold it
+        if expires_at - time.time() > self.duration / 3:
+            await self.storage.delete([key])
+            return
+        lease = (await self.storage.read([key])).get(key)
+        if lease is None or lease.get("owner") != owner:
+            return
+        try:
+            await self.__write(key, None, lease)
+        except Exception:
+            # The lease expires on its own
+            pass
+
+    @asynccontextmanager
+    async def hold(self, conversation_id: str):
+        owner = await self.acquire(conversation_id)
+        if owner is None:
+            raise LeaseUnavailableError(f"Conversation {conversation_id} is leased by another worker")
+        renewal = asyncio.create_task(self.__keep_alive(conversation_id, owner))
+        try:
+            yield owner
+        finally:
+            renewal.cancel()
+            await self.release(conversation_id, owner)
+
+    async def __keep_alive(self, conversation_id: str, owner: str):
+        while True:
+            await asyncio.sleep(self.duration / 3)
+            await self.renew(conversation_id, owner)
+
+    async def __write(self, key: str, owner: str, lease: dict):
+        change = self.__lease(owner)
+        if lease.get("e_tag"):
+            change["e_tag"] = lease["e_tag"]
+        await self.storage.write({key: change})
+        if owner:
+            self.expires_at[owner] = change["expires_at"]
+
+    def __lease(self, owner: str) -> dict:
+        return {"owner": owner, "expires_at": time.time() + self.duration if owner else 0}
+
+    @staticmethod
+    def __key(conversation_id: str) -> str:
+        return f"leases/{conversation_id}"
+
+
+async def create_item(storage: Storage, key: str, item: dict, ttl: float = None) -> bool:
+    """Writes an item only if its key does not exist yet. Returns False if it does.
+
+    Storages shared by processes implement create(), and expire the items
+    created with a ttl. Other storages, like MemoryStorage, are read then
+    written without yielding to other tasks, and ignore the ttl.
+    """
+    create = getattr(storage, "create", None)
+    if create is not None:
+        return await create(key, item, ttl)
+    if (await storage.read([key])).get(key) is not None:
+        return False
+    await storage.write({key: item})
+    return True
+
+
+class TurnSerializer:
+    """Processes the turns of each conversation one at a time.
+
+    An asyncio lock orders turns within the worker, and an optional
+    ConversationLease orders them across workers. Messages queued while a turn
+    is active are handed in one batch to the next turn that gets the lock, so a
+    burst of messages results in a single follow-up run.
+    """
+
+    QUEUED_KEY = "TurnSerializer.queued"
+
+    def __init__(self, lease: ConversationLease = None):
+        self.lease = lease
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self.waiters: Dict[str, int] = {}
+        self.pending: Dict[str, List[str]] = {}
+
+    @asynccontextmanager
+    async def turn(self, conversation_id: str):
+        lock = self.locks.setdefault(conversation_id, asyncio.Lock())
+        self.waiters[conversation_id] = self.waiters.get(conversation_id, 0) + 1
+        try:
+            async with lock:
+                if self.lease is None:
+                    yield
+                else:
+                    async with self.lease.hold(conversation_id):
+                        yield
+        finally:
+            self.waiters[conversation_id] -= 1
+            if self.waiters[conversation_id] == 0:
+                del self.waiters[conversation_id]
+                del self.locks[conversation_id]
+
+    def enqueue(self, conversation_id: str, text: str):
+        self.pending.setdefault(conversation_id, []).append(text)
+
+    def take_pending(self, conversation_id: str) -> List[str]:
+        return self.pending.pop(conversation_id, [])
+
+    def discard(self, conversation_id: str, text: str):
+        """Drops a queued message, for a turn that will not be processed."""
+        texts = self.pending.get(conversation_id, [])
+        if text in texts:
+            del texts[len(texts) - 1 - texts[::-1].index(text)]
+        if not texts:
+            self.pending.pop(conversation_id, None)
@@ -6,7 +6,9 @@
 from typing import Dict, List
 from threading import Lock, Semaphore
 import json
+import time
 
+from azure.core import MatchConditions
 from azure.cosmos import documents, PartitionKey, DatabaseProxy
 from azure.identity import ChainedTokenCredential
 from jsonpickle.pickler import Pickler
@@ -15,6 +17,12 @@ import azure.cosmos.cosmos_client as cosmos_client  # pylint: disable=no-name-in
 import azure.cosmos.errors as cosmos_errors  # pylint: disable=no-name-in-module,import-error
 from botbuilder.core.storage import Storage
 
+from services.metrics import REGISTRY
+from services.telemetry import current_span
+
+COSMOS_REQUEST_SECONDS = REGISTRY.histogram("cosmos_request_seconds", "Duration of Cosmos DB requests", ["operation"])
+COSMOS_REQUEST_CHARGE = REGISTRY.counter("cosmos_request_units_total", "Request units charged by Cosmos DB", ["operation"])
+
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 from hashlib import sha256
@@ -112,6 +120,7 @@ class CosmosDbPartitionedStorage(Storage):
         store_items = {}
 
         for key in keys:
+            start = time.perf_counter()
             try:
                 escaped_key = CosmosDbKeyEscape.sanitize_key(
                     key, self.config.key_suffix, self.config.compatibility_mode
@@ -136,6 +145,8 @@ class CosmosDbPartitionedStorage(Storage):
                 raise err
             except Exception as err:
                 raise err
+            finally:
+                self.__record_request("read", start)
         return store_items
 
     async def write(self, changes: Dict[str, object]):
@@ -167,20 +178,55 @@ class CosmosDbPartitionedStorage(Storage):
             if e_tag == "":
                 raise Exception("cosmosdb_storage.write(): etag missing")
 
-            access_condition = {
-                "accessCondition": {"type": "IfMatch", "condition": e_tag}
-            }
+            # Only overwrite the stored item if it did not change since it was read
             options = (
-                access_condition if e_tag != "*" and e_tag and e_tag != "" else None
+                {"etag": e_tag, "match_condition": MatchConditions.IfNotModified}
+                if e_tag != "*" and e_tag and e_tag != "" else {}
             )
+            start = time.perf_counter()
             try:
                 self.container.upsert_item(
-                    doc
+                    doc, **options
                 )
             except cosmos_errors.HttpResponseError as err:
                 raise err
             except Exception as err:
                 raise err
+            finally:
+                self.__record_request("write", start)
+
+    async def create(self, key: str, item: object, ttl: float = None) -> bool:
+        """Save a storeitem only if its key does not exist yet.
+
+        :param key:
+        :param item:
+        :param ttl: Seconds after which Cosmos DB deletes the item, needs a container with a default ttl
+        :return bool: False if the key exists
+        """
+        await self.initialize()
+
+        doc = {
+            "id": CosmosDbKeyEscape.sanitize_key(
+                key, self.config.key_suffix, self.config.compatibility_mode
+            ),
+            "realId": key,
+            "document": self.__create_dict(item),
+        }
+        if ttl is not None:
+            doc["ttl"] = max(int(ttl), 1)
+        start = time.perf_counter()
+        try:
+            self.container.create_item(doc)
+        except cosmos_errors.HttpResponseError as err:
+            if (
+                err.status_code
+                == cosmos_errors.http_constants.StatusCodes.CONFLICT
+            ):
+                return False
+            raise err
+        finally:
+            self.__record_request("create", start)
+        return True
 
     async def delete(self, keys: List[str]):
         """Remove storeitems from storage.
@@ -194,6 +240,7 @@ class CosmosDbPartitionedStorage(Storage):
             escaped_key = CosmosDbKeyEscape.sanitize_key(
                 key, self.config.key_suffix, self.config.compatibility_mode
             )
+            start = time.perf_counter()
             try:
                 self.container.delete_item(
                     self.__item_link(escaped_key)
@@ -207,6 +254,8 @@ class CosmosDbPartitionedStorage(Storage):
                 raise err
             except Exception as err:
                 raise err
+            finally:
+                self.__record_request("delete", start)
 
     async def initialize(self):
         if not self.container:
@@ -228,8 +277,22 @@ class CosmosDbPartitionedStorage(Storage):
                     self.config.container_id,
                     partition_key=PartitionKey(["/id"], kind=documents.PartitionKind.Hash),
                     offer_throughput=self.config.container_throughput,
+                    # Items only expire when created with a ttl, see create()
+                    default_ttl=-1,
                 )
 
+    def __record_request(self, operation: str, start: float):
+        """Records the duration and request charge of the last Cosmos DB request."""
+        COSMOS_REQUEST_SECONDS.observe(time.perf_counter() - start, operation=operation)
+        headers = self.container.client_connection.last_response_headers or {}
+        charge = headers.get("x-ms-request-charge")
+        if charge is None:
+            return
+        COSMOS_REQUEST_CHARGE.inc(float(charge), operation=operation)
+        span = current_span()
+        if span:
+            span.set_attribute("cosmos_request_charge", span.attributes.get("cosmos_request_charge", 0) + float(charge))
+
     def __get_partition_key(self, key: str) -> str:
         return None if self.compatability_mode_partition_key else key
 
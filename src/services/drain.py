@@ -0,0 +1,104 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable
+
+from botbuilder.core import TurnContext
+
+from services.metrics import REGISTRY, MetricsRegistry
+from services.turn_queue import TurnQueue
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerDrain:
+    """Lets the turns in flight finish when the worker stops, instead of cutting their answers.
+
+    Runs from the on_shutdown signal, after the listening sockets closed and
+    before aiohttp cancels the remaining handlers. New turns are refused with
+    503 from then on. Turns get timeout - cancel_grace seconds to finish; the
+    runs still streaming after that are cancelled, and their partial answer is
+    sent with the interrupted message. Cancelled turns still save their state.
+
+    run_registry is the RunRegistry of the bot, with its in-flight runs.
+    """
+
+    def __init__(
+            self,
+            run_registry,
+            turn_queue: TurnQueue = None,
+            timeout: float = 45,
+            cancel_grace: float = 10,
+            interrupted_message: str = "This answer was interrupted by a service restart. Please ask again.",
+            registry: MetricsRegistry = REGISTRY
+        ):
+        self.run_registry = run_registry
+        self.turn_queue = turn_queue
+        self.timeout = timeout
+        self.cancel_grace = cancel_grace
+        self.interrupted_message = interrupted_message
+        self.draining = False
+        self.in_flight = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+        self.in_flight_gauge = registry.gauge("turns_in_flight", "Turns being processed by this worker")
+        self.drain_histogram = registry.histogram("worker_drain_seconds", "Time the worker waited for its turns when stopping")
+        self.interrupted_counter = registry.counter("worker_drain_interrupted_turns_total", "Turns interrupted by a worker stop, by outcome", ["outcome"])
+
+    @staticmethod
+    def from_environment(run_registry, turn_queue: TurnQueue = None):
+        return WorkerDrain(
+            run_registry,
+            turn_queue,
+            timeout=float(os.getenv("DRAIN_TIMEOUT_SECONDS", 45)),
+            cancel_grace=float(os.getenv("DRAIN_CANCEL_GRACE_SECONDS", 10)),
+        )
+
+    def tracked(self, logic: Callable[[TurnContext], Awaitable]) -> Callable[[TurnContext], Awaitable]:
+        """Wraps turn logic so the drain waits for it."""
+        async def turn(turn_context: TurnContext):
+            self.in_flight += 1
+            self.in_flight_gauge.set(self.in_flight)
+            self.idle.clear()
+            try:
+                await logic(turn_context)
+            finally:
+                self.in_flight -= 1
+                self.in_flight_gauge.set(self.in_flight)
+                if self.in_flight == 0:
+                    self.idle.set()
+        return turn
+
+    async def drain(self):
+        self.draining = True
+        started = time.monotonic()
+        finished = await self.__wait(self.timeout - self.cancel_grace)
+        if not finished:
+            cancelled = self.run_registry.cancel_all(self.interrupted_message)
+            self.interrupted_counter.inc(cancelled, outcome="cancelled")
+            logger.warning("Drain deadline reached, cancelled %s runs", cancelled)
+            if not await self.__wait(self.cancel_grace):
+                # Left to aiohttp, which cancels their handlers
+                self.interrupted_counter.inc(self.in_flight, outcome="abandoned")
+                logger.warning("Worker stopping with %s turns in flight", self.in_flight)
+        self.drain_histogram.observe(time.monotonic() - started)
+
+    async def on_shutdown(self, app):
+        await self.drain()
+
+    async def __wait(self, timeout: float) -> bool:
+        async def drained():
+            # Queued activities are answered from background tasks, not request handlers
+            if self.turn_queue and self.turn_queue.queue:
+                await self.turn_queue.queue.join()
+            await self.idle.wait()
+        try:
+            await asyncio.wait_for(drained(), max(timeout, 0))
+            return True
+        except asyncio.TimeoutError:
+            return False
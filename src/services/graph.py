@@ -1,24 +1,105 @@
+import asyncio
 import json
+import time
 import requests
 
+# Requests per $batch call accepted by Microsoft Graph
+MAX_BATCH_SIZE = 20
+THROTTLED_STATUSES = [429, 503, 504]
+
 class GraphClient():
-    def __init__(self, endpoint="https://graph.microsoft.com/v1.0"):
+    def __init__(self, endpoint="https://graph.microsoft.com/v1.0", max_retries=3):
         self.endpoint = endpoint
-        pass
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        # Events waiting for the next $batch request, per user token
+        self.pending = {}
 
     def schedule_event(self, token: str, subject: str, start: str, end: str):
-        body = {
-            "subject": subject,
-            "start": {
-                "dateTime": start,
-                "timeZone": "UTC"
-            },
-            "end": {
-                "dateTime": end,
-                "timeZone": "UTC"
-            }
-        }
-        response = requests.post(f"{self.endpoint}/me/events", headers={"Authorization": f"Bearer {token}"}, json=body)
+        response = self.session.post(f"{self.endpoint}/me/events", headers={"Authorization": f"Bearer {token}"}, json=event_body(subject, start, end))
         response.raise_for_status()
         search_results = response.json()
-        return json.dumps(search_results)
\ No newline at end of file
+        return json.dumps(search_results)
+
+    async def schedule_event_batched(self, token: str, subject: str, start: str, end: str):
+        """Schedules the event with the other events requested in the same event loop iteration, in one $batch request.
+
+        The tool calls of an agent run are started together, so the events of a
+        tool round share a single Graph round trip.
+        """
+        loop = asyncio.get_running_loop()
+        result = loop.create_future()
+        if token not in self.pending:
+            self.pending[token] = []
+            loop.call_soon(lambda: asyncio.ensure_future(self.__flush(token)))
+        self.pending[token].append((event_body(subject, start, end), result))
+        return await result
+
+    async def __flush(self, token: str):
+        pending = self.pending.pop(token)
+        try:
+            outputs = await asyncio.to_thread(self.create_events, token, [body for body, _ in pending])
+        except Exception as error:
+            for _, result in pending:
+                if not result.done():
+                    result.set_exception(error)
+            return
+        for (_, result), output in zip(pending, outputs):
+            # Results of cancelled turns are dropped
+            if not result.done():
+                result.set_result(output)
+
+    def create_events(self, token: str, bodies: list[dict]) -> list[str]:
+        """Creates calendar events with $batch requests, and returns the JSON output of each, in order.
+
+        Throttled requests are retried after the delay Graph asks for. Failed
+        requests return their error, so one failure does not fail the others.
+        """
+        outputs = [None] * len(bodies)
+        for offset in range(0, len(bodies), MAX_BATCH_SIZE):
+            chunk = dict(enumerate(bodies[offset:offset + MAX_BATCH_SIZE], offset))
+            for attempt in range(self.max_retries + 1):
+                throttled = []
+                for response in self.__post_batch(token, chunk):
+                    if response["status"] in THROTTLED_STATUSES and attempt < self.max_retries:
+                        throttled.append(response)
+                    else:
+                        outputs[int(response["id"])] = json.dumps(response.get("body") or {"status": response["status"]})
+                if not throttled:
+                    break
+                chunk = {int(response["id"]): chunk[int(response["id"])] for response in throttled}
+                time.sleep(max(retry_after(response, attempt) for response in throttled))
+        return outputs
+
+    def __post_batch(self, token: str, chunk: dict) -> list[dict]:
+        batch = {"requests": [
+            {"id": str(i), "method": "POST", "url": "/me/events", "headers": {"Content-Type": "application/json"}, "body": body}
+            for i, body in chunk.items()
+        ]}
+        for attempt in range(self.max_retries + 1):
+            response = self.session.post(f"{self.endpoint}/$batch", headers={"Authorization": f"Bearer {token}"}, json=batch)
+            if response.status_code not in THROTTLED_STATUSES or attempt == self.max_retries:
+                break
+            time.sleep(retry_after({"headers": response.headers}, attempt))
+        response.raise_for_status()
+        return response.json()["responses"]
+
+def event_body(subject: str, start: str, end: str) -> dict:
+    return {
+        "subject": subject,
+        "start": {
+            "dateTime": start,
+            "timeZone": "UTC"
+        },
+        "end": {
+            "dateTime": end,
+            "timeZone": "UTC"
+        }
+    }
+
+def retry_after(response: dict, attempt: int) -> float:
+    headers = {key.lower(): value for key, value in (response.get("headers") or {}).items()}
+    try:
+        return float(headers["retry-after"])
+    except (KeyError, ValueError):
+        return min(2 ** attempt, 30)
@@ -0,0 +1,236 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import asyncio
+import logging
+import os
+import time
+import zlib
+
+from azure.ai.projects.operations import AgentsOperations
+from azure.core.exceptions import ResourceNotFoundError
+from botbuilder.core.storage import Storage
+
+from services.conversation_lock import ConversationLease
+from services.metrics import REGISTRY, MetricsRegistry
+from services.telemetry import TRACER
+
+logger = logging.getLogger(__name__)
+
+
+class JanitorReport:
+    """What a sweep reclaimed."""
+
+    def __init__(self):
+        self.conversations = 0
+        self.threads = 0
+        self.files = 0
+        self.vector_stores = 0
+        self.failures = 0
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class ResourceJanitor:
+    """Deletes the agent threads, files and vector stores of conversations idle for idle_after seconds.
+
+    Conversations record the files they own and the time of their last message
+    in their state. The janitor keeps an index of conversations and their last
+    activity in the same storage, in shards, because bot storage cannot be
+    listed. Touches are buffered and merged into the index every flush_interval.
+
+    A sweep confirms idleness against the conversation state, clears the
+    conversation like 'clear' does, then deletes its resources at a limited
+    rate. One worker sweeps at a time, under a storage lease.
+    """
+
+    def __init__(
+            self,
+            storage: Storage,
+            agents_client: AgentsOperations,
+            property_name: str = "ConversationData",
+            idle_after: float = 7 * 24 * 3600,
+            interval: float = 3600,
+            flush_interval: float = 60,
+            deletes_per_second: float = 5,
+            concurrency: int = 5,
+            shards: int = 16,
+            registry: MetricsRegistry = REGISTRY
+        ):
+        self.storage = storage
+        self.agents_client = agents_client
+        self.property_name = property_name
+        self.idle_after = idle_after
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.deletes_per_second = deletes_per_second
+        self.concurrency = concurrency
+        self.shards = shards
+        self.lease = ConversationLease(storage, duration=max(interval, 60))
+        self.touched = {}
+        self.task: asyncio.Task = None
+
+        self.reclaimed_counter = registry.counter("janitor_reclaimed_total", "Agent resources deleted by the janitor, by kind", ["kind"])
+        self.failures_counter = registry.counter("janitor_failures_total", "Agent resources the janitor failed to delete, by kind", ["kind"])
+        self.sweep_histogram = registry.histogram("janitor_sweep_seconds", "Duration of janitor sweeps")
+
+    @staticmethod
+    def from_environment(storage: Storage, agents_client: AgentsOperations):
+        return ResourceJanitor(
+            storage,
+            agents_client,
+            idle_after=float(os.getenv("JANITOR_IDLE_AFTER_SECONDS", 7 * 24 * 3600)),
+            interval=float(os.getenv("JANITOR_INTERVAL_SECONDS", 3600)),
+            deletes_per_second=float(os.getenv("JANITOR_DELETES_PER_SECOND", 5)),
+        )
+
+    def touch(self, state_key: str, timestamp: float = None):
+        """Records activity on the conversation stored under state_key, for the next index flush."""
+        self.touched[state_key] = timestamp or time.time()
+
+    async def flush(self):
+        """Merges the buffered touches into the index. Touches that could not be written are kept."""
+        touched, self.touched = self.touched, {}
+        by_shard = {}
+        for state_key, timestamp in touched.items():
+            by_shard.setdefault(self.__shard(state_key), {})[state_key] = timestamp
+        for shard, touches in by_shard.items():
+            def merge(conversations: dict):
+                for state_key, timestamp in touches.items():
+                    conversations[state_key] = max(conversations.get(state_key, 0), timestamp)
+            if not await self.__update_shard(shard, merge):
+                for state_key, timestamp in touches.items():
+                    self.touched[state_key] = max(self.touched.get(state_key, 0), timestamp)
+
+    async def sweep(self) -> JanitorReport:
+        """Reclaims the resources of idle conversations, and returns what was reclaimed."""
+        report = JanitorReport()
+        # The lease is left to expire, so the workers sharing the storage sweep once per interval
+        if await self.lease.acquire("janitor", timeout=0) is None:
+            return report
+        with TRACER.span("janitor.sweep") as span:
+            await self.flush()
+            cutoff = time.time() - self.idle_after
+            for shard in range(self.shards):
+                key = self.__shard_key(shard)
+                document = (await self.storage.read([key])).get(key) or {}
+                idle = [state_key for state_key, timestamp in document.get("conversations", {}).items() if timestamp < cutoff]
+                reclaimed = [state_key for state_key in idle if await self.__reclaim(state_key, cutoff, report)]
+
+                def remove(conversations: dict):
+                    for state_key in reclaimed:
+                        # Unless the conversation was touched again since the shard was read
+                        if conversations.get(state_key, 0) < cutoff:
+                            conversations.pop(state_key, None)
+
+                if reclaimed:
+                    await self.__update_shard(shard, remove)
+            span.set_attribute("report", report.to_dict())
+        self.sweep_histogram.observe(span.duration)
+        if report.conversations or report.failures:
+            logger.info("Janitor reclaimed %s", report.to_dict())
+        return report
+
+    async def on_startup(self, app):
+        self.task = asyncio.create_task(self.__run())
+
+    async def on_cleanup(self, app):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        await self.flush()
+
+    async def __run(self):
+        next_sweep = time.monotonic() + self.interval
+        while True:
+            await asyncio.sleep(min(self.flush_interval, self.interval))
+            try:
+                await self.flush()
+                if time.monotonic() >= next_sweep:
+                    next_sweep = time.monotonic() + self.interval
+                    await self.sweep()
+            except Exception:
+                logger.exception("Janitor sweep failed")
+
+    async def __reclaim(self, state_key: str, cutoff: float, report: JanitorReport) -> bool:
+        """Clears an idle conversation and deletes its resources. Returns False if it is no longer idle."""
+        document = (await self.storage.read([state_key])).get(state_key)
+        conversation_data = document.get(self.property_name) if document else None
+        if conversation_data is None:
+            return True
+        if (getattr(conversation_data, "last_activity", None) or 0) >= cutoff:
+            return False
+        thread_id = conversation_data.thread_id
+        file_ids = list(getattr(conversation_data, "file_ids", None) or [])
+        if thread_id is None and not file_ids:
+            return True
+        conversation_data.thread_id = None
+        conversation_data.file_ids = []
+        conversation_data.attachments = []
+        conversation_data.history = []
+        try:
+            # The e_tag of the read makes the write fail if a turn saved the conversation meanwhile
+            await self.storage.write({state_key: document})
+        except Exception:
+            return False
+
+        report.conversations += 1
+        vector_store_ids = []
+        if thread_id:
+            try:
+                thread = await asyncio.to_thread(self.agents_client.get_thread, thread_id)
+                vector_store_ids = get_vector_store_ids(thread)
+            except ResourceNotFoundError:
+                pass
+            except Exception:
+                logger.exception("Failed to read thread %s", thread_id)
+            await self.__delete("threads", self.agents_client.delete_thread, [thread_id], report)
+        await self.__delete("vector_stores", self.agents_client.delete_vector_store, vector_store_ids, report)
+        await self.__delete("files", self.agents_client.delete_file, file_ids, report)
+        return True
+
+    async def __delete(self, kind: str, delete, ids: list[str], report: JanitorReport):
+        for offset in range(0, len(ids), self.concurrency):
+            batch = ids[offset:offset + self.concurrency]
+            started = time.monotonic()
+            results = await asyncio.gather(*[asyncio.to_thread(delete, resource_id) for resource_id in batch], return_exceptions=True)
+            for resource_id, result in zip(batch, results):
+                if isinstance(result, Exception) and not isinstance(result, ResourceNotFoundError):
+                    logger.warning("Failed to delete %s %s: %r", kind, resource_id, result)
+                    self.failures_counter.inc(kind=kind)
+                    report.failures += 1
+                    continue
+                self.reclaimed_counter.inc(kind=kind)
+                setattr(report, kind, getattr(report, kind) + 1)
+            # Keep under the delete rate of the project
+            if self.deletes_per_second > 0:
+                await asyncio.sleep(max(len(batch) / self.deletes_per_second - (time.monotonic() - started), 0))
+
+    async def __update_shard(self, shard: int, update, attempts: int = 3) -> bool:
+        key = self.__shard_key(shard)
+        for _ in range(attempts):
+            document = (await self.storage.read([key])).get(key) or {"conversations": {}}
+            update(document["conversations"])
+            try:
+                await self.storage.write({key: document})
+                return True
+            except Exception:
+                # Another worker updated the shard since it was read
+                continue
+        logger.warning("Failed to update janitor index shard %s", shard)
+        return False
+
+    def __shard(self, state_key: str) -> int:
+        return zlib.crc32(state_key.encode()) % self.shards
+
+    @staticmethod
+    def __shard_key(shard: int) -> str:
+        return f"janitor/conversations/{shard}"
+
+
+def get_vector_store_ids(thread) -> list[str]:
+    """The vector stores the service created for the file search attachments of a thread."""
+    tool_resources = getattr(thread, "tool_resources", None)
+    file_search = getattr(tool_resources, "file_search", None) if tool_resources else None
+    return list(getattr(file_search, "vector_store_ids", None) or [])
@@ -0,0 +1,160 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from services.metrics import REGISTRY, MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+# Application packages, used to attribute a blocked loop to the code that blocked it
+SOURCE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APPLICATION_PACKAGES = ["bots", "dialogs", "routes", "services", "tools", "utils", "data_models"]
+
+
+class LoopMonitor:
+    """Measures the lag of the event loop, and samples the stack when the loop is blocked.
+
+    A task on the loop ticks every interval, and the lag is how late each tick
+    wakes up. A watchdog thread checks the time of the last tick, and once the
+    loop has not ticked for longer than threshold, it captures the stack of the
+    loop thread. The stack is attributed to the innermost application frame,
+    and to the route that handles the request. The block is logged and counted
+    when the loop ticks again, with the lag of that tick as its duration.
+    """
+
+    def __init__(
+            self,
+            interval: float = 0.1,
+            threshold: float = 0.25,
+            max_reports: int = 50,
+            registry: MetricsRegistry = REGISTRY
+        ):
+        self.interval = interval
+        self.threshold = threshold
+        self.reports = deque(maxlen=max_reports)
+        self.last_tick = None
+        self.loop_thread_id = None
+        self.task = None
+        self.watchdog = None
+        self.stopped = threading.Event()
+        # Stack sampled by the watchdog, and the tick it was blocked after, reported on the next tick
+        self.sample = None
+        self.sample_lock = threading.Lock()
+
+        self.lag_histogram = registry.histogram(
+            "event_loop_lag_seconds", "Delay of event loop ticks",
+            buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+        )
+        self.blocked_counter = registry.counter("event_loop_blocked_total", "Times the event loop was blocked", ["route", "location"])
+        self.blocked_seconds = registry.counter("event_loop_blocked_seconds_total", "Time the event loop was blocked", ["route", "location"])
+
+    @staticmethod
+    def from_environment():
+        return LoopMonitor(
+            interval=float(os.getenv("LOOP_MONITOR_INTERVAL_SECONDS", 0.1)),
+            threshold=float(os.getenv("LOOP_MONITOR_THRESHOLD_SECONDS", 0.25)),
+        )
+
+    def start(self):
+        self.loop_thread_id = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self.stopped.clear()
+        self.task = asyncio.get_running_loop().create_task(self.__tick())
+        self.watchdog = threading.Thread(target=self.__watch, name="loop-monitor", daemon=True)
+        self.watchdog.start()
+
+    async def stop(self):
+        self.stopped.set()
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+    async def on_startup(self, app):
+        self.start()
+
+    async def on_cleanup(self, app):
+        await self.stop()
+
+    async def __tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            previous_tick = self.last_tick
+            self.last_tick = now
+            lag = max(now - expected, 0)
+            self.lag_histogram.observe(lag)
+            with self.sample_lock:
+                sample, self.sample = self.sample, None
+            if sample and sample[0] == previous_tick:
+                self.report(sample[1], lag)
+
+    def __watch(self):
+        sampled_tick = None
+        while not self.stopped.wait(self.interval / 2):
+            last_tick = self.last_tick
+            blocked = time.monotonic() - last_tick
+            if blocked < self.threshold:
+                continue
+            if sampled_tick == last_tick:
+                # One sample per blocking call
+                continue
+            sampled_tick = last_tick
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is not None:
+                stack = traceback.extract_stack(frame)
+                with self.sample_lock:
+                    self.sample = (last_tick, stack)
+
+    def report(self, stack: traceback.StackSummary, blocked: float):
+        route, location = attribute(stack)
+        self.blocked_counter.inc(route=route, location=location)
+        self.blocked_seconds.inc(blocked, route=route, location=location)
+        self.reports.append({
+            "time": time.time(),
+            "blocked_seconds": blocked,
+            "route": route,
+            "location": location,
+            "stack": stack.format(),
+        })
+        logger.warning(
+            "Event loop blocked for %.3fs in %s (route %s)\n%s",
+            blocked, location, route, "".join(stack.format())
+        )
+
+
+def attribute(stack: traceback.StackSummary):
+    """Returns the route and the innermost application function of a stack."""
+    route = "unknown"
+    location = "unknown"
+    for frame in stack:
+        package = application_package(frame.filename)
+        if package is None:
+            continue
+        name = f"{os.path.relpath(os.path.abspath(frame.filename), SOURCE_DIRECTORY)}:{frame.name}"
+        if package == "routes" and route == "unknown":
+            route = name
+        location = name
+    return route, location
+
+
+def application_package(filename: str) -> str:
+    path = os.path.abspath(filename)
+    if not path.startswith(SOURCE_DIRECTORY + os.sep) or "site-packages" in path:
+        return None
+    package = os.path.relpath(path, SOURCE_DIRECTORY).split(os.sep)[0]
+    if package.endswith(".py"):
+        package = package[:-3]
+    return package if package in APPLICATION_PACKAGES else None
@@ -0,0 +1,243 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Metric:
+    """A named metric with optional labels, rendered in the Prometheus text format."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: List[str] = None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = list(labels or [])
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.label_names)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Dict[str, str] = None) -> str:
+        pairs = list(zip(self.label_names, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        escaped = [
+            '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in pairs
+        ]
+        return "{" + ",".join(escaped) + "}"
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self, extra: Dict[str, str] = None) -> List[str]:
+        with self.lock:
+            return [f"{self.name}{self._format_labels(key, extra)} {value}" for key, value in self.values.items()]
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+    def render(self, extra: Dict[str, str] = None) -> str:
+        return "\n".join(self.header() + self.samples(extra))
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: List[str] = None, buckets: List[float] = None):
+        super().__init__(name, documentation, labels)
+        self.buckets = sorted(buckets or DEFAULT_BUCKETS)
+        self.counts: Dict[Tuple[str, ...], List[int]] = {}
+        self.sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.sums[key] = self.sums.get(key, 0) + value
+
+    def get(self, **labels) -> float:
+        """Returns the number of observations."""
+        counts = self.counts.get(self._key(labels))
+        return counts[-1] if counts else 0
+
+    def get_sum(self, **labels) -> float:
+        return self.sums.get(self._key(labels), 0)
+
+    def samples(self, extra: Dict[str, str] = None) -> List[str]:
+        extra = extra or {}
+        lines = []
+        with self.lock:
+            for key, counts in self.counts.items():
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{self._format_labels(key, {**extra, 'le': str(bound)})} {count}")
+                lines.append(f"{self.name}_bucket{self._format_labels(key, {**extra, 'le': '+Inf'})} {counts[-1]}")
+                lines.append(f"{self.name}_sum{self._format_labels(key, extra)} {self.sums[key]}")
+                lines.append(f"{self.name}_count{self._format_labels(key, extra)} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds the metrics of this worker process."""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.lock = threading.Lock()
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, *args, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name: str, documentation: str, labels: List[str] = None) -> Counter:
+        return self._register(Counter, name, documentation, labels)
+
+    def gauge(self, name: str, documentation: str, labels: List[str] = None) -> Gauge:
+        return self._register(Gauge, name, documentation, labels)
+
+    def histogram(self, name: str, documentation: str, labels: List[str] = None, buckets: List[float] = None) -> Histogram:
+        return self._register(Histogram, name, documentation, labels, buckets)
+
+    def render(self, extra: Dict[str, str] = None) -> str:
+        return "\n".join(metric.render(extra) for metric in self.metrics.values()) + "\n"
+
+    def families(self, extra: Dict[str, str] = None) -> Dict[str, dict]:
+        """Returns the header and samples of each metric, to merge them with those of other workers."""
+        return {name: {"header": metric.header(), "samples": metric.samples(extra)} for name, metric in self.metrics.items()}
+
+
+# Default registry shared by the whole worker
+REGISTRY = MetricsRegistry()
+
+
+class WorkerMetrics:
+    """Serves the metrics of every worker of the host, whichever worker answers the scrape.
+
+    Each worker writes its samples, labelled with its worker id, to a snapshot
+    file in a directory shared by the host, every interval seconds. A scrape
+    returns the live samples of the worker that answers it and the latest
+    snapshots of the others. Snapshots of workers that stopped updating them
+    for max_age seconds are skipped.
+    """
+
+    def __init__(self, directory: str, interval: float = 10, max_age: float = 60, registry: MetricsRegistry = REGISTRY):
+        self.directory = directory
+        self.interval = interval
+        self.max_age = max_age
+        self.registry = registry
+        self.task: asyncio.Task = None
+
+    @staticmethod
+    def from_environment():
+        return WorkerMetrics(
+            os.getenv("METRICS_DIRECTORY") or os.path.join(tempfile.gettempdir(), "travel-agent-metrics"),
+            interval=float(os.getenv("METRICS_SNAPSHOT_INTERVAL_SECONDS", 10)),
+        )
+
+    @property
+    def worker(self) -> str:
+        # Read on use, the registry may have been created before gunicorn forked the worker
+        return str(os.getpid())
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"{self.worker}.json")
+
+    def snapshot(self):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.registry.families({"worker": self.worker}), f)
+        os.replace(temporary, self.path)
+
+    def render(self) -> str:
+        merged = self.registry.families({"worker": self.worker})
+        for snapshot in self.__snapshots():
+            for name, family in snapshot.items():
+                if name in merged:
+                    merged[name]["samples"].extend(family["samples"])
+                else:
+                    merged[name] = family
+        return "\n".join("\n".join(family["header"] + family["samples"]) for family in merged.values()) + "\n"
+
+    async def on_startup(self, app):
+        self.task = asyncio.create_task(self.__run())
+
+    async def on_cleanup(self, app):
+        if self.task:
+            self.task.cancel()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    async def __run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.snapshot)
+            except Exception:
+                logger.exception("Failed to write the metrics snapshot of this worker")
+            await asyncio.sleep(self.interval)
+
+    def __snapshots(self) -> List[dict]:
+        snapshots = []
+        if not os.path.isdir(self.directory):
+            return snapshots
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".json") or path == self.path:
+                continue
+            try:
+                if now - os.path.getmtime(path) > self.max_age:
+                    continue
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # Removed, or being replaced, by its worker
+                continue
+        return snapshots
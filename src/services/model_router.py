@@ -0,0 +1,68 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import os
+import re
+
+from data_models import ConversationData
+from services.metrics import REGISTRY, MetricsRegistry
+
+FAST = "fast"
+FULL = "full"
+
+# Words of requests that need tools, files or several reasoning steps
+FULL_TIER_KEYWORDS = [
+    "search", "find", "look up", "latest", "news", "weather", "price", "book", "booking", "hotel", "flight",
+    "schedule", "meeting", "calendar", "event", "image", "picture", "photo", "file", "document", "pdf",
+    "plan", "itinerary", "compare", "calculate", "chart", "code", "analyze", "explain", "why", "how do",
+]
+
+
+class ModelRouter:
+    """Picks the agent of each turn: a fast agent on a smaller deployment, or the full agent.
+
+    The fast agent has no tools. Turns go to it only when they are short, have
+    no keyword hinting at tools or several reasoning steps, and the conversation
+    has no files. Everything else, and every turn when no fast agent is
+    configured, runs on the full agent. Both agents share the thread.
+    """
+
+    def __init__(self, fast_agent_id: str = None, max_words: int = 12, keywords: list[str] = FULL_TIER_KEYWORDS, registry: MetricsRegistry = REGISTRY):
+        self.fast_agent_id = fast_agent_id
+        self.max_words = max_words
+        self.keywords = re.compile(r"\b(" + "|".join(re.escape(keyword) for keyword in keywords) + r")\b", re.IGNORECASE)
+
+        self.decisions_counter = registry.counter("model_routing_decisions_total", "Agent runs per tier, by routing reason", ["tier", "reason"])
+        self.turn_histogram = registry.histogram("model_routing_turn_seconds", "Time from the start of an agent run to its answer, per tier", ["tier"])
+
+    @staticmethod
+    def from_environment(fast_agent_id: str = None):
+        keywords = os.getenv("ROUTER_FULL_TIER_KEYWORDS")
+        return ModelRouter(
+            fast_agent_id,
+            max_words=int(os.getenv("ROUTER_FAST_TIER_MAX_WORDS", 12)),
+            keywords=[keyword.strip() for keyword in keywords.split(",") if keyword.strip()] if keywords else FULL_TIER_KEYWORDS,
+        )
+
+    def route(self, texts: list[str], conversation_data: ConversationData) -> tuple[str, str]:
+        """Returns the tier of the turn and the reason for it."""
+        tier, reason = self.classify(texts, conversation_data)
+        self.decisions_counter.inc(tier=tier, reason=reason)
+        return tier, reason
+
+    def classify(self, texts: list[str], conversation_data: ConversationData) -> tuple[str, str]:
+        if self.fast_agent_id is None:
+            return FULL, "disabled"
+        if conversation_data.attachments or getattr(conversation_data, "file_ids", None):
+            return FULL, "files"
+        text = " ".join(texts)
+        if len(text.split()) > self.max_words:
+            return FULL, "length"
+        if text.count("?") > 1:
+            return FULL, "questions"
+        if self.keywords.search(text):
+            return FULL, "keyword"
+        return FAST, "simple"
+
+    def observe(self, tier: str, seconds: float):
+        self.turn_histogram.observe(seconds, tier=tier)
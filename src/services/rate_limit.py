@@ -0,0 +1,223 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import asyncio
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from typing import Callable
+
+try:
+    import fcntl
+except ImportError:  # Sharing the bucket across workers needs POSIX file locks
+    fcntl = None
+
+from services.metrics import REGISTRY, MetricsRegistry
+
+# Rough cost of an image in a vision prompt, in tokens
+IMAGE_TOKENS = 765
+
+
+class BucketState:
+    """The bucket levels, kept in a locked file so every worker of the host shares them."""
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.memory = {}
+
+    def update(self, change: Callable[[dict], object]):
+        """Applies change to the state atomically and returns its result."""
+        with self.lock:
+            if self.path is None or fcntl is None:
+                return change(self.memory)
+            with open(self.path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    content = f.read()
+                    state = json.loads(content) if content else {}
+                    result = change(state)
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                    return result
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class RateLimiter:
+    """A token bucket for model tokens and requests, shared by the workers of a host.
+
+    Calls reserve an estimate of the tokens they will use before they start.
+    Estimates come from the prompt size, and are corrected from the usage the
+    service reports. A 429 from the service, or an agent run that failed with
+    rate_limit_exceeded, pauses the bucket for every worker until the
+    retry-after time passed. A limit of 0 disables that bucket, and both are
+    disabled unless configured.
+    """
+
+    def __init__(
+            self,
+            tokens_per_minute: int,
+            requests_per_minute: int,
+            state_path: str = None,
+            max_retries: int = 5,
+            registry: MetricsRegistry = REGISTRY
+        ):
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.state = BucketState(state_path)
+        self.max_retries = max_retries
+        # Ratio of reported to estimated usage, and typical usage per call, by kind of call
+        self.correction = {}
+        self.typical_usage = {}
+
+        self.wait_histogram = registry.histogram("rate_limit_wait_seconds", "Time calls waited for rate limit tokens", ["kind"])
+        self.throttled_counter = registry.counter("rate_limit_throttled_total", "Calls throttled by the service", ["kind"])
+        self.tokens_counter = registry.counter("rate_limit_tokens_total", "Tokens used, as reported by the service", ["kind"])
+
+    @staticmethod
+    def from_environment():
+        return RateLimiter(
+            tokens_per_minute=int(os.getenv("AZURE_OPENAI_TOKENS_PER_MINUTE", 0)),
+            requests_per_minute=int(os.getenv("AZURE_OPENAI_REQUESTS_PER_MINUTE", 0)),
+            state_path=os.getenv("RATE_LIMIT_STATE_FILE", os.path.join(tempfile.gettempdir(), "travel-agent-rate-limit.json")),
+            max_retries=int(os.getenv("RATE_LIMIT_MAX_RETRIES", 5)),
+        )
+
+    def estimate_chat_tokens(self, messages: list, max_tokens: int = 1000) -> int:
+        characters = 0
+        images = 0
+        for message in messages:
+            content = message["content"]
+            if isinstance(content, str):
+                characters += len(content)
+                continue
+            for part in content:
+                if part["type"] == "text":
+                    characters += len(part["text"])
+                else:
+                    images += 1
+        estimate = characters // 4 + images * IMAGE_TOKENS + max_tokens
+        return int(estimate * self.correction.get("chat", 1))
+
+    def estimate_run_tokens(self) -> int:
+        return int(self.typical_usage.get("run", 4000))
+
+    async def acquire(self, tokens: int, kind: str = "chat"):
+        """Waits until the bucket holds the tokens and a request, and takes them."""
+        start = time.monotonic()
+        tokens = min(tokens, self.tokens_per_minute) if self.tokens_per_minute > 0 else 0
+        while True:
+            wait = self.state.update(lambda state: self.__take(state, tokens))
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        self.wait_histogram.observe(time.monotonic() - start, kind=kind)
+
+    def record_usage(self, kind: str, reserved: int, used: int):
+        """Settles a reservation with the usage the service reported."""
+        self.tokens_counter.inc(used, kind=kind)
+        if self.tokens_per_minute > 0:
+            self.state.update(lambda state: state.update(tokens=min(state.get("tokens", self.tokens_per_minute) + reserved - used, self.tokens_per_minute)))
+        if reserved > 0:
+            ratio = used * self.correction.get(kind, 1) / reserved
+            self.correction[kind] = 0.8 * self.correction.get(kind, 1) + 0.2 * ratio
+        self.typical_usage[kind] = 0.8 * self.typical_usage.get(kind, used) + 0.2 * used
+
+    def release(self, reserved: int):
+        """Returns the tokens of a call that used none, or reported no usage, to the bucket."""
+        if self.tokens_per_minute > 0 and reserved > 0:
+            self.state.update(lambda state: state.update(tokens=min(state.get("tokens", self.tokens_per_minute) + reserved, self.tokens_per_minute)))
+
+    def throttled(self, kind: str, attempt: int, delay: float = None) -> float:
+        """Pauses the bucket after the service throttled a call, and returns the delay before retrying it."""
+        self.throttled_counter.inc(kind=kind)
+        if delay is None:
+            delay = min(2 ** attempt, 30)
+        # Jitter keeps the workers from retrying in lockstep
+        delay *= random.uniform(1, 1.25)
+        self.pause(delay)
+        return delay
+
+    def pause(self, seconds: float):
+        """Stops every worker from calling the service for a while."""
+        until = time.time() + seconds
+        self.state.update(lambda state: state.update(paused_until=max(state.get("paused_until", 0), until)))
+
+    async def call(self, kind: str, tokens: int, function: Callable, *args, **kwargs):
+        """Calls a blocking service function within the rate limit, retrying when throttled."""
+        return await self.call_async(kind, tokens, asyncio.to_thread, function, *args, **kwargs)
+
+    async def call_async(self, kind: str, tokens: int, function: Callable, *args, **kwargs):
+        """Awaits a service coroutine function within the rate limit, retrying when throttled."""
+        await self.acquire(tokens, kind)
+        attempt = 0
+        while True:
+            try:
+                return await function(*args, **kwargs)
+            except Exception as error:
+                if not is_throttled(error) or attempt >= self.max_retries:
+                    raise
+                delay = self.throttled(kind, attempt, retry_after(error))
+                attempt += 1
+                await asyncio.sleep(delay)
+                await self.acquire(0, kind)
+
+    def __take(self, state: dict, tokens: int) -> float:
+        now = time.time()
+        paused_until = state.get("paused_until", 0)
+        if paused_until > now:
+            return paused_until - now
+        elapsed = now - state.get("updated", now)
+        state["updated"] = now
+        wait = 0
+        if self.tokens_per_minute > 0:
+            state["tokens"] = min(state.get("tokens", self.tokens_per_minute) + elapsed * self.tokens_per_minute / 60, self.tokens_per_minute)
+            wait = max(tokens - state["tokens"], 0) * 60 / self.tokens_per_minute
+        if self.requests_per_minute > 0:
+            state["requests"] = min(state.get("requests", self.requests_per_minute) + elapsed * self.requests_per_minute / 60, self.requests_per_minute)
+            wait = max(wait, max(1 - state["requests"], 0) * 60 / self.requests_per_minute)
+        if wait > 0:
+            return max(wait, 0.05)
+        if self.tokens_per_minute > 0:
+            state["tokens"] -= tokens
+        if self.requests_per_minute > 0:
+            state["requests"] -= 1
+        return 0
+
+
+def is_throttled(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+def is_run_throttled(last_error) -> bool:
+    """Agent runs report throttling as a failed run, not as a 429."""
+    return getattr(last_error, "code", None) == "rate_limit_exceeded"
+
+
+def run_retry_after(last_error) -> float:
+    """Returns the delay in the message of a throttled run, like "Try again in 20 seconds.", if any."""
+    match = re.search(r"(\d+(?:\.\d+)?) seconds?", getattr(last_error, "message", None) or "")
+    return float(match.group(1)) if match else None
+
+
+def retry_after(error: Exception) -> float:
+    """Returns the delay the service asked for, in seconds, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in [("retry-after-ms", 1000), ("x-ms-retry-after-ms", 1000), ("retry-after", 1)]:
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return float(value) / scale
+        except ValueError:
+            continue
+    return None
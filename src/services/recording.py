@@ -0,0 +1,115 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+
+class Recording:
+    """The agent run events and tool outputs of one turn, with their timing.
+
+    Each stream the run consumes, the first one and one per tool output
+    submission, is a segment. Recordings are saved as JSON lines, compressed
+    when the path ends with .gz, and replayed by benchmarks.replay.
+    """
+
+    def __init__(self, path: str, texts: list = None, channel_id: str = None):
+        self.path = path
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.lines = [{"kind": "turn", "texts": list(texts or []), "channel_id": channel_id}]
+        self.segments = 0
+
+    def wrap(self, stream):
+        """Yields the events of a run stream, recording each one."""
+        with self.lock:
+            segment = self.segments
+            self.segments += 1
+        self.__append({"kind": "stream", "segment": segment})
+        try:
+            for event in stream:
+                self.__append({"kind": "event", "segment": segment, "type": event[0], "data": to_plain(event[1])})
+                yield event
+        finally:
+            close = getattr(stream, "close", None)
+            if callable(close):
+                close()
+
+    def record_tool(self, name: str, arguments: str, output: str, duration: float):
+        self.__append({"kind": "tool", "name": name, "arguments": arguments, "output": output, "duration": round(duration, 4)})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with opener(self.path, "wt", encoding="utf-8") as f:
+            for line in self.lines:
+                f.write(json.dumps(line, separators=(",", ":"), default=str) + "\n")
+
+    def __append(self, line: dict):
+        line["t"] = round(time.monotonic() - self.started, 4)
+        with self.lock:
+            self.lines.append(line)
+
+
+class RunRecorder:
+    """Records the agent runs of every turn to fixture files, for replay in benchmarks.
+
+    Recordings hold the conversation content, enable them only where that is acceptable.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    @staticmethod
+    def from_environment():
+        directory = os.getenv("AGENT_RECORDING_DIRECTORY")
+        return RunRecorder(directory) if directory else None
+
+    def start(self, conversation_id: str, texts: list, channel_id: str) -> Recording:
+        conversation = hashlib.sha256(conversation_id.encode("utf-8")).hexdigest()[:12]
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{conversation}-{os.urandom(3).hex()}.jsonl.gz"
+        return Recording(os.path.join(self.directory, name), texts, channel_id)
+
+
+def load_recording(path: str) -> dict:
+    """Reads a recording into its turn, event segments and tool outputs."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    recording = {"turn": lines[0], "segments": [], "tools": []}
+    for line in lines[1:]:
+        if line["kind"] in ["stream", "event"]:
+            # Segments start with their stream line, which times the wait for the first event
+            while len(recording["segments"]) <= line["segment"]:
+                recording["segments"].append([])
+            recording["segments"][line["segment"]].append(line)
+        elif line["kind"] == "tool":
+            recording["tools"].append(line)
+    return recording
+
+
+def to_plain(value):
+    """Converts SDK models and namespaces to JSON-compatible values."""
+    if hasattr(value, "as_dict"):
+        return value.as_dict()
+    if isinstance(value, SimpleNamespace):
+        return {key: to_plain(item) for key, item in vars(value).items()}
+    if isinstance(value, dict):
+        return {key: to_plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_plain(item) for item in value]
+    return value
+
+
+def to_namespace(value):
+    """Converts recorded values back to objects with the attributes the run orchestrator reads."""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: to_namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [to_namespace(item) for item in value]
+    return value
@@ -0,0 +1,205 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List
+
+from botbuilder.core.storage import Storage
+from jsonpickle.pickler import Pickler
+from jsonpickle.unpickler import Unpickler
+
+from services.metrics import REGISTRY, MetricsRegistry
+
+# Keeps IN (...) lists below the bound parameters limit of older SQLite builds
+BATCH_SIZE = 500
+
+
+class SqliteStorage(Storage):
+    """Bot state storage in a local SQLite database, shared by the worker processes of a host.
+
+    The database runs in WAL mode, so readers do not block the writer and
+    workers see each other's writes at once. Every write sets a new e_tag, and
+    changes carrying the e_tag of an item are written only if the item did not
+    change since it was read, like CosmosDbPartitionedStorage. A write call is
+    one transaction: on an e_tag conflict, none of its changes are written.
+    Items created with a ttl are hidden once expired, and purged periodically.
+
+    The database must be on a local disk: SQLite locking is not reliable on
+    network shares, such as the /home share of App Service, so use a path
+    under /tmp there. Each process opens its own connection on first use. Statements run on a
+    worker thread, under a lock, since a connection serves one statement at a
+    time.
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 5, purge_interval: float = 60, registry: MetricsRegistry = REGISTRY):
+        super().__init__()
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.purge_interval = purge_interval
+        self.purged_at = 0
+        self.connection: sqlite3.Connection = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+        self.request_histogram = registry.histogram("sqlite_storage_seconds", "Duration of SQLite storage requests", ["operation"])
+        self.conflict_counter = registry.counter("sqlite_storage_conflicts_total", "Writes rejected because the item changed since it was read")
+
+    @staticmethod
+    def from_environment():
+        return SqliteStorage(
+            os.getenv("STORAGE_SQLITE_PATH"),
+            busy_timeout=float(os.getenv("STORAGE_SQLITE_BUSY_TIMEOUT_SECONDS", 5)),
+        )
+
+    async def read(self, keys: List[str]) -> Dict[str, object]:
+        if not keys:
+            raise Exception("Keys are required when reading")
+        rows = await self.__execute("read", self.__read, list(dict.fromkeys(keys)))
+        return {key: restore(document, e_tag) for key, document, e_tag in rows}
+
+    async def write(self, changes: Dict[str, object]):
+        if changes is None:
+            raise Exception("Changes are required when writing")
+        if not changes:
+            return
+        # Serialized on the event loop, the items may change once control returns to other turns
+        documents = [(key, flatten(change), get_e_tag(change)) for key, change in changes.items()]
+        await self.__execute("write", self.__write, documents)
+
+    async def create(self, key: str, item: object, ttl: float = None) -> bool:
+        """Writes an item only if the key does not exist yet, or expired. Returns False if it does.
+
+        Items with a ttl expire after ttl seconds.
+        """
+        now = time.time()
+        purge = ttl is not None and now - self.purged_at > self.purge_interval
+        if purge:
+            self.purged_at = now
+        expires_at = now + ttl if ttl is not None else None
+        return await self.__execute("create", self.__create, (key, flatten(item), uuid.uuid4().hex, expires_at, now, purge))
+
+    async def delete(self, keys: List[str]):
+        if not keys:
+            return
+        await self.__execute("delete", self.__delete, list(keys))
+
+    def close(self):
+        with self.lock:
+            if self.connection and self.pid == os.getpid():
+                self.connection.close()
+            self.connection = None
+
+    async def on_cleanup(self, app):
+        self.close()
+
+    async def __execute(self, operation: str, function, argument):
+        start = time.perf_counter()
+        try:
+            return await asyncio.to_thread(self.__locked, function, argument)
+        finally:
+            self.request_histogram.observe(time.perf_counter() - start, operation=operation)
+
+    def __locked(self, function, argument):
+        with self.lock:
+            return function(self.__connect(), argument)
+
+    def __connect(self) -> sqlite3.Connection:
+        # A connection inherited from the gunicorn arbiter must not be used by its workers
+        if self.connection is None or self.pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Commits survive a crash of the process, a power loss may drop the last ones
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS items (key TEXT PRIMARY KEY, document TEXT NOT NULL, e_tag TEXT NOT NULL, expires_at REAL) WITHOUT ROWID")
+            connection.execute("CREATE INDEX IF NOT EXISTS items_expires_at ON items (expires_at) WHERE expires_at IS NOT NULL")
+            self.connection = connection
+            self.pid = os.getpid()
+        return self.connection
+
+    @staticmethod
+    def __read(connection: sqlite3.Connection, keys: List[str]) -> list:
+        rows = []
+        now = time.time()
+        for i in range(0, len(keys), BATCH_SIZE):
+            batch = keys[i:i + BATCH_SIZE]
+            rows.extend(connection.execute(
+                f"SELECT key, document, e_tag FROM items WHERE key IN ({','.join('?' * len(batch))}) AND (expires_at IS NULL OR expires_at > ?)",
+                batch + [now]
+            ))
+        return rows
+
+    def __write(self, connection: sqlite3.Connection, documents: list):
+        # Takes the write lock at once, rather than upgrading a read lock, which could deadlock with another writer
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for key, document, e_tag in documents:
+                if e_tag == "":
+                    raise Exception("sqlite_storage.write(): etag missing")
+                if e_tag is None or e_tag == "*":
+                    connection.execute(
+                        "INSERT INTO items (key, document, e_tag) VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE SET document = excluded.document, e_tag = excluded.e_tag, expires_at = NULL",
+                        (key, document, uuid.uuid4().hex)
+                    )
+                    continue
+                cursor = connection.execute(
+                    "INSERT INTO items (key, document, e_tag) VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE SET document = excluded.document, e_tag = excluded.e_tag, expires_at = NULL WHERE items.e_tag = ?",
+                    (key, document, uuid.uuid4().hex, e_tag)
+                )
+                if cursor.rowcount == 0:
+                    self.conflict_counter.inc()
+                    raise KeyError(f"Etag conflict on {key}.\nOriginal: {e_tag}")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    @staticmethod
+    def __create(connection: sqlite3.Connection, arguments: tuple) -> bool:
+        key, document, e_tag, expires_at, now, purge = arguments
+        if purge:
+            connection.execute("DELETE FROM items WHERE expires_at <= ?", (now,))
+        # An expired item is replaced, as if it had been purged already
+        return connection.execute(
+            "INSERT INTO items VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET document = excluded.document, e_tag = excluded.e_tag, expires_at = excluded.expires_at WHERE items.expires_at <= ?",
+            (key, document, e_tag, expires_at, now)
+        ).rowcount == 1
+
+    @staticmethod
+    def __delete(connection: sqlite3.Connection, keys: List[str]):
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for i in range(0, len(keys), BATCH_SIZE):
+                batch = keys[i:i + BATCH_SIZE]
+                connection.execute(f"DELETE FROM items WHERE key IN ({','.join('?' * len(batch))})", batch)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+
+def get_e_tag(change: object) -> str:
+    if isinstance(change, dict):
+        return change.get("e_tag", None)
+    return getattr(change, "e_tag", None)
+
+
+def flatten(store_item: object) -> str:
+    document = Pickler().flatten(store_item)
+    if isinstance(document, dict):
+        document.pop("e_tag", None)
+    return json.dumps(document, separators=(",", ":"))
+
+
+def restore(document: str, e_tag: str) -> object:
+    document = json.loads(document)
+    if isinstance(document, dict):
+        document["e_tag"] = e_tag
+    return Unpickler().restore(document)
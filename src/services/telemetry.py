@@ -0,0 +1,115 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import List
+
+from services.metrics import REGISTRY, MetricsRegistry
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed operation, shaped after OpenTelemetry spans."""
+
+    def __init__(self, name: str, parent: "Span" = None, attributes: dict = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.status = "ok"
+        self.start_time = time.time_ns()
+        self.end_time = None
+        self._start = time.perf_counter()
+        self.duration = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        self.events.append({"name": name, "time_unix_nano": time.time_ns(), "attributes": attributes})
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def end(self):
+        self.duration = self.elapsed()
+        self.end_time = self.start_time + int(self.duration * 1e9)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "start_time_unix_nano": self.start_time,
+            "end_time_unix_nano": self.end_time,
+            "attributes": self.attributes,
+            "events": self.events,
+            "status": self.status,
+        }
+
+
+class LocalSpanExporter:
+    """Keeps the latest finished spans in memory, and optionally appends them to a JSON lines file."""
+
+    def __init__(self, max_spans: int = 1000, path: str = None):
+        self.spans = deque(maxlen=max_spans)
+        self.path = path
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def from_environment():
+        return LocalSpanExporter(
+            max_spans=int(os.getenv("TELEMETRY_MAX_SPANS", 1000)),
+            path=os.getenv("TELEMETRY_SPAN_FILE"),
+        )
+
+    def export(self, span: Span):
+        self.spans.append(span)
+        if self.path:
+            with self.lock, open(self.path, "a") as f:
+                f.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+    def find(self, name: str) -> List[Span]:
+        return [span for span in self.spans if span.name == name]
+
+
+class Tracer:
+    def __init__(self, exporter: LocalSpanExporter = None, registry: MetricsRegistry = REGISTRY):
+        self.exporter = exporter or LocalSpanExporter()
+        self.duration_histogram = registry.histogram("span_duration_seconds", "Duration of traced operations", ["name"])
+        self.error_counter = registry.counter("span_errors_total", "Traced operations that raised an error", ["name"])
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span = Span(name, _current_span.get(), attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as error:
+            span.status = "error"
+            span.set_attribute("error", repr(error))
+            self.error_counter.inc(name=name)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+            self.duration_histogram.observe(span.duration, name=name)
+            self.exporter.export(span)
+
+
+def current_span() -> Span:
+    return _current_span.get()
+
+
+# Default tracer shared by the whole worker
+TRACER = Tracer(LocalSpanExporter.from_environment())
@@ -0,0 +1,103 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from azure.ai.projects.operations import AgentsOperations
+
+from services.metrics import REGISTRY, MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadPool:
+    """Keeps empty agent threads created ahead of time, so new conversations do not wait for create_thread.
+
+    The pool of each worker is refilled by a background task after every take.
+    Threads older than max_age are deleted instead of being handed out, and the
+    threads still pooled when the worker stops are deleted if delete_on_cleanup.
+    With size 0, threads are created on demand.
+    """
+
+    def __init__(self, agents_client: AgentsOperations, size: int = 4, max_age: float = 3600, delete_on_cleanup: bool = True, registry: MetricsRegistry = REGISTRY):
+        self.agents_client = agents_client
+        self.size = size
+        self.max_age = max_age
+        self.delete_on_cleanup = delete_on_cleanup
+        self.threads = deque()
+        self.refill_task: asyncio.Task = None
+
+        self.requests_counter = registry.counter("agent_thread_pool_requests_total", "Threads taken from the pool, by result", ["result"])
+        self.size_gauge = registry.gauge("agent_thread_pool_size", "Threads waiting in the pool")
+        self.deleted_counter = registry.counter("agent_thread_pool_deleted_total", "Pooled threads deleted without being used, by reason", ["reason"])
+
+    @staticmethod
+    def from_environment(agents_client: AgentsOperations):
+        return ThreadPool(
+            agents_client,
+            size=int(os.getenv("THREAD_POOL_SIZE", 4)),
+            max_age=float(os.getenv("THREAD_POOL_MAX_AGE_SECONDS", 3600)),
+            delete_on_cleanup=os.getenv("THREAD_POOL_DELETE_ON_CLEANUP", "true").lower() == "true",
+        )
+
+    async def take(self) -> str:
+        """Returns the id of an empty thread, from the pool when it has a fresh one."""
+        thread_id = None
+        expired = []
+        while self.threads and thread_id is None:
+            pooled_id, created_at = self.threads.popleft()
+            if time.time() - created_at < self.max_age:
+                thread_id = pooled_id
+            else:
+                expired.append(pooled_id)
+        self.size_gauge.set(len(self.threads))
+        if expired:
+            asyncio.create_task(self.__delete(expired, "expired"))
+        self.refill()
+        if thread_id is not None:
+            self.requests_counter.inc(result="hit")
+            return thread_id
+        self.requests_counter.inc(result="miss")
+        thread = await asyncio.to_thread(self.agents_client.create_thread)
+        return thread.id
+
+    def refill(self):
+        """Starts filling the pool in the background, unless it is full or already being filled."""
+        if len(self.threads) < self.size and (self.refill_task is None or self.refill_task.done()):
+            self.refill_task = asyncio.create_task(self.__refill())
+
+    async def on_startup(self, app):
+        self.refill()
+
+    async def on_cleanup(self, app):
+        if self.refill_task:
+            self.refill_task.cancel()
+            await asyncio.gather(self.refill_task, return_exceptions=True)
+        threads = [thread_id for thread_id, _ in self.threads]
+        self.threads.clear()
+        self.size_gauge.set(0)
+        if self.delete_on_cleanup and threads:
+            await self.__delete(threads, "cleanup")
+
+    async def __refill(self):
+        while len(self.threads) < self.size:
+            try:
+                thread = await asyncio.to_thread(self.agents_client.create_thread)
+            except Exception:
+                # Conversations still get threads on demand, the pool is refilled on the next take
+                logger.exception("Failed to create a pooled thread")
+                return
+            self.threads.append((thread.id, time.time()))
+            self.size_gauge.set(len(self.threads))
+
+    async def __delete(self, threads: list[str], reason: str):
+        for thread_id in threads:
+            try:
+                await asyncio.to_thread(self.agents_client.delete_thread, thread_id)
+                self.deleted_counter.inc(reason=reason)
+            except Exception:
+                logger.exception("Failed to delete pooled thread %s", thread_id)
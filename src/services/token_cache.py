@@ -0,0 +1,65 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import os
+import time
+from collections import OrderedDict
+
+import jwt
+from botframework.connector.token_api.models import TokenResponse
+
+from services.metrics import REGISTRY, MetricsRegistry
+
+
+class CachedToken:
+    """A user token with its decoded claims, and the time it was fetched from the token service."""
+
+    def __init__(self, token: str, claims: dict, expires_at: float, fetched_at: float = None):
+        self.token = token
+        self.claims = claims
+        self.expires_at = expires_at
+        self.fetched_at = fetched_at or time.time()
+
+
+class UserTokenCache:
+    """Keeps the SSO tokens of users between turns, until shortly before they expire.
+
+    Tokens are kept per user, connection name and channel, and decoded once.
+    A token is refreshed from the token service refresh_margin seconds before
+    its exp claim, so it stays valid for the tools of the turn that uses it.
+    The cache is per worker: a logout handled by another worker is found in
+    the user state, see StateManagementBot.handle_login.
+    """
+
+    def __init__(self, refresh_margin: float = 300, max_size: int = 10000, registry: MetricsRegistry = REGISTRY):
+        self.refresh_margin = refresh_margin
+        self.max_size = max_size
+        self.tokens = OrderedDict()
+        self.requests_counter = registry.counter("user_token_cache_requests_total", "User token lookups, by result", ["result"])
+
+    @staticmethod
+    def from_environment():
+        return UserTokenCache(refresh_margin=float(os.getenv("SSO_TOKEN_REFRESH_MARGIN_SECONDS", 300)))
+
+    def get(self, user_id: str, connection_name: str, channel_id: str) -> CachedToken:
+        key = (user_id, connection_name, channel_id)
+        cached = self.tokens.get(key)
+        if cached is None or cached.expires_at - self.refresh_margin <= time.time():
+            self.requests_counter.inc(result="miss")
+            return None
+        self.tokens.move_to_end(key)
+        self.requests_counter.inc(result="hit")
+        return cached
+
+    def add(self, user_id: str, connection_name: str, channel_id: str, token_response: TokenResponse) -> CachedToken:
+        """Decodes the token and keeps it if it has an expiry. Raises if the token cannot be decoded."""
+        claims = jwt.decode(token_response.token, options={"verify_signature": False})
+        cached = CachedToken(token_response.token, claims, claims.get("exp", 0))
+        if cached.expires_at - self.refresh_margin > time.time():
+            self.tokens[(user_id, connection_name, channel_id)] = cached
+            while len(self.tokens) > self.max_size:
+                self.tokens.popitem(last=False)
+        return cached
+
+    def invalidate(self, user_id: str, connection_name: str, channel_id: str):
+        self.tokens.pop((user_id, connection_name, channel_id), None)
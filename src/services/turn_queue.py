@@ -0,0 +1,138 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from botbuilder.core import TurnContext
+from botbuilder.core.storage import Storage
+from botbuilder.schema import Activity
+from botframework.connector.auth import AuthenticateRequestResult
+
+from services.conversation_lock import create_item
+from services.metrics import REGISTRY, MetricsRegistry
+from services.telemetry import TRACER
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyCache:
+    """Remembers the activities already received, so redelivered ones are not processed twice.
+
+    Ids are kept in memory for ttl seconds. With a shared storage that expires
+    items (see create_item), they are also created there with the same ttl,
+    which catches redeliveries that reach another worker.
+    """
+
+    def __init__(self, ttl: float = 900, max_size: int = 10000, storage: Storage = None, registry: MetricsRegistry = REGISTRY):
+        self.ttl = ttl
+        self.max_size = max_size
+        # Markers in a storage without expiry would pile up forever
+        self.storage = storage if getattr(storage, "create", None) else None
+        self.seen = OrderedDict()
+        self.duplicate_counter = registry.counter("duplicate_activities_total", "Redelivered activities that were not processed again")
+
+    async def is_duplicate(self, activity: Activity) -> bool:
+        """Records the activity and returns True if it was received before."""
+        if not activity.id or not activity.conversation:
+            return False
+        key = f"activities/{activity.channel_id}/{activity.conversation.id}/{activity.id}"
+        now = time.time()
+        self.__expire(now)
+        duplicate = key in self.seen
+        if not duplicate and self.storage:
+            duplicate = not await create_item(self.storage, key, {"expires_at": now + self.ttl}, self.ttl)
+        if duplicate:
+            self.duplicate_counter.inc()
+            return True
+        self.seen[key] = now + self.ttl
+        return False
+
+    def __expire(self, now: float):
+        while self.seen and (len(self.seen) > self.max_size or next(iter(self.seen.values())) < now):
+            self.seen.popitem(last=False)
+
+
+class TurnQueue:
+    """Processes activities on background tasks, after the request that brought them was answered.
+
+    The request is authenticated before its activity is queued, and the turn
+    later runs as a proactive turn on the stored conversation reference, so
+    replies go out through the connector like they do for regular turns.
+    """
+
+    def __init__(self, adapter, workers: int = 32, max_size: int = 1000, registry: MetricsRegistry = REGISTRY):
+        self.adapter = adapter
+        self.workers = workers
+        self.max_size = max_size
+        self.queue: asyncio.Queue = None
+        self.tasks = []
+
+        self.depth_gauge = registry.gauge("turn_queue_depth", "Activities waiting for a background worker")
+        self.wait_histogram = registry.histogram("turn_queue_wait_seconds", "Time activities waited for a background worker")
+        self.rejected_counter = registry.counter("turn_queue_rejected_total", "Activities rejected because the turn queue was full")
+
+    @staticmethod
+    def from_environment(adapter):
+        return TurnQueue(
+            adapter,
+            workers=int(os.getenv("TURN_QUEUE_WORKERS", 32)),
+            max_size=int(os.getenv("TURN_QUEUE_MAX_SIZE", 1000)),
+        )
+
+    def start(self):
+        self.queue = asyncio.Queue(self.max_size)
+        self.tasks = [asyncio.create_task(self.__work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def on_startup(self, app):
+        self.start()
+
+    async def on_cleanup(self, app):
+        await self.stop()
+
+    def enqueue(self, activity: Activity, authentication: AuthenticateRequestResult, logic: Callable[[TurnContext], Awaitable]) -> bool:
+        """Queues the turn of an authenticated activity. Returns False when the queue is full."""
+        try:
+            self.queue.put_nowait((time.monotonic(), activity, authentication, logic))
+        except asyncio.QueueFull:
+            self.rejected_counter.inc()
+            return False
+        self.depth_gauge.set(self.queue.qsize())
+        return True
+
+    async def __work(self):
+        while True:
+            queued_at, activity, authentication, logic = await self.queue.get()
+            self.depth_gauge.set(self.queue.qsize())
+            self.wait_histogram.observe(time.monotonic() - queued_at)
+            try:
+                await self.process(activity, authentication, logic)
+            except Exception:
+                logger.exception("Background turn failed for activity %s", activity.id)
+            finally:
+                self.queue.task_done()
+
+    async def process(self, activity: Activity, authentication: AuthenticateRequestResult, logic: Callable[[TurnContext], Awaitable]):
+        async def turn(turn_context: TurnContext):
+            # Run the turn on the received activity rather than on the continuation event
+            turn_context.activity = activity
+            await logic(turn_context)
+
+        reference = TurnContext.get_conversation_reference(activity)
+        with TRACER.span("POST /api/messages (background)", activity_type=activity.type, channel_id=activity.channel_id):
+            await self.adapter.continue_conversation_with_claims(
+                authentication.claims_identity,
+                reference,
+                authentication.audience,
+                turn
+            )
@@ -0,0 +1,219 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""Network-free stand-ins shared by the tests and the benchmarks, and the fixtures of the tests."""
+
+import itertools
+import uuid
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from aiohttp import web
+from botbuilder.core import BotAdapter, ConversationState, MemoryStorage, TurnContext, UserState
+from botbuilder.schema import Activity, ActivityTypes, ChannelAccount, ConversationAccount, ResourceResponse
+
+from bots import AssistantBot
+from dialogs import LoginDialog
+
+
+class FakeTurnContext:
+    """Records outgoing activities instead of sending them to a channel."""
+
+    def __init__(self, channel_id: str = "directline", text: str = None):
+        self.activity = SimpleNamespace(
+            channel_id=channel_id,
+            text=text,
+            token=None,
+            attachments=None,
+            conversation=SimpleNamespace(id="conversation_fake"),
+        )
+        self.turn_state = {}
+        self.sent = []
+        self.updated = []
+
+    async def send_activity(self, activity):
+        self.sent.append(activity)
+        return ResourceResponse(id=f"activity-{len(self.sent)}")
+
+    async def update_activity(self, activity):
+        self.updated.append(activity)
+        return ResourceResponse(id=activity.id)
+
+    def bytes_sent(self) -> int:
+        return sum(len(_text(a).encode("utf-8")) for a in self.sent + self.updated)
+
+
+class NullAdapter(BotAdapter):
+    """An adapter for real TurnContexts that counts outgoing activities and drops them."""
+
+    def __init__(self):
+        super().__init__()
+        self.sent = 0
+        self.updated = 0
+
+    async def send_activities(self, context, activities):
+        self.sent += len(activities)
+        return [ResourceResponse(id=f"activity-{self.sent}") for _ in activities]
+
+    async def update_activity(self, context, activity):
+        self.updated += 1
+        return ResourceResponse(id=activity.id)
+
+    async def delete_activity(self, context, reference):
+        pass
+
+
+def message_activity(text: str, conversation_id: str = "conversation_fake", user_id: str = "user_fake", channel_id: str = "directline") -> Activity:
+    return Activity(
+        type=ActivityTypes.message,
+        id=f"activity_{conversation_id}",
+        text=text,
+        channel_id=channel_id,
+        service_url="https://localhost",
+        conversation=ConversationAccount(id=conversation_id),
+        from_property=ChannelAccount(id=user_id),
+        recipient=ChannelAccount(id="bot_fake"),
+    )
+
+
+class FakeAgentsClient:
+    """The subset of AgentsOperations used by process_run_streaming."""
+
+    def __init__(self, tool_output_runs: list = None, answer: str = "Hello from the fake agent!", record: bool = True):
+        # Event lists returned, in order, for each tool output submission
+        self.tool_output_runs = list(tool_output_runs or [])
+        self.answer = answer
+        # Long runs turn recording off, so the fake does not grow with every turn
+        self.record = record
+        self.message_count = 0
+        self.run_count = 0
+        self.messages = []
+        self.runs = []
+        self.submitted_tool_outputs = []
+        self.cancelled_runs = []
+
+    def create_thread(self):
+        return SimpleNamespace(id="thread_fake")
+
+    def create_message(self, thread_id: str, role: str, content: str, **kwargs):
+        self.message_count += 1
+        if self.record:
+            self.messages.append(content)
+        return SimpleNamespace(id=f"msg_{self.message_count}", thread_id=thread_id, role=role)
+
+    def create_stream(self, thread_id: str, assistant_id: str, **kwargs):
+        self.run_count += 1
+        if self.record:
+            self.runs.append(thread_id)
+        return text_run_events(self.answer, run_id=f"run_{self.run_count}")
+
+    def submit_tool_outputs_to_stream(self, thread_id: str, run_id: str, tool_outputs: list):
+        self.submitted_tool_outputs.append(tool_outputs)
+        return iter(self.tool_output_runs.pop(0))
+
+    def cancel_run(self, thread_id: str, run_id: str):
+        self.cancelled_runs.append(run_id)
+        return SimpleNamespace(id=run_id, status="cancelled")
+
+    def get_run(self, thread_id: str, run_id: str):
+        return SimpleNamespace(id=run_id, status="cancelled")
+
+
+def text_run_events(answer: str, chunk_size: int = 4, run_id: str = "run_fake"):
+    """Yield the stream events of a run that answers with the given text."""
+    yield ("thread.run.created", SimpleNamespace(id=run_id))
+    for i in range(0, len(answer), chunk_size):
+        text = SimpleNamespace(value=answer[i:i + chunk_size])
+        block = SimpleNamespace(type="text", text=text)
+        yield ("thread.message.delta", SimpleNamespace(delta=SimpleNamespace(content=[block])))
+    yield ("thread.run.completed", SimpleNamespace(id=run_id, usage=SimpleNamespace(total_tokens=len(answer) // 4)))
+
+
+def grounded_run_events(answer: str, run_id: str = "run_fake"):
+    """Yield the stream events of a run that searches the web with server-side Bing grounding, then answers."""
+    yield ("thread.run.created", SimpleNamespace(id=run_id))
+    step_details = SimpleNamespace(type="tool_calls", tool_calls=[SimpleNamespace(id="call_bing", type="bing_grounding")])
+    yield ("thread.run.step.created", SimpleNamespace(id="step_bing", type="tool_calls", step_details=SimpleNamespace(type="tool_calls", tool_calls=[])))
+    yield ("thread.run.step.completed", SimpleNamespace(id="step_bing", type="tool_calls", step_details=step_details))
+    # The answer events, after their thread.run.created
+    yield from itertools.islice(text_run_events(answer, run_id=run_id), 1, None)
+
+
+def tool_call_run_events(name: str, arguments: str, run_id: str = "run_fake"):
+    """Yield the stream events of a run that stops to call a function tool."""
+    function = SimpleNamespace(name=name, arguments=arguments)
+    tool_call = SimpleNamespace(id=f"call_{name}", type="function", function=function)
+    action = SimpleNamespace(submit_tool_outputs=SimpleNamespace(tool_calls=[tool_call]))
+    yield ("thread.run.created", SimpleNamespace(id=run_id))
+    yield ("thread.run.requires_action", SimpleNamespace(id=run_id, required_action=action))
+
+
+def create_bot(agents_client=None, streaming_mode: str = "full") -> AssistantBot:
+    storage = MemoryStorage()
+    bot = AssistantBot(
+        ConversationState(storage),
+        UserState(storage),
+        SimpleNamespace(chat=None),
+        agents_client or FakeAgentsClient(),
+        "asst_fake",
+        None,
+        None,
+        LoginDialog(),
+    )
+    bot.streaming = True
+    bot.streaming_mode = streaming_mode
+    return bot
+
+
+class GraphStub:
+    """A local Microsoft Graph with the calendar endpoints used by GraphClient.
+
+    Serve app() on a local port and point GraphClient at its /v1.0 endpoint.
+    The first throttle_count requests of a $batch call are answered with 429.
+    """
+
+    def __init__(self, throttle_count: int = 0, retry_after: str = "0"):
+        self.throttle_count = throttle_count
+        self.retry_after = retry_after
+        self.batch_requests = 0
+        self.events = []
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post("/v1.0/me/events", self.on_event),
+            web.post("/v1.0/$batch", self.on_batch),
+        ])
+        return app
+
+    async def on_event(self, req: web.Request) -> web.Response:
+        return web.json_response(self.__create(await req.json()), status=201)
+
+    async def on_batch(self, req: web.Request) -> web.Response:
+        self.batch_requests += 1
+        responses = []
+        for request in (await req.json())["requests"]:
+            if self.throttle_count > 0:
+                self.throttle_count -= 1
+                responses.append({"id": request["id"], "status": 429, "headers": {"Retry-After": self.retry_after}, "body": {"error": {"code": "TooManyRequests"}}})
+            else:
+                responses.append({"id": request["id"], "status": 201, "body": self.__create(request["body"])})
+        return web.json_response({"responses": responses})
+
+    def __create(self, body: dict) -> dict:
+        event = {"id": uuid.uuid4().hex, **body}
+        self.events.append(event)
+        return event
+
+
+def _text(activity) -> str:
+    return activity if isinstance(activity, str) else (activity.text or "")
+
+
+@pytest.fixture()
+def turn_context():
+    turn_context = MagicMock(spec=TurnContext)
+    turn_context.activity.channel_id = "directline"
+    turn_context.turn_state = {}
+    return turn_context
@@ -0,0 +1,29 @@
+from botbuilder.schema import Activity
+
+from services.activity_parsing import is_ignorable, loads, parse_activity
+from benchmarks.activity_parsing import BODIES
+
+def test_parse_activity_matches_msrest():
+    for body in BODIES.values():
+        body = {**body, "unknownProperty": {"kept": True}}
+        expected = Activity().deserialize(body)
+        activity = parse_activity(body)
+        assert activity.serialize() == expected.serialize()
+        assert activity.timestamp == expected.timestamp
+        assert activity.additional_properties == {"unknownProperty": {"kept": True}}
+
+def test_parse_activity_keeps_entity_properties():
+    activity = parse_activity(BODIES["message"])
+    mention = activity.entities[0]
+    assert mention.type == "mention"
+    assert mention.additional_properties["text"] == "<at>Travel Agent</at>"
+    assert activity.from_property.aad_object_id == BODIES["message"]["from"]["aadObjectId"]
+    assert activity.local_timestamp.utcoffset().total_seconds() == 7200
+
+def test_is_ignorable():
+    assert is_ignorable(BODIES["typing"])
+    assert is_ignorable(BODIES["conversationUpdate/topicName"])
+    assert not is_ignorable(BODIES["conversationUpdate/membersAdded"])
+    assert not is_ignorable(BODIES["message"])
+    assert not is_ignorable({"type": "invoke", "name": "signin/verifyState"})
+    assert loads(b'{"type": "typing"}') == {"type": "typing"}
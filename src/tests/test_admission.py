@@ -0,0 +1,107 @@
+import asyncio
+import pytest
+from aiohttp import web
+from botbuilder.core import TurnContext
+from botbuilder.core.adapters import TestAdapter
+from botbuilder.integration.aiohttp import CloudAdapter, ConfigurationBotFrameworkAuthentication
+from botbuilder.schema import Activity, ActivityTypes, ChannelAccount, ConversationAccount
+
+from config import DefaultConfig
+from routes.api.messages import messages_routes
+
+from services.admission import AdmissionController, AdmissionRejected
+from services.metrics import MetricsRegistry
+from tests.conftest import create_bot, message_activity
+
+def controller(**kwargs):
+    return AdmissionController(registry=MetricsRegistry(), **kwargs)
+
+async def test_in_flight_limit():
+    admission = controller(max_in_flight=2)
+    running = []
+    async def run(name):
+        async with admission.admit(name):
+            running.append(admission.in_flight)
+            await asyncio.sleep(0.01)
+    await asyncio.gather(*[run(f"user_{i}") for i in range(5)])
+    assert max(running) == 2
+    assert admission.in_flight == 0
+    assert admission.queued == 0
+    assert admission.wait_histogram.get() == 5
+
+async def test_fair_queue():
+    admission = controller(max_in_flight=1)
+    order = []
+    slot = await admission.acquire("busy_user")
+    async def run(user_id):
+        async with admission.admit(user_id):
+            order.append(user_id)
+    tasks = [asyncio.create_task(run(user_id)) for user_id in ["chatty", "chatty", "chatty", "quiet"]]
+    await asyncio.sleep(0)
+    admission.release(slot)
+    await asyncio.gather(*tasks)
+    # The quiet user does not wait for every message of the chatty one
+    assert order == ["chatty", "quiet", "chatty", "chatty"]
+
+async def test_queue_full():
+    admission = controller(max_in_flight=1, max_queue=1, retry_after=7)
+    slot = await admission.acquire("user_1")
+    waiting = asyncio.create_task(admission.acquire("user_2"))
+    await asyncio.sleep(0)
+    assert admission.saturated()
+    with pytest.raises(AdmissionRejected) as rejection:
+        await admission.acquire("user_3")
+    assert rejection.value.retry_after == 7
+    assert admission.rejected_counter.get(reason="queue_full") == 1
+    admission.release(slot)
+    admission.release(await waiting)
+
+async def test_wait_timeout():
+    admission = controller(max_in_flight=1, max_wait=0.01)
+    slot = await admission.acquire("user_1")
+    with pytest.raises(AdmissionRejected):
+        await admission.acquire("user_2")
+    assert admission.queued == 0
+    admission.release(slot)
+    assert admission.in_flight == 0
+
+async def test_host_limit(tmp_path):
+    worker_1 = controller(max_in_flight=5, max_in_flight_host=1, slot_directory=str(tmp_path))
+    worker_2 = controller(max_in_flight=5, max_in_flight_host=1, slot_directory=str(tmp_path))
+    slot = await worker_1.acquire("user_1")
+    waiting = asyncio.create_task(worker_2.acquire("user_2"))
+    await asyncio.sleep(0.05)
+    assert not waiting.done()
+    worker_1.release(slot)
+    worker_2.release(await asyncio.wait_for(waiting, 1))
+
+async def test_bot_sheds_turn():
+    bot = create_bot()
+    bot.admission = controller(max_in_flight=0, max_queue=0, retry_after=5)
+    adapter = TestAdapter()
+    turn_context = TurnContext(adapter, Activity(
+        type=ActivityTypes.message,
+        text="Plan a trip to Rome",
+        channel_id="test",
+        conversation=ConversationAccount(id="conversation_1"),
+        from_property=ChannelAccount(id="user_1"),
+        recipient=ChannelAccount(id="bot"),
+    ))
+    await bot.on_turn(turn_context)
+    assert adapter.activity_buffer[-1].text == bot.admission.busy_message
+
+async def test_shed_turn_is_acknowledged(aiohttp_client):
+    adapter = CloudAdapter(ConfigurationBotFrameworkAuthentication(DefaultConfig()))
+    admission = controller(max_in_flight=0, max_queue=0)
+    app = web.Application()
+    app.add_routes(messages_routes(adapter, create_bot(), admission=admission))
+    client = await aiohttp_client(app)
+    sent = []
+    async def send_activities(turn_context, activities):
+        sent.extend(activities)
+        return []
+    adapter.send_activities = send_activities
+    response = await client.post("/api/messages", json=message_activity("Plan a trip to Rome").serialize())
+    # Redelivering a turn that answered with the busy message would answer it twice
+    assert response.status == 200
+    assert sent[-1].text == admission.busy_message
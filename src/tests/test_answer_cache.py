@@ -0,0 +1,98 @@
+import time
+
+from aiohttp import web
+from botbuilder.core import MemoryStorage, TurnContext
+
+from data_models import ConversationData
+from routes.api.admin import answer_cache_routes
+from services.answer_cache import AnswerCache
+from services.metrics import MetricsRegistry
+from tests.conftest import FakeAgentsClient, NullAdapter, create_bot, message_activity
+
+def test_context_free_questions():
+    answer_cache = AnswerCache("agent_hash", registry=MetricsRegistry())
+    conversation_data = ConversationData([])
+    assert answer_cache.is_context_free(["What is the checked baggage allowance?"], conversation_data)
+    assert answer_cache.is_context_free(["how many vacation days do new employees get"], conversation_data)
+    assert not answer_cache.is_context_free(["Is it open tomorrow?"], conversation_data)
+    assert not answer_cache.is_context_free(["What about the other one?"], conversation_data)
+    assert not answer_cache.is_context_free(["Book the flight"], conversation_data)
+    assert not answer_cache.is_context_free(["What is covered?", "And dental?"], conversation_data)
+    conversation_data.add_file("assistant-1")
+    assert not answer_cache.is_context_free(["What is covered?"], conversation_data)
+
+async def test_keys_expiry_and_invalidation():
+    registry = MetricsRegistry()
+    answer_cache = AnswerCache("agent_hash", ttl=60, registry=registry)
+    answer_cache.add("What is the baggage allowance?", "One bag of 23 kg.", 4)
+    assert await answer_cache.get("  what is the BAGGAGE allowance ") == "One bag of 23 kg."
+    assert AnswerCache("updated_agent_hash", registry=MetricsRegistry()).key("What is the baggage allowance?") != answer_cache.key("What is the baggage allowance?")
+    assert answer_cache.stats() == {"scope": "worker", "answers": 1, "hits": 1, "misses": 0, "hit_ratio": 1, "seconds_saved": 4}
+
+    answer_cache.answers[answer_cache.key("What is the baggage allowance?")].expires_at = time.time() - 1
+    assert await answer_cache.get("What is the baggage allowance?") is None
+    answer_cache.add("What is the baggage allowance?", "One bag of 23 kg.", 4)
+    answer_cache.add("Can I bring a stroller?", "Yes, free of charge.", 4)
+    assert await answer_cache.invalidate("can i bring a stroller") == 1
+    assert await answer_cache.invalidate() == 1
+
+async def test_invalidation_reaches_every_worker():
+    storage = MemoryStorage()
+    workers = [AnswerCache("agent_hash", storage=storage, registry=MetricsRegistry()) for _ in range(2)]
+    for answer_cache in workers:
+        answer_cache.add("What is the baggage allowance?", "One bag of 23 kg.", 4)
+        answer_cache.add("Can I bring a stroller?", "Yes, free of charge.", 4)
+    assert await workers[0].invalidate("Can I bring a stroller?") == 1
+    assert await workers[1].get("Can I bring a stroller?") is None
+    assert await workers[1].get("What is the baggage allowance?") == "One bag of 23 kg."
+
+    await workers[1].invalidate()
+    assert await workers[0].get("What is the baggage allowance?") is None
+    # Answers of runs started after the invalidation are reused again
+    workers[0].add("What is the baggage allowance?", "Two bags of 23 kg.", 0)
+    assert await workers[0].get("What is the baggage allowance?") == "Two bags of 23 kg."
+
+async def test_cached_answers_skip_the_run():
+    agents_client = FakeAgentsClient(answer="New employees get 20 vacation days.")
+    bot = create_bot(agents_client)
+    bot.answer_cache = AnswerCache("agent_hash", registry=MetricsRegistry())
+    adapter = NullAdapter()
+    await bot.on_turn(TurnContext(adapter, message_activity("How many vacation days do new employees get?", conversation_id="conversation_1")))
+    turn_context = TurnContext(adapter, message_activity("how many vacation days do new employees get", conversation_id="conversation_2"))
+    replies = []
+    turn_context.on_send_activities(lambda context, activities, next: replies.extend(activities) or next())
+    await bot.on_turn(turn_context)
+
+    assert agents_client.run_count == 1
+    assert replies[-1].text == "New employees get 20 vacation days."
+    # The thread of the second conversation still holds the question and its answer
+    assert agents_client.messages[-2:] == ["how many vacation days do new employees get", "New employees get 20 vacation days."]
+    assert bot.answer_cache.stats()["hits"] == 1
+
+async def test_later_turns_are_not_cached():
+    agents_client = FakeAgentsClient(answer="One bag of 23 kg.")
+    bot = create_bot(agents_client)
+    bot.answer_cache = AnswerCache("agent_hash", registry=MetricsRegistry())
+    adapter = NullAdapter()
+    await bot.on_turn(TurnContext(adapter, message_activity("Plan my trip to Rome", conversation_id="conversation_1")))
+    await bot.on_turn(TurnContext(adapter, message_activity("What is the baggage allowance?", conversation_id="conversation_1")))
+    assert bot.answer_cache.stats()["answers"] == 0
+
+    await bot.on_turn(TurnContext(adapter, message_activity("What is the baggage allowance?", conversation_id="conversation_2")))
+    assert agents_client.run_count == 3
+    assert bot.answer_cache.stats()["answers"] == 1
+    # A cached answer is not reused for a question asked later in a conversation
+    await bot.on_turn(TurnContext(adapter, message_activity("What is the baggage allowance?", conversation_id="conversation_1")))
+    assert agents_client.run_count == 4
+
+async def test_admin_routes(aiohttp_client):
+    answer_cache = AnswerCache("agent_hash", registry=MetricsRegistry())
+    answer_cache.add("What is the baggage allowance?", "One bag of 23 kg.", 4)
+    app = web.Application()
+    app.add_routes(answer_cache_routes(answer_cache, "admin_key"))
+    client = await aiohttp_client(app)
+    assert (await client.get("/api/admin/answer-cache")).status == 401
+    response = await client.get("/api/admin/answer-cache", headers={"X-Admin-Key": "admin_key"})
+    assert (await response.json())["answers"] == 1
+    response = await client.delete("/api/admin/answer-cache", params={"question": "What is the baggage allowance?"}, headers={"X-Admin-Key": "admin_key"})
+    assert await response.json() == {"invalidated": 1, "scope": "worker"}
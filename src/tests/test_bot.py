@@ -7,7 +7,7 @@ from botbuilder.core import ConversationState, UserState, MemoryStorage, TurnCon
 from botbuilder.schema import Attachment as BotAttachment, ChannelAccount
 from azure.identity import DefaultAzureCredential, get_bearer_token_provider
 from azure.ai.projects import AIProjectClient
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
 
 from bots import AssistantBot
 from services.bing import BingClient
@@ -22,11 +22,13 @@ load_dotenv()
 
 @pytest.fixture()
 async def turn_context(loop):
-    return MagicMock(spec=TurnContext)
+    turn_context = MagicMock(spec=TurnContext)
+    turn_context.turn_state = {}
+    return turn_context
 
 @pytest.fixture()
 async def aoai_client(loop):
-    aoai_client = AzureOpenAI(
+    aoai_client = AsyncAzureOpenAI(
         api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
         azure_endpoint=os.getenv("AZURE_OPENAI_API_ENDPOINT"),
         api_key=os.getenv("AZURE_OPENAI_API_KEY"),
@@ -35,7 +37,7 @@ async def aoai_client(loop):
             "https://cognitiveservices.azure.com/.default"
         )
     )
-    # aoai_client = MagicMock(spec=AzureOpenAI)
+    # aoai_client = MagicMock(spec=AsyncAzureOpenAI)
     return aoai_client
 
 project_client = AIProjectClient.from_connection_string(
@@ -150,14 +152,15 @@ async def test_image_query(bot, turn_context, aoai_client):
     )
     turn_context.activity.attachments = [attachment]
     await bot.on_message_activity(turn_context)
-    assert "File uploaded: fork.jpg" in turn_context.send_activity.mock_calls[0][1][0].text
-    assert "Add to a tool?" in turn_context.send_activity.mock_calls[1][1][0].text
+    notices = turn_context.send_activities.mock_calls[0][1][0]
+    assert "File uploaded: fork.jpg" in notices[0].text
+    assert "Add to a tool?" in notices[1].text
     conversation_data = await bot.conversation_data_accessor.get(turn_context)
     conversation_data.attachments = [Attachment(name="fork.jpg", content_type="image/jpeg", url=f"file://{current_directory}/../../data/fork.jpg")]
     turn_context.activity.attachments = []
     turn_context.activity.text = "What's in this image?"
     await bot.on_message_activity(turn_context)
-    assert "fork" in turn_context.send_activity.mock_calls[2][1][0].text
+    assert "fork" in turn_context.send_activity.mock_calls[0][1][0].text
 
 async def test_file_search(bot, turn_context, aoai_client):
     attachment = BotAttachment(
@@ -167,14 +170,15 @@ async def test_file_search(bot, turn_context, aoai_client):
     )
     turn_context.activity.attachments = [attachment]
     await bot.on_message_activity(turn_context)
-    assert "File uploaded: ContosoBenefits.pdf" in turn_context.send_activity.mock_calls[0][1][0].text
-    assert "Add to a tool?" in turn_context.send_activity.mock_calls[1][1][0].text
+    notices = turn_context.send_activities.mock_calls[0][1][0]
+    assert "File uploaded: ContosoBenefits.pdf" in notices[0].text
+    assert "Add to a tool?" in notices[1].text
     conversation_data = await bot.conversation_data_accessor.get(turn_context)
     conversation_data.attachments = [Attachment(name="ContosoBenefits.pdf", content_type="application/pdf", url=f"file://{current_directory}/../../data/ContosoBenefits.pdf")]
     turn_context.activity.attachments = []
     turn_context.activity.text = ":File Search"
     await bot.on_message_activity(turn_context)
-    assert "added to File Search" in turn_context.send_activity.mock_calls[2][1][0].text
+    assert "added to File Search" in turn_context.send_activity.mock_calls[0][1][0].text
     turn_context.activity.text = "What is my dental care coverage limit?"
     await bot.on_message_activity(turn_context)
-    assert "1000" or "1,000" in turn_context.send_activity.mock_calls[3][1][0].text
+    assert "1000" or "1,000" in turn_context.send_activity.mock_calls[1][1][0].text
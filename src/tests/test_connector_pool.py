@@ -0,0 +1,34 @@
+from botbuilder.core import TurnContext
+from botbuilder.integration.aiohttp import CloudAdapter, ConfigurationBotFrameworkAuthentication
+from botframework.connector.auth import UserTokenClient
+
+from config import DefaultConfig
+from services.connector_pool import PooledBotFrameworkAuthentication
+from services.metrics import MetricsRegistry
+from tests.conftest import message_activity
+
+async def test_clients_are_shared_by_turns():
+    registry = MetricsRegistry()
+    connector_pool = PooledBotFrameworkAuthentication(ConfigurationBotFrameworkAuthentication(DefaultConfig()), registry=registry)
+    adapter = CloudAdapter(connector_pool)
+    connector_clients = []
+    user_token_clients = []
+
+    async def logic(turn_context: TurnContext):
+        connector_clients.append(turn_context.turn_state[adapter.BOT_CONNECTOR_CLIENT_KEY])
+        user_token_clients.append(turn_context.turn_state[UserTokenClient.__name__])
+
+    await adapter.process_activity("", message_activity("Hello", conversation_id="conversation_1"), logic)
+    await adapter.process_activity("", message_activity("Hello", conversation_id="conversation_2"), logic)
+    activity = message_activity("Hello")
+    activity.service_url = "https://smba.trafficmanager.net/emea/"
+    await adapter.process_activity("", activity, logic)
+
+    assert connector_clients[0] is connector_clients[1]
+    assert connector_clients[2] is not connector_clients[0]
+    assert user_token_clients[0] is user_token_clients[2]
+    created = registry.counter("connector_clients_created_total", "", ["kind"])
+    assert created.get(kind="connector") == 2
+    assert created.get(kind="user_token") == 1
+    await connector_pool.close()
+    assert not connector_pool.connector_clients
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+import pytest
+from botbuilder.core import MemoryStorage, TurnContext
+from botbuilder.core.adapters import TestAdapter
+from botbuilder.schema import Activity, ActivityTypes, ChannelAccount, ConversationAccount
+
+from services.conversation_lock import ConversationLease, LeaseUnavailableError, TurnSerializer
+from tests.conftest import FakeAgentsClient, create_bot, text_run_events
+
+def message(text):
+    return Activity(
+        type=ActivityTypes.message,
+        text=text,
+        channel_id="test",
+        conversation=ConversationAccount(id="conversation_1"),
+        from_property=ChannelAccount(id="user_1"),
+        recipient=ChannelAccount(id="bot"),
+    )
+
+async def test_turns_are_serialized():
+    serializer = TurnSerializer()
+    events = []
+    async def turn(name):
+        async with serializer.turn("conversation_1"):
+            events.append(f"{name} start")
+            await asyncio.sleep(0.01)
+            events.append(f"{name} end")
+    await asyncio.gather(turn("a"), turn("b"))
+    assert events == ["a start", "a end", "b start", "b end"]
+    assert serializer.locks == {}
+
+async def test_lease_across_workers():
+    storage = MemoryStorage()
+    worker_1 = ConversationLease(storage, duration=60, poll_interval=0.01)
+    worker_2 = ConversationLease(storage, duration=60, poll_interval=0.01)
+    owner = await worker_1.acquire("conversation_1")
+    assert owner is not None
+    assert await worker_2.acquire("conversation_1", timeout=0.05) is None
+    await worker_1.release("conversation_1", owner)
+    assert await worker_2.acquire("conversation_1", timeout=0.05) is not None
+
+async def test_expired_lease():
+    storage = MemoryStorage()
+    assert await ConversationLease(storage, duration=-1).acquire("conversation_1") is not None
+    assert await ConversationLease(storage, duration=60).acquire("conversation_1", timeout=0) is not None
+
+async def test_burst_is_coalesced():
+    agents_client = FakeAgentsClient()
+    bot = create_bot(agents_client)
+    bot.cancel_superseded_runs = False
+    release = threading.Event()
+
+    def first_run(thread_id, assistant_id, **kwargs):
+        agents_client.runs.append(thread_id)
+        release.wait(5)
+        yield from text_run_events("First answer")
+    agents_client.create_stream = first_run
+
+    adapter = TestAdapter()
+    first = asyncio.create_task(bot.on_turn(TurnContext(adapter, message("Plan a trip to Rome"))))
+    await asyncio.sleep(0.05)
+    second = asyncio.create_task(bot.on_turn(TurnContext(adapter, message("For 3 days"))))
+    third = asyncio.create_task(bot.on_turn(TurnContext(adapter, message("In May"))))
+    await asyncio.sleep(0.05)
+    agents_client.create_stream = FakeAgentsClient.create_stream.__get__(agents_client)
+    release.set()
+    await asyncio.gather(first, second, third)
+
+    # Both follow-up messages are answered by a single run
+    assert agents_client.messages == ["Plan a trip to Rome", "For 3 days", "In May"]
+    assert len(agents_client.runs) == 2
+
+async def test_lease_is_created_once():
+    storage = MemoryStorage()
+    leases = [ConversationLease(storage, duration=60, poll_interval=0.01) for _ in range(5)]
+    owners = await asyncio.gather(*[lease.acquire("conversation_1", timeout=0) for lease in leases])
+    assert len([owner for owner in owners if owner]) == 1
+
+async def test_turn_fails_without_lease():
+    storage = MemoryStorage()
+    await ConversationLease(storage, duration=60).acquire("conversation_1")
+    serializer = TurnSerializer(ConversationLease(storage, duration=0.05, poll_interval=0.01))
+    with pytest.raises(LeaseUnavailableError):
+        async with serializer.turn("conversation_1"):
+            pass
+
+async def test_turn_without_lease_drops_its_queued_message():
+    storage = MemoryStorage()
+    await ConversationLease(storage, duration=60).acquire("conversation_1")
+    bot = create_bot()
+    bot.turn_serializer = TurnSerializer(ConversationLease(storage, duration=0.05, poll_interval=0.01))
+    adapter = TestAdapter()
+    await bot.on_turn(TurnContext(adapter, message("Plan a trip to Rome")))
+    assert adapter.activity_buffer[-1].text == "I am still working on your previous message. Please send this one again in a moment."
+    assert bot.turn_serializer.take_pending("conversation_1") == []
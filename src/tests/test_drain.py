@@ -0,0 +1,65 @@
+import asyncio
+
+from aiohttp import web
+
+from bots.run_orchestrator import RunOrchestrator, RunRegistry
+from data_models import ConversationData
+from routes.api.messages import messages_routes
+from services.drain import WorkerDrain
+from services.metrics import MetricsRegistry
+from tests.conftest import FakeAgentsClient, NullAdapter, create_bot, text_run_events
+
+async def test_drain_waits_for_turns():
+    registry = MetricsRegistry()
+    drain = WorkerDrain(RunRegistry(), timeout=5, cancel_grace=1, registry=registry)
+    finished = []
+
+    async def logic(turn_context):
+        await asyncio.sleep(0.05)
+        finished.append(turn_context)
+
+    task = asyncio.create_task(drain.tracked(logic)("turn_context"))
+    await asyncio.sleep(0)
+    assert drain.in_flight == 1
+    await drain.drain()
+    await task
+    assert finished == ["turn_context"]
+    assert drain.draining and drain.in_flight == 0
+    assert registry.counter("worker_drain_interrupted_turns_total", "", ["outcome"]).get(outcome="cancelled") == 0
+    assert registry.histogram("worker_drain_seconds", "").get() == 1
+
+async def test_drain_cancels_streaming_runs(turn_context):
+    registry = MetricsRegistry()
+    agents_client = FakeAgentsClient()
+    bot = create_bot(agents_client)
+    conversation_data = ConversationData([])
+    orchestrator = RunOrchestrator(bot, conversation_data, turn_context)
+    bot.run_registry.start("conversation", orchestrator)
+    drain = WorkerDrain(bot.run_registry, timeout=0.2, cancel_grace=0.1, interrupted_message="Interrupted.", registry=registry)
+
+    def slow_events():
+        yield from text_run_events("Partial")
+        while True:
+            yield ("thread.run.step.delta", None)
+
+    task = asyncio.create_task(drain.tracked(lambda turn_context: orchestrator.run(slow_events()))(turn_context))
+    await asyncio.sleep(0.01)
+    await drain.drain()
+    await task
+    assert orchestrator.state == "cancelled"
+    assert agents_client.cancelled_runs == ["run_fake"]
+    assert turn_context.send_activity.mock_calls[-1][1][0].text == "Partial\n\nInterrupted."
+    assert conversation_data.history[-1].content == "Partial\n\nInterrupted."
+    assert registry.counter("worker_drain_interrupted_turns_total", "", ["outcome"]).get(outcome="cancelled") == 1
+
+async def test_messages_refused_while_draining(aiohttp_client):
+    bot = create_bot()
+    drain = WorkerDrain(bot.run_registry, registry=MetricsRegistry())
+    app = web.Application()
+    app.add_routes(messages_routes(NullAdapter(), bot, drain=drain))
+    app.on_shutdown.append(drain.on_shutdown)
+    client = await aiohttp_client(app)
+    drain.draining = True
+    response = await client.post("/api/messages", json={"type": "message", "text": "Hello"})
+    assert response.status == 503
+    assert response.headers["Retry-After"] == "1"
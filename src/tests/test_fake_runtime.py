@@ -0,0 +1,35 @@
+from botbuilder.core import ConversationState, MemoryStorage, TurnContext, UserState
+
+from bots import AssistantBot
+from dialogs import LoginDialog
+from benchmarks.fake_runtime import FakeAgentRuntime, FakeBingClient, FakeChatClient, RuntimeProfile
+from tests.conftest import NullAdapter, message_activity
+
+def create_bot(profile):
+    storage = MemoryStorage()
+    return AssistantBot(
+        ConversationState(storage), UserState(storage),
+        FakeChatClient(profile), FakeAgentRuntime(profile), "asst_fake",
+        FakeBingClient(profile), None, LoginDialog()
+    )
+
+class RecordingAdapter(NullAdapter):
+    def __init__(self):
+        super().__init__()
+        self.activities = []
+
+    async def send_activities(self, context, activities):
+        self.activities.extend(activities)
+        return await super().send_activities(context, activities)
+
+async def test_tool_call_run():
+    profile = RuntimeProfile(first_token_latency=0, tokens_per_second=0, answer_tokens=10, tool_call_rate=1, tool_latency=0, failure_rate=0)
+    adapter = RecordingAdapter()
+    await create_bot(profile).on_turn(TurnContext(adapter, message_activity("Find me a hotel")))
+    assert adapter.activities[-1].text.startswith("Day one arrive in Rome")
+
+async def test_failed_run():
+    profile = RuntimeProfile(first_token_latency=0, tokens_per_second=0, tool_call_rate=0, failure_rate=1)
+    adapter = RecordingAdapter()
+    await create_bot(profile).on_turn(TurnContext(adapter, message_activity("Plan my trip")))
+    assert adapter.activities[-1].text == "Sorry, something went wrong."
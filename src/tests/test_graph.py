@@ -0,0 +1,53 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from data_models import ConversationData
+from services.graph import GraphClient
+from bots.run_orchestrator import RunOrchestrator
+from tests.conftest import FakeAgentsClient, FakeTurnContext, GraphStub, create_bot, text_run_events
+
+async def graph_client(aiohttp_server, stub: GraphStub) -> GraphClient:
+    server = await aiohttp_server(stub.app())
+    return GraphClient(endpoint=str(server.make_url("/v1.0")), max_retries=2)
+
+async def test_events_of_a_round_share_a_batch(aiohttp_server):
+    stub = GraphStub()
+    client = await graph_client(aiohttp_server, stub)
+    outputs = await asyncio.gather(
+        client.schedule_event_batched("token", "Flight to Rome", "2024-05-01T08:00:00", "2024-05-01T10:00:00"),
+        client.schedule_event_batched("token", "Hotel check-in", "2024-05-01T14:00:00", "2024-05-01T15:00:00"),
+        client.schedule_event_batched("token", "Colosseum tour", "2024-05-02T09:00:00", "2024-05-02T12:00:00"),
+    )
+    assert stub.batch_requests == 1
+    assert [json.loads(output)["subject"] for output in outputs] == ["Flight to Rome", "Hotel check-in", "Colosseum tour"]
+
+async def test_throttled_batch_requests_are_retried(aiohttp_server):
+    stub = GraphStub(throttle_count=1)
+    client = await graph_client(aiohttp_server, stub)
+    outputs = await asyncio.gather(
+        client.schedule_event_batched("token", "Flight to Rome", "2024-05-01T08:00:00", "2024-05-01T10:00:00"),
+        client.schedule_event_batched("token", "Hotel check-in", "2024-05-01T14:00:00", "2024-05-01T15:00:00"),
+    )
+    assert stub.batch_requests == 2
+    assert [json.loads(output)["subject"] for output in outputs] == ["Flight to Rome", "Hotel check-in"]
+    assert len(stub.events) == 2
+
+async def test_tool_round_batches_schedule_event(aiohttp_server):
+    stub = GraphStub()
+    bot = create_bot(FakeAgentsClient(tool_output_runs=[list(text_run_events("Booked!"))]))
+    bot.graph_client = await graph_client(aiohttp_server, stub)
+    tool_calls = [
+        SimpleNamespace(id=f"call_{i}", type="function", function=SimpleNamespace(name="schedule_event", arguments=json.dumps({"subject": subject, "start": "2024-05-01T08:00:00", "end": "2024-05-01T10:00:00"})))
+        for i, subject in enumerate(["Flight to Rome", "Hotel check-in"])
+    ]
+    action = SimpleNamespace(submit_tool_outputs=SimpleNamespace(tool_calls=tool_calls))
+    events = [("thread.run.created", SimpleNamespace(id="run_fake")), ("thread.run.requires_action", SimpleNamespace(id="run_fake", required_action=action))]
+    orchestrator = RunOrchestrator(bot, ConversationData([]), FakeTurnContext(text="Book my trip"))
+    await orchestrator.run(iter(events))
+
+    assert orchestrator.state == "completed"
+    assert stub.batch_requests == 1
+    tool_outputs = bot.agents_client.submitted_tool_outputs[0]
+    assert [output["tool_call_id"] for output in tool_outputs] == ["call_0", "call_1"]
+    assert [json.loads(output["output"])["subject"] for output in tool_outputs] == ["Flight to Rome", "Hotel check-in"]
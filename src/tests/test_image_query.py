@@ -0,0 +1,80 @@
+import asyncio
+import os
+
+from botbuilder.core import ConversationState, MemoryStorage, UserState
+
+from bots import AssistantBot
+from bots.assistant_bot import VISION_SECONDS
+from data_models import Attachment, ConversationData
+from dialogs import LoginDialog
+from benchmarks.fake_runtime import FakeAgentRuntime, FakeBingClient, FakeChatClient, RuntimeProfile
+from services.metrics import MetricsRegistry
+from services.rate_limit import RateLimiter
+from services.telemetry import TRACER
+
+current_directory = os.path.dirname(os.path.abspath(__file__))
+
+def create_bot(profile):
+    storage = MemoryStorage()
+    return AssistantBot(
+        ConversationState(storage), UserState(storage),
+        FakeChatClient(profile), FakeAgentRuntime(profile), "asst_fake",
+        FakeBingClient(profile), None, LoginDialog()
+    )
+
+def conversation_data():
+    conversation_data = ConversationData([])
+    conversation_data.attachments = [Attachment(name="fork.jpg", content_type="image/jpeg", url=f"file://{current_directory}/../../data/fork.jpg")]
+    return conversation_data
+
+async def test_streamed_answer():
+    bot = create_bot(RuntimeProfile(chat_latency=0, tokens_per_second=0))
+    completed = VISION_SECONDS.get(outcome="completed")
+    answer = await bot.image_query(conversation_data(), "What's in this image?", "fork.jpg")
+    assert answer == "The image shows the Colosseum at sunset."
+    assert VISION_SECONDS.get(outcome="completed") == completed + 1
+    span = TRACER.exporter.find("vision.completion")[-1]
+    assert span.attributes["outcome"] == "completed"
+    assert [event["name"] for event in span.events] == ["first_token"]
+
+async def test_length_budget():
+    bot = create_bot(RuntimeProfile(chat_latency=0, tokens_per_second=0))
+    bot.vision_max_tokens = 3
+    answer = await bot.image_query(conversation_data(), "What's in this image?", "fork.jpg")
+    assert answer == "The image shows"
+
+async def test_time_budget_keeps_partial_answer():
+    bot = create_bot(RuntimeProfile(chat_latency=0, tokens_per_second=10))
+    bot.vision_timeout = 0.25
+    answer = await bot.image_query(conversation_data(), "What's in this image?", "fork.jpg")
+    assert answer.startswith("The image")
+    assert answer != "The image shows the Colosseum at sunset."
+    assert TRACER.exporter.find("vision.completion")[-1].attributes["outcome"] == "timeout"
+
+async def test_time_budget_without_answer():
+    bot = create_bot(RuntimeProfile(chat_latency=1, tokens_per_second=0))
+    bot.vision_timeout = 0.1
+    answer = await bot.image_query(conversation_data(), "What's in this image?", "fork.jpg")
+    assert answer == "The image could not be analyzed in time."
+
+async def test_time_budget_without_asyncio_timeout(monkeypatch):
+    # App Service runs Python 3.10, which has no asyncio.timeout
+    monkeypatch.delattr(asyncio, "timeout", raising=False)
+    bot = create_bot(RuntimeProfile(chat_latency=0, tokens_per_second=10))
+    bot.vision_timeout = 0.25
+    answer = await bot.image_query(conversation_data(), "What's in this image?", "fork.jpg")
+    assert answer.startswith("The image")
+    assert TRACER.exporter.find("vision.completion")[-1].attributes["outcome"] == "timeout"
+
+async def test_reservation_is_settled(tmp_path):
+    bot = create_bot(RuntimeProfile(chat_latency=0, tokens_per_second=0))
+    bot.rate_limiter = RateLimiter(tokens_per_minute=100000, requests_per_minute=0, state_path=str(tmp_path / "bucket.json"), registry=MetricsRegistry())
+    await bot.image_query(conversation_data(), "What's in this image?", "fork.jpg")
+    assert bot.rate_limiter.tokens_counter.get(kind="chat") == 907
+
+    # A completion cut before its first token gives its reservation back
+    bot = create_bot(RuntimeProfile(chat_latency=1, tokens_per_second=0))
+    bot.rate_limiter = RateLimiter(tokens_per_minute=100000, requests_per_minute=0, state_path=str(tmp_path / "other_bucket.json"), registry=MetricsRegistry())
+    bot.vision_timeout = 0.1
+    await bot.image_query(conversation_data(), "What's in this image?", "fork.jpg")
+    assert bot.rate_limiter.state.update(lambda state: state.get("tokens")) == 100000
@@ -0,0 +1,71 @@
+import time
+from types import SimpleNamespace
+
+from botbuilder.core import ConversationState, MemoryStorage, TurnContext, UserState
+
+from bots import AssistantBot
+from data_models import ConversationData
+from dialogs import LoginDialog
+from services.janitor import ResourceJanitor
+from services.metrics import MetricsRegistry
+from benchmarks.fake_runtime import FakeAgentRuntime
+from tests.conftest import NullAdapter, message_activity
+
+async def add_conversation(storage, agents_client, janitor, conversation_id, last_activity, touched):
+    """Stores a conversation owning a thread with a file search vector store, and an uploaded file."""
+    conversation_data = ConversationData([], thread_id=agents_client.create_thread().id)
+    file_id = agents_client.upload_file(purpose="assistants").id
+    conversation_data.add_file(file_id)
+    agents_client.create_message(conversation_data.thread_id, "user", "File uploaded: benefits.pdf", attachments=[{"file_id": file_id, "tools": [{"type": "file_search"}]}])
+    conversation_data.last_activity = last_activity
+    state_key = f"directline/conversations/{conversation_id}"
+    await storage.write({state_key: {"ConversationData": conversation_data}})
+    janitor.touch(state_key, touched)
+    return state_key
+
+async def test_idle_conversations_are_reclaimed():
+    storage = MemoryStorage()
+    registry = MetricsRegistry()
+    agents_client = FakeAgentRuntime()
+    janitor = ResourceJanitor(storage, agents_client, idle_after=3600, deletes_per_second=0, registry=registry)
+    two_hours_ago = time.time() - 7200
+    idle_key = await add_conversation(storage, agents_client, janitor, "conversation_idle", two_hours_ago, two_hours_ago)
+    # Its index entry is stale, but a turn on another worker wrote the state since
+    active_key = await add_conversation(storage, agents_client, janitor, "conversation_active", time.time(), two_hours_ago)
+
+    report = await janitor.sweep()
+    assert report.to_dict() == {"conversations": 1, "threads": 1, "files": 1, "vector_stores": 1, "failures": 0}
+    assert len(agents_client.threads) == 1 and len(agents_client.files) == 1 and len(agents_client.vector_stores) == 1
+    conversation_data = (await storage.read([idle_key]))[idle_key]["ConversationData"]
+    assert conversation_data.thread_id is None and conversation_data.file_ids == []
+    assert (await storage.read([active_key]))[active_key]["ConversationData"].thread_id in agents_client.threads
+    assert registry.counter("janitor_reclaimed_total", "", ["kind"]).get(kind="threads") == 1
+
+    # Reclaimed conversations leave the index, and other workers skip the sweep while the lease runs
+    assert (await janitor.sweep()).conversations == 0
+
+async def test_already_deleted_resources_count_as_reclaimed():
+    storage = MemoryStorage()
+    agents_client = FakeAgentRuntime()
+    janitor = ResourceJanitor(storage, agents_client, idle_after=3600, deletes_per_second=0, registry=MetricsRegistry())
+    two_hours_ago = time.time() - 7200
+    state_key = await add_conversation(storage, agents_client, janitor, "conversation_idle", two_hours_ago, two_hours_ago)
+    conversation_data = (await storage.read([state_key]))[state_key]["ConversationData"]
+    agents_client.delete_file(conversation_data.file_ids[0])
+
+    report = await janitor.sweep()
+    assert report.files == 1 and report.failures == 0
+
+async def test_turns_record_ownership():
+    storage = MemoryStorage()
+    agents_client = FakeAgentRuntime()
+    janitor = ResourceJanitor(storage, agents_client, registry=MetricsRegistry())
+    bot = AssistantBot(ConversationState(storage), UserState(storage), SimpleNamespace(chat=None), agents_client, "asst_fake", None, None, LoginDialog(), janitor=janitor)
+    await bot.on_turn(TurnContext(NullAdapter(), message_activity("clear")))
+    state_key = "directline/conversations/conversation_fake"
+    assert state_key in janitor.touched
+    await janitor.flush()
+    assert not janitor.touched
+    index = [(await storage.read([f"janitor/conversations/{shard}"])).get(f"janitor/conversations/{shard}") for shard in range(janitor.shards)]
+    assert any(document and state_key in document["conversations"] for document in index)
+    assert (await storage.read([state_key]))[state_key]["ConversationData"].last_activity is not None
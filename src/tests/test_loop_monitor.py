@@ -0,0 +1,36 @@
+import asyncio
+import os
+import time
+import traceback
+
+from services.loop_monitor import LoopMonitor, SOURCE_DIRECTORY, attribute
+from services.metrics import MetricsRegistry
+
+def frame(path, name):
+    return traceback.FrameSummary(os.path.join(SOURCE_DIRECTORY, path), 1, name)
+
+def test_attribute():
+    stack = traceback.StackSummary.from_list([
+        frame("app.py", "<module>"),
+        frame("routes/api/messages.py", "messages"),
+        frame("bots/assistant_bot.py", "on_message_activity"),
+        frame("services/bing.py", "query"),
+        traceback.FrameSummary("/usr/lib/python3/site-packages/requests/api.py", 1, "get"),
+    ])
+    assert attribute(stack) == ("routes/api/messages.py:messages", "services/bing.py:query")
+    assert attribute(traceback.StackSummary.from_list([])) == ("unknown", "unknown")
+
+async def test_blocked_loop():
+    monitor = LoopMonitor(interval=0.02, threshold=0.1, registry=MetricsRegistry())
+    monitor.start()
+    await asyncio.sleep(0.05)
+    time.sleep(0.3)
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+    assert len(monitor.reports) == 1
+    assert monitor.reports[0]["blocked_seconds"] >= 0.1
+    assert any("test_blocked_loop" in line for line in monitor.reports[0]["stack"])
+    assert monitor.lag_histogram.get() > 0
+    assert monitor.blocked_counter.get(route="unknown", location="unknown") == 1
+    # The whole block is counted, not the threshold it crossed when sampled
+    assert monitor.blocked_seconds.get(route="unknown", location="unknown") >= 0.25
@@ -0,0 +1,36 @@
+import tracemalloc
+from aiohttp import web
+
+from routes.api.admin import admin_routes
+from services.memory import MemoryProfiler, resident_memory_bytes
+from services.metrics import MetricsRegistry
+
+async def test_memory_admin(aiohttp_client):
+    profiler = MemoryProfiler(snapshot_interval=3600, registry=MetricsRegistry())
+    app = web.Application(middlewares=[profiler.middleware])
+    app.on_startup.append(profiler.on_startup)
+    app.on_cleanup.append(profiler.on_cleanup)
+    retained = []
+    async def allocate(req):
+        retained.append(bytearray(1024 * 1024))
+        return web.Response()
+    app.add_routes([web.get("/allocate", allocate)])
+    app.add_routes(admin_routes(profiler, "secret"))
+    client = await aiohttp_client(app)
+    assert tracemalloc.is_tracing()
+
+    await client.get("/allocate")
+    resp = await client.get("/api/admin/memory")
+    assert resp.status == 401
+    resp = await client.get("/api/admin/memory", headers={"X-Admin-Key": "secret"})
+    summary = await resp.json()
+    assert summary["routes"]["/allocate"]["requests"] == 1
+    assert summary["routes"]["/allocate"]["allocated_bytes"] >= 1024 * 1024
+
+    resp = await client.post("/api/admin/memory/snapshot", headers={"X-Admin-Key": "secret"})
+    report = await resp.json()
+    assert report["growth_since_start"][0]["size_diff"] >= 1024 * 1024
+    assert "test_memory.py" in report["growth_since_start"][0]["location"]
+
+def test_resident_memory():
+    assert resident_memory_bytes() > 0
@@ -0,0 +1,18 @@
+import json
+
+from services.cosmos import CosmosDbKeyEscape
+from benchmarks import micro
+
+def test_key_escaping():
+    # Optimizations of the benchmarked paths must keep the stored keys unchanged
+    assert CosmosDbKeyEscape.sanitize_key("a/b?c#d\\e*f\tg") == "a*47b*63c*35d*92e*42f*9g"
+    assert CosmosDbKeyEscape.sanitize_key(micro.DIRECTLINE_KEY, "-suffix") == "directline*47conversations*478Zk3xVqL2mN7pR4tY9wB1c-us-suffix"
+    truncated = CosmosDbKeyEscape.sanitize_key(micro.LONG_KEY)
+    assert len(truncated) == 255
+    assert CosmosDbKeyEscape.sanitize_key(micro.LONG_KEY, compatibility_mode=False).endswith("x" * 120)
+
+def test_micro_benchmarks(tmp_path):
+    baseline = tmp_path / "micro.json"
+    args = micro.parse_arguments(["--repeat", "1", "--min-time", "0.001", "--baseline", str(baseline), "--update-baseline"])
+    assert micro.main(args) == 0
+    assert set(json.loads(baseline.read_text())) == set(micro.CASES)
@@ -0,0 +1,39 @@
+from botbuilder.core import TurnContext
+
+from data_models import ConversationData
+from services.metrics import MetricsRegistry
+from services.model_router import FAST, FULL, ModelRouter
+from tests.conftest import FakeAgentsClient, NullAdapter, create_bot, message_activity
+
+class AgentRecordingClient(FakeAgentsClient):
+    def __init__(self):
+        super().__init__()
+        self.assistant_ids = []
+
+    def create_stream(self, thread_id: str, assistant_id: str, **kwargs):
+        self.assistant_ids.append(assistant_id)
+        return super().create_stream(thread_id, assistant_id, **kwargs)
+
+def test_classification():
+    router = ModelRouter("asst_fast", registry=MetricsRegistry())
+    conversation_data = ConversationData([])
+    assert router.classify(["thanks!"], conversation_data) == (FAST, "simple")
+    assert router.classify(["What time is it in Rome?"], conversation_data) == (FAST, "simple")
+    assert router.classify(["Find me a hotel near the Pantheon"], conversation_data) == (FULL, "keyword")
+    assert router.classify(["Where should we eat tonight? And tomorrow?"], conversation_data) == (FULL, "questions")
+    assert router.classify(["I would like to spend three days in Rome with my two kids in late May"], conversation_data) == (FULL, "length")
+    conversation_data.add_file("assistant-1")
+    assert router.classify(["thanks!"], conversation_data) == (FULL, "files")
+    assert ModelRouter(registry=MetricsRegistry()).classify(["thanks!"], ConversationData([])) == (FULL, "disabled")
+
+async def test_turns_run_on_their_tier():
+    registry = MetricsRegistry()
+    agents_client = AgentRecordingClient()
+    bot = create_bot(agents_client)
+    bot.router = ModelRouter("asst_fast", registry=registry)
+    await bot.on_turn(TurnContext(NullAdapter(), message_activity("thanks!")))
+    await bot.on_turn(TurnContext(NullAdapter(), message_activity("Search the latest news about the Colosseum")))
+    assert agents_client.assistant_ids == ["asst_fast", "asst_fake"]
+    assert registry.counter("model_routing_decisions_total", "", ["tier", "reason"]).get(tier=FULL, reason="keyword") == 1
+    turn_seconds = registry.histogram("model_routing_turn_seconds", "", ["tier"])
+    assert turn_seconds.get(tier=FAST) == 1 and turn_seconds.get(tier=FULL) == 1
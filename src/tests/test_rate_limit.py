@@ -0,0 +1,101 @@
+import time
+import pytest
+from types import SimpleNamespace
+
+from data_models import ConversationData
+from services.rate_limit import RateLimiter, retry_after
+from services.metrics import MetricsRegistry
+from tests.conftest import create_bot, text_run_events
+
+def limiter(tmp_path, **kwargs):
+    return RateLimiter(state_path=str(tmp_path / "bucket.json"), registry=MetricsRegistry(), **kwargs)
+
+class Throttled(Exception):
+    status_code = 429
+    def __init__(self, headers):
+        self.response = SimpleNamespace(headers=headers)
+
+def test_retry_after():
+    assert retry_after(Throttled({"retry-after": "2"})) == 2
+    assert retry_after(Throttled({"retry-after-ms": "1500"})) == 1.5
+    assert retry_after(Throttled({})) is None
+    assert retry_after(ValueError()) is None
+
+def test_estimate_chat_tokens(tmp_path):
+    rate_limiter = limiter(tmp_path, tokens_per_minute=1000, requests_per_minute=10)
+    messages = [{"role": "user", "content": [
+        {"type": "text", "text": "x" * 400},
+        {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}},
+    ]}]
+    estimate = rate_limiter.estimate_chat_tokens(messages, max_tokens=100)
+    assert estimate == 100 + 765 + 100
+    # Usage reports pull later estimates toward what the service counted
+    rate_limiter.record_usage("chat", estimate, estimate // 2)
+    assert rate_limiter.estimate_chat_tokens(messages, max_tokens=100) < estimate
+
+async def test_bucket_is_shared(tmp_path):
+    worker_1 = limiter(tmp_path, tokens_per_minute=600, requests_per_minute=600)
+    worker_2 = limiter(tmp_path, tokens_per_minute=600, requests_per_minute=600)
+    await worker_1.acquire(590)
+    start = time.monotonic()
+    # 10 tokens per second refill, the second worker waits for the tokens the first one took
+    await worker_2.acquire(20)
+    assert time.monotonic() - start >= 0.9
+
+async def test_retry_throttled_call(tmp_path):
+    rate_limiter = limiter(tmp_path, tokens_per_minute=0, requests_per_minute=0)
+    calls = []
+    def create():
+        calls.append(time.monotonic())
+        if len(calls) < 3:
+            raise Throttled({"retry-after-ms": "50"})
+        return "created"
+    assert await rate_limiter.call("run", 0, create) == "created"
+    assert len(calls) == 3
+    assert calls[1] - calls[0] >= 0.05
+    assert rate_limiter.throttled_counter.get(kind="run") == 2
+
+async def test_other_errors_are_raised(tmp_path):
+    rate_limiter = limiter(tmp_path, tokens_per_minute=0, requests_per_minute=0)
+    def create():
+        raise ValueError("Bad request")
+    with pytest.raises(ValueError):
+        await rate_limiter.call("run", 0, create)
+
+def failed_run_events(code: str, message: str):
+    yield ("thread.run.created", SimpleNamespace(id="run_fake"))
+    yield ("thread.run.failed", SimpleNamespace(id="run_fake", usage=None, last_error=SimpleNamespace(code=code, message=message)))
+
+def tokens(rate_limiter) -> float:
+    return rate_limiter.state.update(lambda state: state["tokens"])
+
+def test_disabled_unless_configured(monkeypatch):
+    monkeypatch.delenv("AZURE_OPENAI_TOKENS_PER_MINUTE", raising=False)
+    monkeypatch.delenv("AZURE_OPENAI_REQUESTS_PER_MINUTE", raising=False)
+    rate_limiter = RateLimiter.from_environment()
+    assert rate_limiter.tokens_per_minute == 0 and rate_limiter.requests_per_minute == 0
+
+async def test_throttled_run_is_retried(tmp_path, turn_context):
+    bot = create_bot()
+    bot.rate_limiter = limiter(tmp_path, tokens_per_minute=60000, requests_per_minute=0)
+    restarts = []
+    async def restart():
+        restarts.append(time.monotonic())
+        await bot.rate_limiter.acquire(1000, "run")
+        return text_run_events("Booked!")
+    await bot.rate_limiter.acquire(1000, "run")
+    events = failed_run_events("rate_limit_exceeded", "Rate limit is exceeded. Try again in 0.05 seconds.")
+    orchestrator = await bot.process_run_streaming(events, ConversationData([]), turn_context, 1000, restart)
+    assert orchestrator.state == "completed" and orchestrator.message.text == "Booked!"
+    assert len(restarts) == 1
+    assert bot.rate_limiter.throttled_counter.get(kind="run") == 1
+
+async def test_failed_run_settles_reservation(tmp_path, turn_context):
+    bot = create_bot()
+    bot.rate_limiter = limiter(tmp_path, tokens_per_minute=60000, requests_per_minute=0)
+    await bot.rate_limiter.acquire(30000, "run")
+    assert tokens(bot.rate_limiter) <= 30001
+    orchestrator = await bot.process_run_streaming(failed_run_events("server_error", "Something went wrong."), ConversationData([]), turn_context, 30000)
+    assert orchestrator.state == "failed"
+    # Failed without using tokens, the reservation went back to the bucket
+    assert tokens(bot.rate_limiter) >= 59999
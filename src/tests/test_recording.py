@@ -0,0 +1,27 @@
+from data_models import ConversationData
+from services.recording import RunRecorder, load_recording
+from tests.conftest import FakeAgentsClient, FakeTurnContext, create_bot, text_run_events, tool_call_run_events
+from benchmarks.replay import replay
+
+async def test_record_and_replay(tmp_path):
+    agents_client = FakeAgentsClient(tool_output_runs=[list(text_run_events("Booked a table for two."))])
+    bot = create_bot(agents_client)
+    async def call_tool(tool_call, conversation_data, turn_context):
+        return "Table available at 8pm"
+    bot.call_tool = call_tool
+    bot.recorder = RunRecorder(str(tmp_path))
+    turn_context = FakeTurnContext(text="Book dinner")
+    await bot.process_run_streaming(tool_call_run_events("schedule_event", "{}"), ConversationData([]), turn_context)
+
+    path = str(next(tmp_path.iterdir()))
+    assert path.endswith(".jsonl.gz")
+    recording = load_recording(path)
+    assert recording["turn"]["texts"] == ["Book dinner"]
+    assert len(recording["segments"]) == 2
+    assert recording["tools"][0]["name"] == "schedule_event"
+    assert recording["tools"][0]["output"] == "Table available at 8pm"
+
+    result = await replay(recording)
+    # The replayed turn also sends the typing indicator, ahead of the run
+    assert result.sent == len(turn_context.sent) + 1
+    assert result.updated == len(turn_context.updated)
@@ -0,0 +1,80 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from bots.run_orchestrator import WEB_SEARCH_RUN_SECONDS, RunOrchestrator, RunRegistry
+from data_models import ConversationData
+from tests.conftest import FakeAgentsClient, create_bot, grounded_run_events, text_run_events, tool_call_run_events
+
+async def test_tool_rounds(turn_context):
+    agents_client = FakeAgentsClient(tool_output_runs=[list(text_run_events("Booked!"))])
+    bot = create_bot(agents_client)
+    await bot.process_run_streaming(tool_call_run_events("unknown_tool", "{}"), ConversationData([]), turn_context)
+    assert agents_client.submitted_tool_outputs == [[{"tool_call_id": "call_unknown_tool", "output": "Tool not found"}]]
+    assert turn_context.send_activity.mock_calls[-1][1][0].text == "Booked!"
+
+async def test_max_tool_rounds(turn_context):
+    agents_client = FakeAgentsClient(tool_output_runs=[list(tool_call_run_events("unknown_tool", "{}")) for _ in range(5)])
+    bot = create_bot(agents_client)
+    orchestrator = RunOrchestrator(bot, ConversationData([]), turn_context, max_tool_rounds=2)
+    await orchestrator.run(tool_call_run_events("unknown_tool", "{}"))
+    assert orchestrator.state == "failed"
+    assert len(agents_client.submitted_tool_outputs) == 2
+    assert agents_client.cancelled_runs == ["run_fake"]
+
+async def test_supersede_run(turn_context):
+    agents_client = FakeAgentsClient()
+    bot = create_bot(agents_client)
+    registry = RunRegistry()
+    orchestrator = RunOrchestrator(bot, ConversationData([]), turn_context)
+    registry.start("conversation", orchestrator)
+
+    def slow_events():
+        yield from text_run_events("Partial")
+        while True:
+            yield ("thread.run.step.delta", None)
+
+    task = asyncio.create_task(orchestrator.run(slow_events()))
+    await asyncio.sleep(0.05)
+    assert await registry.supersede("conversation")
+    await task
+    assert orchestrator.state == "cancelled"
+    assert agents_client.cancelled_runs == ["run_fake"]
+    assert not await registry.supersede("other_conversation")
+
+async def test_supersede_before_the_run_is_created(turn_context):
+    agents_client = FakeAgentsClient()
+    bot = create_bot(agents_client)
+    registry = RunRegistry()
+    orchestrator = RunOrchestrator(bot, ConversationData([]), turn_context)
+    registry.start("conversation", orchestrator)
+    run_created = threading.Event()
+
+    def late_events():
+        run_created.wait(5)
+        yield from text_run_events("Hello")
+
+    task = asyncio.create_task(orchestrator.run(late_events()))
+    superseded = asyncio.create_task(registry.supersede("conversation"))
+    await asyncio.sleep(0.05)
+    run_created.set()
+    await asyncio.gather(task, superseded)
+    assert orchestrator.state == "cancelled"
+    assert orchestrator.run_id == "run_fake"
+    assert agents_client.cancelled_runs == ["run_fake"]
+
+async def test_web_search_modes(turn_context):
+    client_runs = WEB_SEARCH_RUN_SECONDS.get(mode="client")
+    server_runs = WEB_SEARCH_RUN_SECONDS.get(mode="server")
+    agents_client = FakeAgentsClient(tool_output_runs=[list(text_run_events("The Pantheon opens at 9."))])
+    bot = create_bot(agents_client)
+    bot.bing_client = SimpleNamespace(query=lambda query, type: '[{"name": "Pantheon"}]')
+    orchestrator = await bot.process_run_streaming(tool_call_run_events("bing_query", '{"query": "Pantheon hours", "type": "webpages"}'), ConversationData([]), turn_context)
+    assert orchestrator.web_search_mode == "client"
+    assert agents_client.submitted_tool_outputs[0][0]["output"] == '[{"name": "Pantheon"}]'
+
+    orchestrator = await bot.process_run_streaming(grounded_run_events("The Pantheon opens at 9."), ConversationData([]), turn_context)
+    assert orchestrator.web_search_mode == "server"
+    assert orchestrator.message.text == "The Pantheon opens at 9."
+    assert WEB_SEARCH_RUN_SECONDS.get(mode="client") == client_runs + 1
+    assert WEB_SEARCH_RUN_SECONDS.get(mode="server") == server_runs + 1
@@ -0,0 +1,80 @@
+import asyncio
+import multiprocessing
+import pytest
+
+from data_models import ConversationData
+from services.conversation_lock import ConversationLease
+from services.metrics import MetricsRegistry
+from services.sqlite_storage import SqliteStorage
+
+@pytest.fixture()
+def storage(tmp_path):
+    storage = SqliteStorage(str(tmp_path / "state" / "bot_state.db"), registry=MetricsRegistry())
+    yield storage
+    storage.close()
+
+async def test_read_write_delete(storage):
+    conversation_data = ConversationData([], thread_id="thread_1")
+    conversation_data.add_turn("user", "Hello")
+    await storage.write({"directline/conversations/1": {"ConversationData": conversation_data}, "directline/users/1": {"name": "Ada"}})
+    items = await storage.read(["directline/conversations/1", "directline/users/1", "directline/conversations/2"])
+    assert set(items) == {"directline/conversations/1", "directline/users/1"}
+    restored = items["directline/conversations/1"]["ConversationData"]
+    assert restored.thread_id == "thread_1" and restored.history[0].content == "Hello"
+    assert items["directline/users/1"]["name"] == "Ada" and items["directline/users/1"]["e_tag"]
+
+    await storage.delete(["directline/users/1", "directline/users/2"])
+    assert await storage.read(["directline/users/1"]) == {}
+
+async def test_e_tags(storage):
+    await storage.write({"item": {"count": 1}})
+    item = (await storage.read(["item"]))["item"]
+    await storage.write({"item": {**item, "count": 2}})
+    with pytest.raises(KeyError):
+        await storage.write({"item": {**item, "count": 3}})
+    assert (await storage.read(["item"]))["item"]["count"] == 2
+
+    # A batch is written entirely, or not at all
+    with pytest.raises(KeyError):
+        await storage.write({"other": {"count": 1}, "item": {**item, "count": 4}})
+    assert await storage.read(["other"]) == {}
+
+    await storage.write({"item": {"count": 5, "e_tag": "*"}})
+    assert (await storage.read(["item"]))["item"]["count"] == 5
+
+async def test_conversation_lease(storage):
+    lease = ConversationLease(storage, duration=60, poll_interval=0.01)
+    owner = await lease.acquire("conversation", timeout=1)
+    assert owner
+    assert await ConversationLease(storage, poll_interval=0.01).acquire("conversation", timeout=0.05) is None
+    await lease.release("conversation", owner)
+    assert await ConversationLease(storage, poll_interval=0.01).acquire("conversation", timeout=0.05)
+
+def increment(path: str, times: int):
+    async def run():
+        storage = SqliteStorage(path, registry=MetricsRegistry())
+        for _ in range(times):
+            while True:
+                counter = (await storage.read(["counter"])).get("counter", {"value": 0})
+                try:
+                    await storage.write({"counter": {**counter, "value": counter["value"] + 1}})
+                    break
+                except KeyError:
+                    pass
+    asyncio.run(run())
+
+def test_concurrent_workers(tmp_path):
+    path = str(tmp_path / "bot_state.db")
+    asyncio.run(SqliteStorage(path, registry=MetricsRegistry()).write({"counter": {"value": 0}}))
+    processes = [multiprocessing.get_context("spawn").Process(target=increment, args=(path, 50)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+    assert all(process.exitcode == 0 for process in processes)
+    assert asyncio.run(SqliteStorage(path, registry=MetricsRegistry()).read(["counter"]))["counter"]["value"] == 200
+
+async def test_create(storage):
+    assert await storage.create("leases/conversation", {"owner": "worker_1"})
+    assert not await storage.create("leases/conversation", {"owner": "worker_2"})
+    assert (await storage.read(["leases/conversation"]))["leases/conversation"]["owner"] == "worker_1"
@@ -0,0 +1,44 @@
+from bots.message_stream import MessageStream
+from data_models import ConversationData
+from tests.conftest import create_bot, text_run_events
+
+def test_message_stream():
+    message = MessageStream()
+    message.append("Hello")
+    message.append(", ")
+    assert message.take_delta() == "Hello, "
+    message.append("world")
+    assert message.text == "Hello, world"
+    assert message.take_delta() == "world"
+    assert message.take_delta() == ""
+    assert len(message) == 12
+    message.replace("Failed")
+    assert message.text == "Failed"
+    assert message.take_delta() == ""
+
+async def test_delta_streaming(turn_context):
+    bot = create_bot(streaming_mode="delta")
+    answer = "Visit the Colosseum. " * 20
+    await bot.process_run_streaming(text_run_events(answer), ConversationData([]), turn_context)
+
+    activities = [call[1][0] for call in turn_context.send_activity.mock_calls]
+    interim = [a for a in activities[1:] if a.type == "typing"]
+    assert len(interim) > 1
+    # Interim chunks only carry new content, and add up to the streamed text
+    assert all(a.channel_data["streamMode"] == "delta" for a in interim)
+    assert answer.startswith("".join(a.text for a in interim))
+    # The last activity is the complete message
+    assert activities[-1].type == "message"
+    assert activities[-1].text == answer
+    assert "streamMode" not in activities[-1].channel_data
+
+async def test_full_streaming(turn_context):
+    bot = create_bot(streaming_mode="full")
+    answer = "Visit the Colosseum. " * 20
+    await bot.process_run_streaming(text_run_events(answer), ConversationData([]), turn_context)
+
+    activities = [call[1][0] for call in turn_context.send_activity.mock_calls]
+    # Each new message contains the previous
+    for i in range(2, len(activities)):
+        assert activities[i].text.startswith(activities[i-1].text)
+    assert activities[-1].text == answer
@@ -0,0 +1,71 @@
+import json
+import os
+import pytest
+from aiohttp import web
+
+from bots.run_orchestrator import RunOrchestrator, TIME_TO_FIRST_TOKEN_SECONDS
+from data_models import ConversationData
+from routes.api.metrics import metrics_routes
+from services.metrics import MetricsRegistry, WorkerMetrics
+from services.telemetry import LocalSpanExporter, Tracer, TRACER
+from tests.conftest import create_bot, text_run_events
+
+def test_span_nesting():
+    exporter = LocalSpanExporter()
+    tracer = Tracer(exporter, MetricsRegistry())
+    with tracer.span("turn") as turn:
+        with tracer.span("state.load", key="value") as load:
+            pass
+        with pytest.raises(ValueError):
+            with tracer.span("agent.run"):
+                raise ValueError("failed")
+    assert load.parent_span_id == turn.span_id
+    assert load.trace_id == turn.trace_id
+    assert load.attributes == {"key": "value"}
+    assert exporter.find("agent.run")[0].status == "error"
+    assert [span.name for span in exporter.spans] == ["state.load", "agent.run", "turn"]
+
+def test_render_metrics():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests", ["route"]).inc(route="/api/messages")
+    registry.histogram("latency_seconds", "Latency", buckets=[0.1, 1]).observe(0.5)
+    text = registry.render()
+    assert 'requests_total{route="/api/messages"} 1' in text
+    assert 'latency_seconds_bucket{le="0.1"} 0' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 1' in text
+    assert "latency_seconds_count 1" in text
+
+async def test_metrics_route(aiohttp_client):
+    registry = MetricsRegistry()
+    registry.gauge("in_flight", "In flight").set(3)
+    app = web.Application()
+    app.add_routes(metrics_routes("admin_key", registry=registry))
+    client = await aiohttp_client(app)
+    assert (await client.get("/metrics")).status == 401
+    resp = await client.get("/metrics", headers={"X-Admin-Key": "admin_key"})
+    assert resp.status == 200
+    assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert "in_flight 3" in await resp.text()
+
+async def test_worker_metrics(tmp_path):
+    worker_1 = MetricsRegistry()
+    worker_1.counter("requests_total", "Requests", ["route"]).inc(route="/api/messages")
+    worker_2 = MetricsRegistry()
+    worker_2.counter("requests_total", "Requests", ["route"]).inc(2, route="/api/messages")
+    exporter = WorkerMetrics(str(tmp_path), registry=worker_2)
+    (tmp_path / "1.json").write_text(json.dumps(worker_1.families({"worker": "1"})))
+    text = exporter.render()
+    # One family, with a series per worker
+    assert text.count("# TYPE requests_total counter") == 1
+    assert 'requests_total{route="/api/messages",worker="1"} 1' in text
+    assert f'requests_total{{route="/api/messages",worker="{os.getpid()}"}} 2' in text
+    exporter.snapshot()
+    assert os.path.exists(exporter.path)
+
+async def test_time_to_first_token(turn_context):
+    count = TIME_TO_FIRST_TOKEN_SECONDS.get()
+    orchestrator = RunOrchestrator(create_bot(), ConversationData([]), turn_context)
+    await orchestrator.run(text_run_events("Hello there"))
+    assert TIME_TO_FIRST_TOKEN_SECONDS.get() == count + 1
+    span = TRACER.exporter.find("agent.run")[-1]
+    assert [event["name"] for event in span.events] == ["first_token"]
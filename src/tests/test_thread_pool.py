@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+from botbuilder.core import TurnContext
+from botbuilder.schema import ActivityTypes, ChannelAccount
+
+from services.metrics import MetricsRegistry
+from services.thread_pool import ThreadPool
+from benchmarks.fake_runtime import FakeAgentRuntime
+from tests.conftest import FakeAgentsClient, NullAdapter, create_bot, message_activity
+
+class CountingAgentsClient(FakeAgentRuntime):
+    def __init__(self):
+        super().__init__()
+        self.created = []
+        self.deleted = []
+
+    def create_thread(self, **kwargs):
+        thread = super().create_thread(**kwargs)
+        self.created.append(thread.id)
+        return thread
+
+    def delete_thread(self, thread_id: str):
+        self.deleted.append(thread_id)
+        return super().delete_thread(thread_id)
+
+async def test_pool_is_refilled_in_background():
+    registry = MetricsRegistry()
+    agents_client = CountingAgentsClient()
+    thread_pool = ThreadPool(agents_client, size=2, registry=registry)
+    await thread_pool.on_startup(None)
+    await thread_pool.refill_task
+    assert len(agents_client.created) == 2
+
+    thread_id = await thread_pool.take()
+    assert thread_id == agents_client.created[0]
+    await thread_pool.refill_task
+    assert len(thread_pool.threads) == 2
+    requests = registry.counter("agent_thread_pool_requests_total", "", ["result"])
+    assert requests.get(result="hit") == 1
+
+    await thread_pool.on_cleanup(None)
+    assert agents_client.deleted == agents_client.created[1:]
+
+async def test_expired_threads_are_not_handed_out():
+    registry = MetricsRegistry()
+    agents_client = CountingAgentsClient()
+    thread_pool = ThreadPool(agents_client, size=1, max_age=60, registry=registry)
+    thread_pool.threads.append(("thread_old", time.time() - 120))
+    thread_id = await thread_pool.take()
+    assert thread_id != "thread_old"
+    await asyncio.sleep(0.05)
+    assert "thread_old" in agents_client.deleted
+    assert registry.counter("agent_thread_pool_requests_total", "", ["result"]).get(result="miss") == 1
+    thread_pool.delete_on_cleanup = False
+    await thread_pool.on_cleanup(None)
+
+async def test_thread_taken_by_the_first_message():
+    agents_client = FakeAgentsClient()
+    bot = create_bot(agents_client)
+    activity = message_activity(None)
+    activity.type = ActivityTypes.conversation_update
+    activity.members_added = [ChannelAccount(id="user_fake")]
+    turn_context = TurnContext(NullAdapter(), activity)
+    await bot.on_turn(turn_context)
+    # The welcome turn runs outside the turn serializer, it must not take a thread
+    conversation_data = await bot.conversation_data_accessor.get(turn_context)
+    assert conversation_data is None or conversation_data.thread_id is None
+
+    turn_context = TurnContext(NullAdapter(), message_activity("Hello"))
+    await bot.on_turn(turn_context)
+    conversation_data = await bot.conversation_data_accessor.get(turn_context)
+    assert conversation_data.thread_id == "thread_fake"
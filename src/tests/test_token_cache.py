@@ -0,0 +1,90 @@
+import time
+
+import jwt
+from botbuilder.core import TurnContext
+from botframework.connector.auth import UserTokenClient
+from botframework.connector.token_api.models import TokenResponse
+
+from services.metrics import MetricsRegistry
+from services.token_cache import UserTokenCache
+from tests.conftest import NullAdapter, create_bot, message_activity
+
+def token_response(name: str, expires_in: float) -> TokenResponse:
+    token = jwt.encode({"name": name, "exp": int(time.time() + expires_in)}, "a-test-signing-key-of-32-bytes-or-more", algorithm="HS256")
+    return TokenResponse(connection_name="default", token=token)
+
+class FakeUserTokenClient:
+    def __init__(self, expires_in: float = 3600):
+        self.expires_in = expires_in
+        self.requests = 0
+        self.sign_outs = 0
+
+    async def get_user_token(self, user_id, connection_name, channel_id, magic_code):
+        self.requests += 1
+        return token_response("Megan Bowen", self.expires_in)
+
+    async def sign_out_user(self, user_id, connection_name, channel_id):
+        self.sign_outs += 1
+
+def test_user_token_cache():
+    cache = UserTokenCache(refresh_margin=300, registry=MetricsRegistry())
+    assert cache.get("user", "default", "msteams") is None
+    cached = cache.add("user", "default", "msteams", token_response("Megan Bowen", 3600))
+    assert cached.claims["name"] == "Megan Bowen"
+    assert cache.get("user", "default", "msteams") is cached
+    assert cache.get("user", "default", "directline") is None
+    cache.invalidate("user", "default", "msteams")
+    assert cache.get("user", "default", "msteams") is None
+    # Tokens within the refresh margin of their expiry are used once, not kept
+    cache.add("user", "default", "msteams", token_response("Megan Bowen", 60))
+    assert cache.get("user", "default", "msteams") is None
+
+async def test_login_uses_cached_token():
+    bot = create_bot()
+    bot.sso_enabled = True
+    bot.user_token_cache = UserTokenCache(registry=MetricsRegistry())
+    user_token_client = FakeUserTokenClient()
+
+    def turn_context(text):
+        context = TurnContext(NullAdapter(), message_activity(text))
+        context.turn_state[UserTokenClient.__name__] = user_token_client
+        return context
+
+    for _ in range(3):
+        context = turn_context("Plan my trip")
+        await bot.user_state.load(context)
+        assert await bot.handle_login(context)
+        assert jwt.decode(context.activity.token, options={"verify_signature": False})["name"] == "Megan Bowen"
+    assert user_token_client.requests == 1
+
+    assert not await bot.handle_login(turn_context("logout"))
+    assert user_token_client.sign_outs == 1
+    context = turn_context("Plan my trip")
+    await bot.user_state.load(context)
+    assert await bot.handle_login(context)
+    assert user_token_client.requests == 2
+
+async def test_logout_on_another_worker():
+    worker_1, worker_2 = create_bot(), create_bot()
+    worker_2.user_state = worker_1.user_state
+    worker_2.user_profile_accessor = worker_1.user_profile_accessor
+    user_token_client = FakeUserTokenClient()
+    for bot in [worker_1, worker_2]:
+        bot.sso_enabled = True
+        bot.user_token_cache = UserTokenCache(registry=MetricsRegistry())
+
+    async def turn(bot, text):
+        context = TurnContext(NullAdapter(), message_activity(text))
+        context.turn_state[UserTokenClient.__name__] = user_token_client
+        await bot.user_state.load(context)
+        logged_in = await bot.handle_login(context)
+        await bot.user_state.save_changes(context)
+        return logged_in
+
+    assert await turn(worker_1, "Plan my trip")
+    assert not await turn(worker_2, "logout")
+    assert await turn(worker_1, "Plan my trip")
+    # The token cached by the first worker before the logout is not used
+    assert user_token_client.requests == 2
+    assert await turn(worker_1, "Plan my trip")
+    assert user_token_client.requests == 2
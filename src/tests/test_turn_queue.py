@@ -0,0 +1,66 @@
+import asyncio
+from aiohttp import web
+from botbuilder.core import ActivityHandler, MemoryStorage, TurnContext
+from botbuilder.integration.aiohttp import CloudAdapter, ConfigurationBotFrameworkAuthentication
+
+from config import DefaultConfig
+from routes.api.messages import messages_routes
+from services.metrics import MetricsRegistry
+from services.sqlite_storage import SqliteStorage
+from services.turn_queue import IdempotencyCache, TurnQueue
+from tests.conftest import message_activity
+
+class RecordingBot(ActivityHandler):
+    def __init__(self):
+        self.texts = []
+
+    async def on_message_activity(self, turn_context: TurnContext):
+        await asyncio.sleep(0.05)
+        self.texts.append(turn_context.activity.text)
+
+async def test_idempotency_cache(tmp_path):
+    storage = SqliteStorage(str(tmp_path / "bot_state.db"), registry=MetricsRegistry())
+    worker_1 = IdempotencyCache(storage=storage, registry=MetricsRegistry())
+    worker_2 = IdempotencyCache(storage=storage, registry=MetricsRegistry())
+    activity = message_activity("Hello")
+    assert not await worker_1.is_duplicate(activity)
+    assert await worker_1.is_duplicate(activity)
+    # Redelivered to another worker
+    assert await worker_2.is_duplicate(activity)
+    activity.id = "another_activity"
+    assert not await worker_2.is_duplicate(activity)
+
+async def test_idempotency_markers_expire(tmp_path):
+    storage = SqliteStorage(str(tmp_path / "bot_state.db"), purge_interval=0, registry=MetricsRegistry())
+    activity = message_activity("Hello")
+    assert not await IdempotencyCache(ttl=0.05, storage=storage, registry=MetricsRegistry()).is_duplicate(activity)
+    await asyncio.sleep(0.1)
+    # Expired markers are replaced, and purged with the next ones
+    assert not await IdempotencyCache(ttl=0.05, storage=storage, registry=MetricsRegistry()).is_duplicate(activity)
+    activity.id = "another_activity"
+    await asyncio.sleep(0.1)
+    assert not await IdempotencyCache(ttl=60, storage=storage, registry=MetricsRegistry()).is_duplicate(activity)
+    rows = await asyncio.to_thread(lambda: storage.connection.execute("SELECT key FROM items").fetchall())
+    assert [key for key, in rows] == ["activities/directline/conversation_fake/another_activity"]
+    # Storages without expiry are not used
+    assert IdempotencyCache(storage=MemoryStorage(), registry=MetricsRegistry()).storage is None
+
+async def test_background_turns(aiohttp_client):
+    adapter = CloudAdapter(ConfigurationBotFrameworkAuthentication(DefaultConfig()))
+    bot = RecordingBot()
+    turn_queue = TurnQueue(adapter, workers=2, registry=MetricsRegistry())
+    app = web.Application()
+    app.on_startup.append(turn_queue.on_startup)
+    app.on_cleanup.append(turn_queue.on_cleanup)
+    app.add_routes(messages_routes(adapter, bot, turn_queue=turn_queue, idempotency=IdempotencyCache(registry=MetricsRegistry())))
+    client = await aiohttp_client(app)
+
+    body = message_activity("Plan my trip").serialize()
+    resp = await client.post("/api/messages", json=body)
+    # Acknowledged before the turn ran
+    assert resp.status == 202
+    assert bot.texts == []
+    resp = await client.post("/api/messages", json=body)
+    assert resp.status == 202
+    await asyncio.wait_for(turn_queue.queue.join(), 5)
+    assert bot.texts == ["Plan my trip"]
@@ -0,0 +1,37 @@
+import time
+from types import SimpleNamespace
+
+from botbuilder.core import TurnContext
+from botbuilder.schema import ActivityTypes
+
+from tests.conftest import FakeAgentsClient, NullAdapter, create_bot, message_activity
+
+class SlowThreadsAgentsClient(FakeAgentsClient):
+    def create_thread(self):
+        time.sleep(0.2)
+        self.thread_created = time.perf_counter()
+        return SimpleNamespace(id="thread_slow")
+
+class RecordingAdapter(NullAdapter):
+    def __init__(self):
+        super().__init__()
+        self.activities = []
+
+    async def send_activities(self, context, activities):
+        self.activities += [(time.perf_counter(), activity) for activity in activities]
+        return await super().send_activities(context, activities)
+
+async def test_typing_before_thread_creation():
+    agents_client = SlowThreadsAgentsClient()
+    bot = create_bot(agents_client)
+    adapter = RecordingAdapter()
+    turn_context = TurnContext(adapter, message_activity("Plan my trip to Rome"))
+    await bot.on_turn(turn_context)
+
+    sent_at, typing = adapter.activities[0]
+    assert typing.type == ActivityTypes.typing
+    assert sent_at < agents_client.thread_created
+    # The messages were posted to the thread created during the turn
+    assert agents_client.runs == ["thread_slow"]
+    assert agents_client.messages == ["Plan my trip to Rome"]
+    assert adapter.activities[-1][1].text == agents_client.answer
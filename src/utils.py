@@ -1,39 +1,60 @@
 import os
 import json
+import hashlib
 from azure.ai.projects.operations import AgentsOperations
 from azure.ai.projects.models import CodeInterpreterTool, FileSearchTool, BingGroundingTool
 
 def create_or_update_agent(
         agents_client: AgentsOperations,
-        agent_name: str
+        agent_name: str,
+        model: str = None,
+        with_tools: bool = True,
+        bing_mode: str = "off"
     ) -> str:
     # Create agent if it doesn't exist
     agents = agents_client.list_agents(limit=100)
 
     options = {
         "name": agent_name,
-        "model": os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
+        "model": model or os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
         "instructions": os.getenv("LLM_INSTRUCTIONS"),
-        "tools": [
-            *CodeInterpreterTool().definitions,
-            *FileSearchTool().definitions,
-            # *BingGroundingTool(connection_id=os.getenv("AZURE_BING_CONNECTION_ID")).definitions
-        ],
+        "tools": [],
         "headers": {"x-ms-enable-preview": "true"}
     }
 
-    for tool in os.listdir("tools"):
-        if tool.endswith(".json"):
-            with open(f"tools/{tool}", "r") as f:
+    if with_tools:
+        options["tools"] += [
+            *CodeInterpreterTool().definitions,
+            *FileSearchTool().definitions,
+        ]
+        for tool in os.listdir("tools"):
+            if tool.endswith(".json"):
+                with open(f"tools/{tool}", "r") as f:
+                    options["tools"].append(json.loads(f.read()))
+        # Web search runs in the service with grounding, or in the bot with the bing_query function
+        if bing_mode == "server":
+            options["tools"] += BingGroundingTool(connection_id=os.getenv("AZURE_BING_CONNECTION_ID")).definitions
+        elif bing_mode == "client":
+            with open("tools/BingQuery.txt", "r") as f:
                 options["tools"].append(json.loads(f.read()))
     if agents.has_more:
         raise Exception("Too many agents")
     for agent in agents.data:
-        if agent.name == os.getenv("AZURE_OPENAI_AGENT_NAME"):
+        if agent.name == agent_name:
             options["assistant_id"] = agent.id
             agent = agents_client.update_agent(**options)
             break
     if "assistant_id" not in options:
         agent = agents_client.create_agent(**options)
         options["assistant_id"] = agent.id
-    return options["assistant_id"]
\ No newline at end of file
+    return options["assistant_id"]
+
+def agent_definition_hash(agents_client: AgentsOperations, agent_id: str, instructions: str = None) -> str:
+    # Model, instructions and tools of the agent, plus the instructions runs override them with
+    agent = agents_client.get_agent(agent_id)
+    definition = {
+        "model": agent.model,
+        "instructions": instructions or agent.instructions,
+        "tools": [tool.as_dict() if hasattr(tool, "as_dict") else tool for tool in agent.tools or []],
+    }
+    return hashlib.sha256(json.dumps(definition, sort_keys=True, default=str).encode()).hexdigest()